@@ -1,11 +1,13 @@
-from typing import List, Optional
+from typing import List, Optional, Literal
+from uuid import UUID
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 
 from app.common_types import BBox
 from app.schemas.clustering_profile_schema import ClusteredStopSchema
-from app.schemas.enums import BusDataProvider
+from app.schemas.enums import BusDataProvider, GeometryEncoding, Weekday
 from app.schemas.route import RouteSchema
+from app.schemas.route_geometry import zoom_tolerance
 from app.schemas.stop import StopSchema
 from app.schemas.stops_clustering import StopsClusteringParams, ClusteredCorrespondenceEntry
 
@@ -15,16 +17,71 @@ from app.schemas.stops_clustering import StopsClusteringParams, ClusteredCorresp
 class GetBusDataRequest(BaseModel):
     source: BusDataProvider
     bbox: Optional[BBox] = None
+    # Потоковая передача ответа в формате NDJSON (по одному объекту в строке)
+    stream: bool = False
+    # Формат представления геометрии маршрутов (список узлов или компактное представление)
+    geometry_encoding: GeometryEncoding = GeometryEncoding.NODES
+    # Упрощение геометрии маршрутов: допуск в метрах или уровень масштабирования карты (допуск равен размеру пикселя),
+    # места остановок и препятствия сохраняются
+    tolerance: Optional[float] = Field(None, gt=0)
+    zoom: Optional[int] = Field(None, ge=0, le=22)
+
+    @property
+    def simplification_tolerance(self) -> Optional[float]:
+        """ Допуск упрощения геометрии маршрутов (None - геометрия не упрощается) """
+        if self.tolerance is not None:
+            return self.tolerance
+        if self.zoom is not None:
+            return zoom_tolerance(self.zoom)
+        return None
 
 class GetBusDataResponse(BaseModel):
     routes: List[RouteSchema]
     stops: List[StopSchema]
 
+class BusDataStreamEntry(BaseModel):
+    """ Строка потокового ответа с данными об остановках и маршрутах """
+    type: Literal['stop', 'route']
+    data: StopSchema | RouteSchema
+
+class SyncRoutesResponse(BaseModel):
+    """ Результат инкрементальной синхронизации маршрутов OSM (id маршрутов в локальной базе данных) """
+    updated: List[str]
+    deleted: List[str]
+    failed: List[str]
+    unchanged: int
+
+class DBPoolStatus(BaseModel):
+    """ Состояние пула соединений с базой данных (счётчики событий накапливаются с момента запуска) """
+    pool_size: int
+    max_overflow: int
+    timeout: float
+    checked_in: int
+    checked_out: int
+    overflow: int
+    connections_created: int
+    checkouts: int
+    invalidations: int
+
 class GenerateSpeedProfileRequest(BaseModel):
     name: str
-    routes_ids: List[str]
+    routes_ids: List[UUID]
     speed_data_id: str
 
+class GetSpeedProfileSliceRequest(BaseModel):
+    routes_ids: List[str]
+    weekday: Weekday
+    # Интервал часов (включительно)
+    hour_from: int = Field(0, ge=0, le=23)
+    hour_to: int = Field(23, ge=0, le=23)
+
+    @model_validator(mode='after')
+    def check_hours_interval(self) -> 'GetSpeedProfileSliceRequest':
+        """ Проверка интервала часов (начало интервала не позже его окончания) """
+        if self.hour_from > self.hour_to:
+            raise ValueError('hour_from must not be greater than hour_to')
+        return self
+
 class TruncatedSpeedProfile(BaseModel):
     id: str
     name: str
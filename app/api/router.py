@@ -1,26 +1,107 @@
-from typing import List
+from typing import List, Callable, AsyncIterator, Optional, Any, Awaitable
+from uuid import UUID
 
-from fastapi import APIRouter, Depends, Query, UploadFile, Body
+import msgpack
+
+from fastapi import APIRouter, Depends, Query, UploadFile, Body, Header, Path, HTTPException
+from fastapi.responses import StreamingResponse, Response
+from pydantic import TypeAdapter
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.api_schemas import GetBusDataRequest, GetBusDataResponse, TruncatedSpeedProfile, \
-    GenerateSpeedProfileRequest, GenerateClusteringProfileRequest, ApplyClusteringResponse
-from app.database.database import get_session
-from app.dispatcher.dispatcher import Dispatcher
+    GenerateSpeedProfileRequest, GenerateClusteringProfileRequest, ApplyClusteringResponse, SyncRoutesResponse, \
+    DBPoolStatus, GetSpeedProfileSliceRequest
+from app.database.database import get_session, AsyncSessionFactory, get_pool_status
+from app.dispatcher.dispatcher import Dispatcher, RoutesNotFoundError
+from app.jobs import job_manager
 from app.schemas.clustering_profile_schema import ClusteringDataSchema, ClusteringProfileSchema, \
     TruncatedClusteringProfileSchema
-from app.schemas.route import RouteSchema
-from app.schemas.speed_profile_schema import SpeedProfileSchema, SpeedDataSchema
+from app.schemas.enums import GeometryEncoding, JobType, JobStatus
+from app.schemas.job import JobSchema
+from app.schemas.route import RouteSchema, TruncatedRouteSchema
+from app.schemas.route_geometry import GEOMETRY_ENCODING_CONTEXT_KEY
+from app.schemas.speed_profile_schema import SpeedProfileSchema, SpeedDataSchema, SpeedProfileSliceSchema
 from app.schemas.stop import StopSchema
 
+def ndjson_response(stream: Callable[[Dispatcher], AsyncIterator[str]]) -> StreamingResponse:
+    """ Формирование потокового ответа в формате NDJSON """
+
+    async def content():
+        # Сессия, полученная через зависимость get_session, закрывается до передачи тела потокового ответа,
+        # поэтому на время передачи открывается отдельная сессия
+        async with AsyncSessionFactory() as session:
+            async for line in stream(Dispatcher(session)):
+                yield line
+
+    return StreamingResponse(content(), media_type='application/x-ndjson')
+
+
+def submit_job(job_type: JobType, run: Callable[[Dispatcher], Awaitable[Any]]) -> JobSchema:
+    """ Постановка фоновой задачи в очередь выполнения """
+
+    async def job():
+        # Задача выполняется после передачи ответа на запрос, поэтому для неё открывается отдельная сессия
+        async with AsyncSessionFactory() as session:
+            return await run(Dispatcher(session))
+
+    return job_manager.submit(job_type, job).as_schema()
+
+
+MSGPACK_MEDIA_TYPE = 'application/x-msgpack'
+
+# Адаптеры pydantic для сериализации ответов с учётом формата представления геометрии маршрутов
+bus_data_response_adapter = TypeAdapter(GetBusDataResponse)
+routes_response_adapter = TypeAdapter(List[RouteSchema])
+
+# Результаты фоновых задач и адаптеры pydantic для их сериализации по типам задач
+JobResult = GetBusDataResponse | SpeedProfileSchema | List[TruncatedClusteringProfileSchema] | ClusteringProfileSchema
+job_result_adapters = {
+    JobType.BUS_DATA: bus_data_response_adapter,
+    JobType.SPEED_PROFILE: TypeAdapter(SpeedProfileSchema),
+    JobType.CLUSTERING_PROFILES_GENERATION: TypeAdapter(List[TruncatedClusteringProfileSchema]),
+    JobType.CLUSTERING_PROFILE_REALIZATION: TypeAdapter(ClusteringProfileSchema)
+}
+
+
+def encoded_response(content: Any, adapter: TypeAdapter, geometry_encoding: GeometryEncoding,
+                     accept: Optional[str]) -> Any:
+    """
+    Согласование формата ответа, содержащего маршруты
+
+    При запросе MessagePack (заголовок Accept) ответ упаковывается в MessagePack, геометрия маршрутов при этом
+    по умолчанию представляется массивами разностей координат. При запросе компактного представления геометрии
+    (параметр geometry_encoding) ответ формируется в JSON с компактной геометрией. В остальных случаях ответ
+    возвращается без изменений (сериализуется FastAPI).
+    """
+
+    if accept is not None and MSGPACK_MEDIA_TYPE in accept:
+        if geometry_encoding is GeometryEncoding.NODES:
+            geometry_encoding = GeometryEncoding.DELTA
+        data = adapter.dump_python(content, mode='json', context={GEOMETRY_ENCODING_CONTEXT_KEY: geometry_encoding})
+        return Response(msgpack.packb(data), media_type=MSGPACK_MEDIA_TYPE)
+
+    if geometry_encoding is not GeometryEncoding.NODES:
+        data = adapter.dump_json(content, context={GEOMETRY_ENCODING_CONTEXT_KEY: geometry_encoding})
+        return Response(data, media_type='application/json')
+
+    return content
+
+
 # Группа конечных точек API для блока обработки данных остановок и маршрутов
 bus_data_router = APIRouter(tags=['BusData'], prefix='/bus_data')
 
 @bus_data_router.get('/')
-async def get_bus_data(data_request: GetBusDataRequest = Query(),
+async def get_bus_data(data_request: GetBusDataRequest = Query(), accept: Optional[str] = Header(None),
                        session: AsyncSession = Depends(get_session)) -> GetBusDataResponse:
     """ Получение данных об остановках """
-    return await Dispatcher(session).get_bus_data(data_request.source, data_request.bbox)
+    if data_request.stream:
+        return ndjson_response(lambda dispatcher: dispatcher.stream_bus_data(
+            data_request.source, data_request.bbox, data_request.geometry_encoding,
+            data_request.simplification_tolerance
+        ))
+    bus_data = await Dispatcher(session).get_bus_data(data_request.source, data_request.bbox,
+                                                      data_request.simplification_tolerance)
+    return encoded_response(bus_data, bus_data_response_adapter, data_request.geometry_encoding, accept)
 
 @bus_data_router.get('/stops')
 async def get_bus_stops(data_request: GetBusDataRequest = Query(),
@@ -34,20 +115,37 @@ async def create_bus_stops(stops: List[StopSchema], session: AsyncSession = Depe
     return await Dispatcher(session).create_bus_stops(stops)
 
 @bus_data_router.delete('/stops')
-async def delete_bus_stops(stops_ids: List[str], session: AsyncSession = Depends(get_session)) -> List[StopSchema]:
+async def delete_bus_stops(stops_ids: List[UUID], session: AsyncSession = Depends(get_session)) -> List[StopSchema]:
     """ Удаление записей об остановках в локальной базе данных """
-    return await Dispatcher(session).delete_bus_stops(stops_ids)
+    return await Dispatcher(session).delete_bus_stops([str(stop_id) for stop_id in stops_ids])
 
 @bus_data_router.get('/routes')
-async def get_bus_routes(data_request: GetBusDataRequest = Query(),
+async def get_bus_routes(data_request: GetBusDataRequest = Query(), accept: Optional[str] = Header(None),
                          session: AsyncSession = Depends(get_session)) -> List[RouteSchema]:
     """ Получение данных о маршрутах """
-    return await Dispatcher(session).get_bus_routes(data_request.source, data_request.bbox)
+    if data_request.stream:
+        return ndjson_response(lambda dispatcher: dispatcher.stream_bus_routes(
+            data_request.source, data_request.bbox, data_request.geometry_encoding,
+            data_request.simplification_tolerance
+        ))
+    routes = await Dispatcher(session).get_bus_routes(data_request.source, data_request.bbox,
+                                                      data_request.simplification_tolerance)
+    return encoded_response(routes, routes_response_adapter, data_request.geometry_encoding, accept)
+
+@bus_data_router.get('/tiles/{z}/{x}/{y}.mvt')
+async def get_bus_data_tile(z: int = Path(ge=0, le=22), x: int = Path(ge=0), y: int = Path(ge=0),
+                            session: AsyncSession = Depends(get_session)) -> Response:
+    """ Получение векторной плитки (Mapbox Vector Tile) с данными об остановках, маршрутах и препятствиях """
+    tile = await Dispatcher(session).get_bus_data_tile(z, x, y)
+    return Response(tile, media_type='application/vnd.mapbox-vector-tile')
 
 @bus_data_router.post('/routes_by_id')
-async def get_bus_routes_by_ids(routes_ids: List[str], session: AsyncSession = Depends(get_session)) \
-        -> List[RouteSchema]:
-    return await Dispatcher(session).get_bus_routes_by_ids(routes_ids)
+async def get_bus_routes_by_ids(routes_ids: List[UUID],
+                                geometry_encoding: GeometryEncoding = Query(GeometryEncoding.NODES),
+                                accept: Optional[str] = Header(None),
+                                session: AsyncSession = Depends(get_session)) -> List[RouteSchema]:
+    routes = await Dispatcher(session).get_bus_routes_by_ids([str(route_id) for route_id in routes_ids])
+    return encoded_response(routes, routes_response_adapter, geometry_encoding, accept)
 
 @bus_data_router.post('/routes')
 async def create_bus_routes(routes: List[RouteSchema],
@@ -56,9 +154,15 @@ async def create_bus_routes(routes: List[RouteSchema],
     return await Dispatcher(session).create_bus_routes(routes)
 
 @bus_data_router.delete('/routes')
-async def delete_bus_routes(routes_ids: List[str], session: AsyncSession = Depends(get_session)) -> List[RouteSchema]:
+async def delete_bus_routes(routes_ids: List[UUID],
+                            session: AsyncSession = Depends(get_session)) -> List[TruncatedRouteSchema]:
     """ Удаление записей о маршрутах в локальной базе данных """
-    return await Dispatcher(session).delete_bus_routes(routes_ids)
+    return await Dispatcher(session).delete_bus_routes([str(route_id) for route_id in routes_ids])
+
+@bus_data_router.post('/routes/sync')
+async def sync_osm_routes(session: AsyncSession = Depends(get_session)) -> SyncRoutesResponse:
+    """ Инкрементальная синхронизация маршрутов OSM в локальной базе данных (обновляются только изменённые) """
+    return await Dispatcher(session).sync_osm_routes()
 
 
 # Группа конечных точек API для блока обработки данных загруженности дорог
@@ -84,8 +188,12 @@ async def delete_speed_data(speed_data_id: str, session: AsyncSession = Depends(
 async def generate_speed_profile(data_request: GenerateSpeedProfileRequest,
                                  session: AsyncSession = Depends(get_session)) -> SpeedProfileSchema:
     """ Генерация профиля скорости """
-    return await Dispatcher(session).generate_speed_profile(data_request.name, data_request.routes_ids,
-                                                            data_request.speed_data_id)
+    routes_ids = [str(route_id) for route_id in data_request.routes_ids]
+    try:
+        return await Dispatcher(session).generate_speed_profile(data_request.name, routes_ids,
+                                                                data_request.speed_data_id)
+    except RoutesNotFoundError as e:
+        raise HTTPException(status_code=404, detail={'message': str(e), 'routes_ids': e.routes_ids})
 
 @traffic_flow_router.get('/list')
 async def get_speed_profile_list(session: AsyncSession = Depends(get_session)) -> List[TruncatedSpeedProfile]:
@@ -98,6 +206,14 @@ async def get_speed_profile(speed_profile_id: str,
     """ Получение профиля скорости по идентификатору """
     return await Dispatcher(session).get_speed_profile(speed_profile_id)
 
+@traffic_flow_router.get('/{speed_profile_id}/speeds')
+async def get_speed_profile_slice(speed_profile_id: str, data_request: GetSpeedProfileSliceRequest = Query(),
+                                  session: AsyncSession = Depends(get_session)) -> SpeedProfileSliceSchema | None:
+    """ Получение скоростей сегментов выбранных маршрутов профиля скорости за день недели и интервал часов """
+    return await Dispatcher(session).get_speed_profile_slice(speed_profile_id, data_request.routes_ids,
+                                                             data_request.weekday, data_request.hour_from,
+                                                             data_request.hour_to)
+
 @traffic_flow_router.delete('/{speed_profile_id}')
 async def delete_speed_profile(speed_profile_id: str,
                                session: AsyncSession = Depends(get_session)) -> SpeedProfileSchema | None:
@@ -156,8 +272,81 @@ async def delete_clustering_profile(clustering_profile_id: str,
     """ Удаление профиля кластеризации по идентификатору """
     return await Dispatcher(session).delete_clustering_profile(clustering_profile_id)
 
+# Группа конечных точек API для выполнения длительных операций в фоновом режиме (клиент получает идентификатор задачи
+# и запрашивает её состояние и результат по мере выполнения)
+jobs_router = APIRouter(tags=['Jobs'], prefix='/jobs')
+
+@jobs_router.post('/bus_data')
+async def submit_bus_data_job(data_request: GetBusDataRequest = Query()) -> JobSchema:
+    """ Постановка задачи получения данных об остановках и маршрутах """
+    return submit_job(JobType.BUS_DATA, lambda dispatcher: dispatcher.get_bus_data(
+        data_request.source, data_request.bbox, data_request.simplification_tolerance
+    ))
+
+@jobs_router.post('/speed_profile')
+async def submit_speed_profile_job(data_request: GenerateSpeedProfileRequest) -> JobSchema:
+    """ Постановка задачи генерации профиля скорости """
+    return submit_job(JobType.SPEED_PROFILE, lambda dispatcher: dispatcher.generate_speed_profile(
+        data_request.name, [str(route_id) for route_id in data_request.routes_ids], data_request.speed_data_id
+    ))
+
+@jobs_router.post('/clustering_profiles')
+async def submit_clustering_profiles_job(generate_clustering_profile_request: GenerateClusteringProfileRequest) \
+        -> JobSchema:
+    """ Постановка задачи генерации профилей кластеризации """
+    return submit_job(JobType.CLUSTERING_PROFILES_GENERATION, lambda dispatcher: dispatcher.generate_clustering_profile(
+        generate_clustering_profile_request.name, generate_clustering_profile_request.params
+    ))
+
+@jobs_router.post('/clustering_profile_realization')
+async def submit_clustering_profile_realization_job(clustering_profile: TruncatedClusteringProfileSchema) -> JobSchema:
+    """ Постановка задачи сохранения выбранного профиля кластеризации """
+    return submit_job(JobType.CLUSTERING_PROFILE_REALIZATION,
+                      lambda dispatcher: dispatcher.realize_clustering_profile(clustering_profile))
+
+@jobs_router.get('/list')
+async def get_jobs_list() -> List[JobSchema]:
+    """ Получение списка фоновых задач """
+    return [job.as_schema() for job in job_manager.get_all()]
+
+@jobs_router.get('/{job_id}')
+async def get_job(job_id: str) -> JobSchema | None:
+    """ Получение состояния фоновой задачи по идентификатору """
+    job = job_manager.get(job_id)
+    return job.as_schema() if job is not None else None
+
+@jobs_router.get('/{job_id}/result')
+async def get_job_result(job_id: str, geometry_encoding: GeometryEncoding = GeometryEncoding.NODES,
+                         accept: Optional[str] = Header(None)) -> JobResult | None:
+    """
+    Получение результата фоновой задачи (None, если задача не завершена успешно)
+
+    Формат ответа согласуется так же, как для синхронных конечных точек: результат задачи получения данных
+    об остановках и маршрутах может быть получен в MessagePack и с компактным представлением геометрии маршрутов.
+    """
+    job = job_manager.get(job_id)
+    if job is None or job.status is not JobStatus.COMPLETED:
+        return None
+    return encoded_response(job.result, job_result_adapters[job.type], geometry_encoding, accept)
+
+@jobs_router.delete('/{job_id}')
+async def cancel_job(job_id: str) -> JobSchema | None:
+    """ Отмена фоновой задачи по идентификатору """
+    job = job_manager.cancel(job_id)
+    return job.as_schema() if job is not None else None
+
+# Группа конечных точек API для мониторинга состояния модуля
+instrumentation_router = APIRouter(tags=['Instrumentation'], prefix='/instrumentation')
+
+@instrumentation_router.get('/db_pool')
+async def get_db_pool_status() -> DBPoolStatus:
+    """ Получение состояния пула соединений с базой данных """
+    return DBPoolStatus(**get_pool_status())
+
 # Объединение отдельных групп конечных точек
 router = APIRouter()
 router.include_router(bus_data_router)
 router.include_router(traffic_flow_router)
-router.include_router(stops_clustering)
\ No newline at end of file
+router.include_router(stops_clustering)
+router.include_router(jobs_router)
+router.include_router(instrumentation_router)
\ No newline at end of file
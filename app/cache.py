@@ -0,0 +1,39 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """ Кэш в памяти процесса с ограничением по количеству записей (вытесняются давно не использовавшиеся записи) """
+
+    def __init__(self, max_size: int):
+        """ Инициализация кэша """
+        self.max_size = max_size
+        self.entries: OrderedDict[Hashable, Any] = OrderedDict()
+
+        # Номер поколения кэша увеличивается при каждой очистке: значение, расчёт которого начался до очистки,
+        # в кэш не сохраняется
+        self.generation = 0
+
+    def get(self, key: Hashable) -> Any | None:
+        """ Получение значения из кэша """
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any, generation: int | None = None):
+        """ Сохранение значения в кэш (generation - поколение кэша на момент начала расчёта значения) """
+        if generation is not None and generation != self.generation:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """ Очистка кэша """
+        self.entries.clear()
+        self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self.entries)
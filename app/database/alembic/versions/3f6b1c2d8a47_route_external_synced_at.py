@@ -0,0 +1,28 @@
+"""route external_synced_at
+
+Revision ID: 3f6b1c2d8a47
+Revises: eeaa3a688e32
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6b1c2d8a47'
+down_revision: Union[str, None] = 'eeaa3a688e32'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('routes', sa.Column('external_synced_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('routes', 'external_synced_at')
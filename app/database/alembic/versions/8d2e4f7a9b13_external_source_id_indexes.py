@@ -0,0 +1,29 @@
+"""external_source_id indexes
+
+Revision ID: 8d2e4f7a9b13
+Revises: 3f6b1c2d8a47
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2e4f7a9b13'
+down_revision: Union[str, None] = '3f6b1c2d8a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_stops_source_external_source_id', 'stops', ['source', 'external_source_id'])
+    op.create_index('ix_routes_source_external_source_id', 'routes', ['source', 'external_source_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_routes_source_external_source_id', table_name='routes')
+    op.drop_index('ix_stops_source_external_source_id', table_name='stops')
@@ -0,0 +1,50 @@
+"""unique stop external_source_id
+
+Revision ID: c5a9e1f3d2b8
+Revises: 8d2e4f7a9b13
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a9e1f3d2b8'
+down_revision: Union[str, None] = '8d2e4f7a9b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    # Объединение повторяющихся записей об остановках одного источника данных: ссылки на повторяющиеся записи
+    # заменяются ссылками на одну из них, после чего повторяющиеся записи удаляются
+    op.execute("""
+        CREATE TEMPORARY TABLE stop_duplicates ON COMMIT DROP AS
+        SELECT id, keep_id FROM (
+            SELECT id, first_value(id) OVER (PARTITION BY source, external_source_id ORDER BY id) AS keep_id
+            FROM stops
+            WHERE external_source_id IS NOT NULL
+        ) AS ranked_stops
+        WHERE id != keep_id
+    """)
+    for table, column in [('routes_stops', 'stop_id'), ('route_segments', 'stop_from_id'),
+                          ('route_segments', 'stop_to_id'), ('route_geometry_nodes', 'corresponding_stop_id'),
+                          ('clustering_stops', 'stop_id')]:
+        op.execute(f"""
+            UPDATE {table} SET {column} = stop_duplicates.keep_id
+            FROM stop_duplicates WHERE {table}.{column} = stop_duplicates.id
+        """)
+    op.execute("DELETE FROM stops USING stop_duplicates WHERE stops.id = stop_duplicates.id")
+
+    op.drop_index('ix_stops_source_external_source_id', table_name='stops')
+    op.create_index('ix_stops_source_external_source_id', 'stops', ['source', 'external_source_id'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_stops_source_external_source_id', table_name='stops')
+    op.create_index('ix_stops_source_external_source_id', 'stops', ['source', 'external_source_id'])
@@ -1,16 +1,17 @@
-from typing import List, Sequence
-from uuid import UUID
+from datetime import datetime, timezone
+from typing import List, Sequence, Dict, Tuple
+from uuid import UUID, uuid4
 
-from sqlalchemy import select
+from sqlalchemy import select, delete, func, update, insert, Table, Row
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import noload, load_only, selectinload
 
 from app.database.daos.base_dao import BaseDAO
 from app.database.daos.stop_dao import StopDAO
-from app.database.models import Route, RouteStop, RouteSegment, RouteGeometryNode, RouteObstacleNode, \
-    RouteStopPositionNode
+from app.database.models import Route, RouteStop, RouteSegment, RouteGeometryNode
 from app.schemas.enums import BusDataProvider
 from app.schemas.route import RouteSchema
-from app.schemas.route_geometry import RouteGeometryNodeSchema, RouteObstacleSchema, RouteStopPositionSchema
+from app.schemas.route_geometry import OBSTACLE_CODE, STOP_POSITION_CODE, OBSTACLE_TYPES, NODE_TYPES
 
 
 class RouteDAO(BaseDAO):
@@ -21,86 +22,60 @@ class RouteDAO(BaseDAO):
 
     async def create(self, route_data: RouteSchema, commit=True) -> Route:
         """ Создание записи о маршруте """
+        _routes = await self.__create_routes([route_data], commit)
+        return _routes[0]
 
-        # Создание записи о маршруте
-        _route = Route(
-            name=route_data.name,
-            source=route_data.source.value,
-            external_source_id=str(route_data.id),
-            final_stop_order=route_data.final_stop_order
+    async def create_all(self, routes_data: List[RouteSchema]) -> List[Route]:
+        """ Создание нескольких маршрутов """
+        return await self.__create_routes(routes_data, commit=True)
+
+    async def update(self, _route: Route, route_data: RouteSchema, commit=True) -> Route:
+        """
+        Обновление записи о маршруте с сохранением её идентификатора
+
+        Остановки и геометрия маршрута создаются заново. Сегменты, совпадающие с существующими (по порядку и
+        остановкам), обновляются на месте, поэтому связанные с ними скорости профилей скорости сохраняются.
+        """
+
+        # Обновление записи о маршруте
+        _route.name = route_data.name
+        _route.final_stop_order = route_data.final_stop_order
+        _route.external_synced_at = self.__synced_at(route_data)
+        _route.version += 1
+
+        # Удаление прежних остановок и геометрии маршрута
+        await self.session.execute(delete(RouteStop).where(RouteStop.route_id == _route.id))
+        await self.session.execute(delete(RouteGeometryNode).where(RouteGeometryNode.route_id == _route.id))
+
+        # Формирование строк таблиц остановок, сегментов и геометрии маршрута
+        routes_matched_stops = await self.__resolve_stops([route_data])
+        route_stops_rows, segments_rows, geometry_rows = self.__route_rows(
+            _route.id, route_data, routes_matched_stops[0]
         )
-        self.session.add(_route)
-
-        # Создание остановок
-        db_stops = []
-        matched_stops = {}
-        for i, stop in enumerate(route_data.stops):
-            if stop.source is BusDataProvider.LOCAL:
-                _stop = await StopDAO(self.session).get_by_id(stop.id)
-            else:
-                _stop = await StopDAO(self.session).create(stop, commit=False)
-            db_stops.append(_stop)
-            matched_stops[str(stop.id)] = _stop
-        await self.session.flush()
-        await self.session.refresh(_route)
-        for _stop in db_stops:
-            await self.session.refresh(_stop)
-
-        # Создание сопоставлений маршрут - остановки
-        for i, _stop in enumerate(db_stops):
-            _route_stop = RouteStop(
-                route_id=_route.id,
-                stop_id=_stop.id,
-                stop_order=i
-            )
-            self.session.add(_route_stop)
-
-        # Создание сегментов маршрута
-        for i, route_segment in enumerate(route_data.segments):
-            _stop_from = matched_stops[route_segment.stop_from_id]
-            _stop_to = matched_stops[route_segment.stop_to_id]
-            _route_segment = RouteSegment(
-                route_id=_route.id,
-                stop_from_id=_stop_from.id,
-                stop_to_id=_stop_to.id,
-                segment_order=i,
-                distance=route_segment.distance,
-                crossings=route_segment.crossings,
-                traffic_signals=route_segment.traffic_signals,
-                speedbumps=route_segment.speedbumps,
-                roundabouts=route_segment.roundabouts
+
+        # Сегменты, совпадающие с существующими по порядку и остановкам, обновляются на месте, остальные существующие
+        # сегменты удаляются
+        existing_segments = {
+            (_segment.segment_order, _segment.stop_from_id, _segment.stop_to_id): _segment
+            for _segment in _route.segments
+        }
+        new_segments_rows = []
+        for segment_row in segments_rows:
+            _segment = existing_segments.pop(
+                (segment_row['segment_order'], segment_row['stop_from_id'], segment_row['stop_to_id']), None
             )
-            self.session.add(_route_segment)
-
-        # Создание геометрии маршрута
-        for i, node in enumerate(route_data.geometry):
-            if type(node) is RouteGeometryNodeSchema:
-                _node = RouteGeometryNode(
-                    route_id=_route.id,
-                    node_order=i,
-                    lon=node.lon,
-                    lat=node.lat,
-                )
-                self.session.add(_node)
-            elif type(node) is RouteObstacleSchema:
-                _node = RouteObstacleNode(
-                    route_id=_route.id,
-                    node_order=i,
-                    lon=node.lon,
-                    lat=node.lat,
-                    obstacle_type=node.obstacle_type.value
-                )
-                self.session.add(_node)
-            elif type(node) is RouteStopPositionSchema:
-                _stop = matched_stops[node.corresponding_stop_id]
-                _node = RouteStopPositionNode(
-                    route_id=_route.id,
-                    node_order=i,
-                    lon=node.lon,
-                    lat=node.lat,
-                    corresponding_stop_id=_stop.id
-                )
-                self.session.add(_node)
+            if _segment is None:
+                new_segments_rows.append(segment_row)
+                continue
+            for field in self.SEGMENT_METRICS:
+                setattr(_segment, field, segment_row[field])
+        for _segment in existing_segments.values():
+            await self.session.delete(_segment)
+        await self.session.flush()
+
+        await self.__insert_rows(RouteStop.__table__, route_stops_rows)
+        await self.__insert_rows(RouteSegment.__table__, new_segments_rows)
+        await self.__insert_rows(RouteGeometryNode.__table__, geometry_rows)
 
         if commit:
             await self.session.commit()
@@ -109,28 +84,231 @@ class RouteDAO(BaseDAO):
         await self.session.refresh(_route)
         return _route
 
-    async def create_all(self, routes_data: List[RouteSchema]) -> List[Route]:
-        """ Создание нескольких маршрутов """
-        _routes = []
-        for route_data in routes_data:
-            _route = await self.create(route_data, commit=False)
-            _routes.append(_route)
-        await self.session.commit()
-        for _route in _routes:
-            await self.session.refresh(_route)
-        return _routes
-
-    async def delete_all(self, routes_ids: List[str]) -> List[Route]:
-        """ Удаление всех маршрутов из списка """
-        _routes = []
-        for route_id in routes_ids:
-            _route = await self.delete_by_id(route_id)
-            _routes.append(_route)
-        return _routes
+    # Показатели сегмента маршрута, рассчитываемые при построении маршрута
+    SEGMENT_METRICS = ('distance', 'crossings', 'traffic_signals', 'speedbumps', 'roundabouts')
+
+    async def __create_routes(self, routes_data: List[RouteSchema], commit: bool) -> List[Route]:
+        """
+        Создание записей о нескольких маршрутах
+
+        Записи создаются множественными вставками (по одному запросу на таблицу для всех маршрутов) без создания
+        объектов ORM для каждой строки. Идентификаторы маршрутов и новых остановок генерируются заранее, поэтому
+        строки зависимых таблиц формируются без промежуточных обращений к базе данных, а созданные маршруты
+        загружаются одним запросом.
+        """
+
+        # Сопоставление остановок маршрутов с записями об остановках
+        routes_matched_stops = await self.__resolve_stops(routes_data)
+
+        # Формирование строк таблиц маршрутов, остановок, сегментов и геометрии маршрутов
+        routes_rows, route_stops_rows, segments_rows, geometry_rows = [], [], [], []
+        for route_data, matched_stops in zip(routes_data, routes_matched_stops):
+            route_id = uuid4()
+            routes_rows.append({
+                'id': route_id,
+                'name': route_data.name,
+                'source': route_data.source.value,
+                'external_source_id': str(route_data.id),
+                'final_stop_order': route_data.final_stop_order,
+                'external_synced_at': self.__synced_at(route_data)
+            })
+            route_rows = self.__route_rows(route_id, route_data, matched_stops)
+            route_stops_rows.extend(route_rows[0])
+            segments_rows.extend(route_rows[1])
+            geometry_rows.extend(route_rows[2])
+
+        # Вставка строк (в порядке зависимостей внешних ключей)
+        await self.__insert_rows(Route.__table__, routes_rows)
+        await self.__insert_rows(RouteStop.__table__, route_stops_rows)
+        await self.__insert_rows(RouteSegment.__table__, segments_rows)
+        await self.__insert_rows(RouteGeometryNode.__table__, geometry_rows)
+
+        if commit:
+            await self.session.commit()
+        else:
+            await self.session.flush()
+
+        # Загрузка созданных маршрутов (в порядке создания)
+        routes_ids = [route_row['id'] for route_row in routes_rows]
+        _routes = {
+            _route.id: _route
+            for _route in (await self.session.execute(select(Route).where(Route.id.in_(routes_ids)))).scalars()
+        }
+        return [_routes[route_id] for route_id in routes_ids]
+
+    async def __resolve_stops(self, routes_data: List[RouteSchema]) -> List[Dict[str, UUID]]:
+        """
+        Сопоставление остановок маршрутов с записями об остановках
+
+        Остановки разрешаются сразу для всех маршрутов: остановки локальной базы данных запрашиваются одним запросом,
+        а остановки внешних источников данных (общие для нескольких маршрутов - однократно) создаются или обновляются
+        по внешнему идентификатору. В качестве результата возвращаются соответствия id остановки схемы -> id записи
+        об остановке для каждого маршрута.
+        """
+
+        all_stops = [stop for route_data in routes_data for stop in route_data.stops]
+
+        # Запрос остановок локальной базы данных
+        local_stops_ids = list({str(stop.id) for stop in all_stops if stop.source is BusDataProvider.LOCAL})
+        local_stops = {str(_stop.id): _stop.id for _stop in await StopDAO(self.session).get_all_by_ids(local_stops_ids)}
+
+        # Создание или обновление остановок внешних источников данных
+        external_stops = [stop for stop in all_stops if stop.source is not BusDataProvider.LOCAL]
+        external_stops_ids = await StopDAO(self.session).upsert_all(external_stops)
+        external_stops = {str(stop.id): stop_id for stop, stop_id in zip(external_stops, external_stops_ids)}
+
+        return [
+            {
+                str(stop.id): local_stops[str(stop.id)] if stop.source is BusDataProvider.LOCAL
+                else external_stops[str(stop.id)]
+                for stop in route_data.stops
+            }
+            for route_data in routes_data
+        ]
+
+    def __route_rows(self, route_id: UUID, route_data: RouteSchema, matched_stops: Dict[str, UUID]) \
+            -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        """ Формирование строк таблиц остановок, сегментов и геометрии маршрута """
+
+        # Сопоставления маршрут - остановки
+        route_stops_rows = [
+            {'id': uuid4(), 'route_id': route_id, 'stop_id': matched_stops[str(stop.id)], 'stop_order': i}
+            for i, stop in enumerate(route_data.stops)
+        ]
+
+        # Сегменты маршрута
+        segments_rows = [
+            {
+                'id': uuid4(),
+                'route_id': route_id,
+                'stop_from_id': matched_stops[route_segment.stop_from_id],
+                'stop_to_id': matched_stops[route_segment.stop_to_id],
+                'segment_order': i,
+                **{field: getattr(route_segment, field) for field in self.SEGMENT_METRICS}
+            }
+            for i, route_segment in enumerate(route_data.segments)
+        ]
+
+        # Геометрия маршрута (непосредственно из массивов геометрии, все узлы хранятся в одной таблице)
+        geometry = route_data.geometry
+        geometry_rows = [
+            {
+                'id': uuid4(),
+                'route_id': route_id,
+                'node_order': i,
+                'lat': lat,
+                'lon': lon,
+                'type': NODE_TYPES[node_type].value,
+                'obstacle_type': OBSTACLE_TYPES[obstacle_type].value if node_type == OBSTACLE_CODE else None,
+                'corresponding_stop_id': matched_stops[stop_ref] if node_type == STOP_POSITION_CODE else None
+            }
+            for i, (lat, lon, node_type, obstacle_type, stop_ref) in enumerate(zip(
+                geometry.lat.tolist(), geometry.lon.tolist(), geometry.node_type.tolist(),
+                geometry.obstacle_type.tolist(), geometry.stop_ref))
+        ]
+
+        return route_stops_rows, segments_rows, geometry_rows
+
+    async def __insert_rows(self, table: Table, rows: List[Dict]):
+        """ Множественная вставка строк в таблицу """
+        if len(rows) > 0:
+            await self.session.execute(insert(table), rows)
+
+    @staticmethod
+    def __synced_at(route_data: RouteSchema) -> datetime | None:
+        """ Момент синхронизации маршрута с внешним источником данных (только для маршрутов OSM) """
+        if route_data.source is BusDataProvider.OSM:
+            return datetime.now(timezone.utc)
+        return None
+
+    async def delete_all(self, routes_ids: List[str], commit=True) -> List[Row]:
+        """
+        Удаление всех маршрутов из списка одним запросом
+
+        Остановки, сегменты и геометрия маршрутов удаляются каскадно на стороне базы данных. Возвращаются только
+        основные поля удалённых записей (без загрузки геометрии).
+        """
+        routes_ids = [UUID(route_id) for route_id in routes_ids]
+        stmt = delete(Route).where(Route.id.in_(routes_ids)).returning(
+            Route.id, Route.source, Route.external_source_id, Route.name
+        )
+        deleted_routes = {row.id: row for row in await self.session.execute(stmt)}
+        if commit:
+            await self.session.commit()
+        return [deleted_routes[route_id] for route_id in routes_ids if route_id in deleted_routes]
 
     async def get_all_by_ids(self, routes_ids: List[str]) -> Sequence[Route]:
         """ Получение нескольких маршрутов по списку идентификаторов """
         routes_ids = [UUID(route_id) for route_id in routes_ids]
-        stmt = select(Route).where(Route.id.in_(routes_ids))
+        # Записи, уже загруженные в сессию, обновляются (данные могли быть изменены запросами без участия ORM)
+        stmt = select(Route).where(Route.id.in_(routes_ids)).execution_options(populate_existing=True)
+        res = await self.session.execute(stmt)
+        return res.scalars().all()
+
+    async def get_all_with_geometry_by_ids(self, routes_ids: List[str]) -> Sequence[Route]:
+        """ Получение нескольких маршрутов по списку идентификаторов (только геометрия и сегменты, без остановок) """
+        routes_ids = [UUID(route_id) for route_id in routes_ids]
+
+        # Загружаются только поля, необходимые для преобразования маршрутов в схемы и сохранения скоростей сегментов
+        # (поля узлов-наследников RouteGeometryNode загружаются вместе с полями базового класса)
+        stmt = select(Route).where(Route.id.in_(routes_ids)).options(
+            load_only(Route.id, Route.name, Route.external_source_id, Route.final_stop_order),
+            noload(Route.stops),
+            selectinload(Route.segments).load_only(
+                RouteSegment.id, RouteSegment.stop_from_id, RouteSegment.stop_to_id, RouteSegment.segment_order,
+                RouteSegment.distance, RouteSegment.crossings, RouteSegment.traffic_signals, RouteSegment.speedbumps,
+                RouteSegment.roundabouts
+            ),
+            selectinload(Route.geometry).load_only(RouteGeometryNode.lat, RouteGeometryNode.lon, RouteGeometryNode.type)
+        )
+        res = await self.session.execute(stmt)
+        return res.scalars().all()
+
+    async def get_versions(self, routes_ids: List[str] | None = None) -> Sequence[Row]:
+        """ Получение id и версий записей о маршрутах (всех маршрутов или маршрутов из списка) """
+        stmt = select(Route.id, Route.version)
+        if routes_ids is not None:
+            stmt = stmt.where(Route.id.in_([UUID(route_id) for route_id in routes_ids]))
+        return (await self.session.execute(stmt)).all()
+
+    async def get_versions_by_external_ids(self, external_ids: List[str], source: BusDataProvider) -> Sequence[Row]:
+        """ Получение id, версий и внешних идентификаторов маршрутов по идентификаторам внешнего источника данных """
+        if len(external_ids) == 0:
+            return []
+        stmt = select(Route.id, Route.version, Route.external_source_id).where(
+            Route.source == source.value, Route.external_source_id.in_(external_ids)
+        )
+        return (await self.session.execute(stmt)).all()
+
+    async def get_all_by_external_ids(self, external_ids: List[str], source: BusDataProvider) -> Sequence[Route]:
+        """ Получение нескольких маршрутов по списку идентификаторов внешнего источника данных """
+        if len(external_ids) == 0:
+            return []
+        stmt = select(Route).where(Route.source == source.value, Route.external_source_id.in_(external_ids))
         res = await self.session.execute(stmt)
         return res.scalars().all()
+
+    async def get_external_routes_sync_state(self, source: BusDataProvider) -> Sequence[Tuple[UUID, str, datetime]]:
+        """ Получение внешних идентификаторов и моментов синхронизации маршрутов внешнего источника данных """
+        stmt = select(Route.id, Route.external_source_id, Route.external_synced_at).where(
+            Route.source == source.value,
+            Route.external_source_id.is_not(None)
+        )
+        res = await self.session.execute(stmt)
+        return res.tuples().all()
+
+    async def get_geometry_bbox(self, routes_ids: List[UUID]) -> Tuple[float, float, float, float] | None:
+        """ Получение ограничивающей рамки геометрии нескольких маршрутов в формате (lon1, lat1, lon2, lat2) """
+        stmt = select(
+            func.min(RouteGeometryNode.lon), func.min(RouteGeometryNode.lat),
+            func.max(RouteGeometryNode.lon), func.max(RouteGeometryNode.lat)
+        ).where(RouteGeometryNode.route_id.in_(routes_ids))
+        bbox = (await self.session.execute(stmt)).one()
+        return None if bbox[0] is None else tuple(bbox)
+
+    async def set_synced_at(self, routes_ids: List[UUID], synced_at: datetime, commit=True):
+        """ Установка момента синхронизации нескольких маршрутов с внешним источником данных """
+        stmt = update(Route).where(Route.id.in_(routes_ids)).values(external_synced_at=synced_at)
+        await self.session.execute(stmt)
+        if commit:
+            await self.session.commit()
@@ -1,10 +1,11 @@
+from typing import Sequence
 from uuid import UUID
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database.daos.base_dao import BaseDAO
 from app.database.daos.route_dao import RouteDAO
-from app.database.models import SpeedProfile, SegmentSpeed
+from app.database.models import SpeedProfile, SegmentSpeed, Route
 from app.schemas.speed_profile_schema import RouteIdToWeekday
 
 
@@ -14,8 +15,14 @@ class SpeedProfileDAO(BaseDAO):
     def __init__(self, session: AsyncSession):
         super().__init__(session, SpeedProfile)
 
-    async def create(self, name: str, routes: RouteIdToWeekday, speed_data_id: str) -> SpeedProfile:
-        """ Создание записи о профиле скорости """
+    async def create(self, name: str, routes: RouteIdToWeekday, speed_data_id: str,
+                     _routes: Sequence[Route] | None = None) -> SpeedProfile:
+        """ Создание записи о профиле скорости (_routes - ранее загруженные записи о маршрутах профиля) """
+
+        # Загрузка записей о маршрутах (с сегментами) одним запросом, если они не были переданы
+        if _routes is None:
+            _routes = await RouteDAO(self.session).get_all_with_geometry_by_ids(list(routes.keys()))
+        _routes = {str(_route.id): _route for _route in _routes}
 
         # Создание записи о профиле скорости
         _speed_profile = SpeedProfile(
@@ -28,7 +35,7 @@ class SpeedProfileDAO(BaseDAO):
 
         # Создание записей о скоростях сегментов маршрутов
         for route_id in routes:
-            route = await RouteDAO(self.session).get_by_id(route_id)
+            route = _routes[route_id]
             for i, route_segment in enumerate(route.segments):
                 for j, weekday in enumerate(routes[route_id].keys()):
                     for hour in routes[route_id][weekday].keys():
@@ -1,11 +1,13 @@
-from typing import List, Dict, Sequence
-from uuid import UUID
+from typing import List, Sequence
+from uuid import UUID, uuid4
 
-from sqlalchemy import select
+from sqlalchemy import select, delete, update, Table, Insert, Row
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database.daos.base_dao import BaseDAO
-from app.database.models import Stop
+from app.database.models import Stop, Route, RouteStop
 from app.schemas.enums import BusDataProvider
 from app.schemas.stop import StopSchema
 
@@ -16,38 +18,115 @@ class StopDAO(BaseDAO):
     def __init__(self, session: AsyncSession):
         super().__init__(session, Stop)
 
+    # Количество строк в одном запросе множественной вставки (ограничение количества параметров запроса)
+    UPSERT_BATCH_SIZE = 1000
+
     async def create(self, stop_data: StopSchema, commit=True) -> Stop:
-        """ Создание записи об остановке """
-        _stop = Stop(
-            name=stop_data.name,
-            source=stop_data.source.value,
-            external_source_id=str(stop_data.id),
-            lon=stop_data.lon,
-            lat=stop_data.lat,
-        )
-        self.session.add(_stop)
+        """ Создание записи об остановке (существующая запись с тем же внешним идентификатором обновляется) """
+        _stops = await self.create_all([stop_data], commit)
+        return _stops[0]
+
+    async def create_all(self, stops_data: List[StopSchema], commit=True) -> List[Stop]:
+        """ Создание записей для всех остановок из списка (с обновлением существующих записей) """
+        stops_ids = await self.upsert_all(stops_data)
         if commit:
             await self.session.commit()
-        return _stop
+        else:
+            await self.session.flush()
+        _stops = {_stop.id: _stop for _stop in await self.get_all_by_ids([str(stop_id) for stop_id in stops_ids])}
+        return [_stops[stop_id] for stop_id in stops_ids]
+
+    async def upsert_all(self, stops_data: List[StopSchema]) -> List[UUID]:
+        """
+        Создание или обновление записей об остановках по паре (источник данных, внешний идентификатор)
+
+        Каждая остановка записывается однократно, даже если встречается в списке несколько раз, а существующие записи
+        обновляются на месте, поэтому повторный импорт одних и тех же данных не создаёт новых записей. В качестве
+        результата возвращаются id записей в порядке следования остановок в списке.
+        """
 
-    async def create_all(self, stops_data: List[StopSchema]) -> List[Stop]:
-        """ Создание записей для всех остановок из списка """
-        _stops = []
+        # Формирование строк (по одной строке на каждую остановку)
+        rows = {}
         for stop_data in stops_data:
-            _stop = await self.create(stop_data, commit=False)
-            _stops.append(_stop)
+            rows.setdefault((stop_data.source.value, str(stop_data.id)), {
+                'id': uuid4(),
+                'name': stop_data.name,
+                'source': stop_data.source.value,
+                'external_source_id': str(stop_data.id),
+                'lon': stop_data.lon,
+                'lat': stop_data.lat
+            })
+        rows = list(rows.values())
+
+        # Множественная вставка с обновлением существующих записей. Существующие записи обновляются, только если данные
+        # остановки изменились, поэтому запрос возвращает id новых и изменённых записей (новые записи отличаются
+        # совпадением id с id строки), а id неизменённых записей запрашиваются отдельно
+        stops_table = Stop.__table__
+        stops_ids = {}
+        changed_stops_ids = []
+        for i in range(0, len(rows), self.UPSERT_BATCH_SIZE):
+            batch = rows[i:i + self.UPSERT_BATCH_SIZE]
+            stmt = self.__insert(stops_table).values(batch)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['source', 'external_source_id'],
+                set_={'name': stmt.excluded.name, 'lon': stmt.excluded.lon, 'lat': stmt.excluded.lat},
+                where=(
+                    stops_table.c.name.is_distinct_from(stmt.excluded.name) |
+                    stops_table.c.lon.is_distinct_from(stmt.excluded.lon) |
+                    stops_table.c.lat.is_distinct_from(stmt.excluded.lat)
+                )
+            ).returning(stops_table.c.id, stops_table.c.source, stops_table.c.external_source_id)
+            rows_ids = {(row['source'], row['external_source_id']): row['id'] for row in batch}
+            for stop_id, source, external_source_id in await self.session.execute(stmt):
+                stops_ids[(source, external_source_id)] = stop_id
+                if stop_id != rows_ids[(source, external_source_id)]:
+                    changed_stops_ids.append(stop_id)
+
+            # Получение id неизменённых записей
+            unchanged_keys = [key for key in rows_ids if key not in stops_ids]
+            for source in {source for source, _ in unchanged_keys}:
+                stmt = select(stops_table.c.id, stops_table.c.source, stops_table.c.external_source_id).where(
+                    stops_table.c.source == source,
+                    stops_table.c.external_source_id.in_([
+                        external_source_id for key_source, external_source_id in unchanged_keys if key_source == source
+                    ])
+                )
+                for stop_id, stop_source, external_source_id in await self.session.execute(stmt):
+                    stops_ids[(stop_source, external_source_id)] = stop_id
+
+        # Версии маршрутов, включающих изменённые остановки, увеличиваются (новые остановки ещё не входят в маршруты,
+        # а неизменённые не влияют на данные маршрутов, поэтому повторный импорт не приводит к инвалидации кэша)
+        await self.__increment_routes_versions(changed_stops_ids)
+
+        return [stops_ids[(stop_data.source.value, str(stop_data.id))] for stop_data in stops_data]
+
+    def __insert(self, table: Table) -> Insert:
+        """ Создание запроса вставки с поддержкой ON CONFLICT для диалекта базы данных сессии """
+        if self.session.bind.dialect.name == 'sqlite':
+            return sqlite_insert(table)
+        return postgresql_insert(table)
+
+    async def __increment_routes_versions(self, stops_ids: List[UUID]):
+        """ Увеличение версий записей о маршрутах, включающих остановки из списка """
+        if len(stops_ids) == 0:
+            return
+        routes_ids = select(RouteStop.route_id).where(RouteStop.stop_id.in_(stops_ids))
+        routes_table = Route.__table__
+        await self.session.execute(
+            update(routes_table).where(routes_table.c.id.in_(routes_ids)).values(version=routes_table.c.version + 1)
+        )
+
+    async def delete_all(self, stops_ids: List[str]) -> List[Row]:
+        """ Удаление всех остановок из списка одним запросом (возвращаются поля удалённых записей) """
+        stops_ids = [UUID(stop_id) for stop_id in stops_ids]
+        # Остановки удаляются из включающих их маршрутов, поэтому версии этих маршрутов увеличиваются
+        await self.__increment_routes_versions(stops_ids)
+        stmt = delete(Stop).where(Stop.id.in_(stops_ids)).returning(
+            Stop.id, Stop.source, Stop.external_source_id, Stop.name, Stop.lat, Stop.lon
+        )
+        deleted_stops = {row.id: row for row in await self.session.execute(stmt)}
         await self.session.commit()
-        for _stop in _stops:
-            await self.session.refresh(_stop)
-        return _stops
-
-    async def delete_all(self, stops_ids: List[str]) -> List[Stop]:
-        """ Удаление всех остановок из списка """
-        _stops = []
-        for stop_id in stops_ids:
-            _stop = await self.delete_by_id(stop_id)
-            _stops.append(_stop)
-        return _stops
+        return [deleted_stops[stop_id] for stop_id in stops_ids if stop_id in deleted_stops]
 
     async def get_all_by_ids(self, stops_ids: List[str]) -> Sequence[Stop]:
         """ Получение нескольких остановок по списку идентификаторов """
@@ -55,3 +134,11 @@ class StopDAO(BaseDAO):
         stmt = select(Stop).where(Stop.id.in_(stops_ids))
         res = await self.session.execute(stmt)
         return res.scalars().all()
+
+    async def get_all_by_external_ids(self, external_ids: List[str], source: BusDataProvider) -> Sequence[Stop]:
+        """ Получение нескольких остановок по списку идентификаторов внешнего источника данных """
+        if len(external_ids) == 0:
+            return []
+        stmt = select(Stop).where(Stop.source == source.value, Stop.external_source_id.in_(external_ids))
+        res = await self.session.execute(stmt)
+        return res.scalars().all()
@@ -1,11 +1,36 @@
-from typing import AsyncGenerator
+from collections import Counter
+from typing import AsyncGenerator, Dict
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 
 from config import app_config
 
-engine = create_async_engine(url=app_config.POSTGRES_URL.unicode_string(), echo=False)
+# Пул соединений с базой данных. Соединения проверяются перед выдачей из пула (pre-ping) и пересоздаются по истечении
+# времени жизни, чтобы не получать разорванные сервером или балансировщиком соединения. Размер кэша подготовленных
+# запросов задаётся как для asyncpg, так и для диалекта SQLAlchemy (значение 0 отключает кэш, что необходимо при
+# работе через pgbouncer в режиме пула транзакций)
+engine = create_async_engine(
+    url=app_config.POSTGRES_URL.unicode_string(),
+    echo=False,
+    pool_size=app_config.DB_POOL_SIZE,
+    max_overflow=app_config.DB_MAX_OVERFLOW,
+    pool_timeout=app_config.DB_POOL_TIMEOUT,
+    pool_recycle=app_config.DB_POOL_RECYCLE,
+    pool_pre_ping=app_config.DB_POOL_PRE_PING,
+    connect_args={
+        'statement_cache_size': app_config.DB_STATEMENT_CACHE_SIZE,
+        'prepared_statement_cache_size': app_config.DB_STATEMENT_CACHE_SIZE
+    }
+)
+
+# Счётчики событий пула соединений (создание, выдача и аннулирование соединений) с момента запуска приложения
+pool_events = Counter()
+
+for pool_event in ('connect', 'checkout', 'invalidate'):
+    event.listen(engine.sync_engine, pool_event, lambda *_, name=pool_event: pool_events.update([name]))
+
 AsyncSessionFactory = async_sessionmaker(
     autocommit=False,
     autoflush=False,
@@ -19,3 +44,18 @@ Base = declarative_base()
 async def get_session() -> AsyncGenerator:
     async with AsyncSessionFactory() as session:
         yield session
+
+def get_pool_status() -> Dict[str, int | float]:
+    """ Текущее состояние пула соединений с базой данных """
+    pool = engine.pool
+    return {
+        'pool_size': pool.size(),
+        'max_overflow': app_config.DB_MAX_OVERFLOW,
+        'timeout': pool.timeout(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'connections_created': pool_events['connect'],
+        'checkouts': pool_events['checkout'],
+        'invalidations': pool_events['invalidate']
+    }
@@ -1,8 +1,9 @@
+from datetime import datetime
 from typing import Optional, List
 from uuid import UUID, uuid4
 
 import sqlalchemy.types
-from sqlalchemy import CheckConstraint, asc
+from sqlalchemy import CheckConstraint, Index, asc
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database.database import Base
@@ -15,6 +16,8 @@ class Route(Base):
     __tablename__ = 'routes'
     __table_args__ = (
         CheckConstraint('final_stop_order >= 0', name='final_stop_order_constraint'),
+        # Поиск маршрутов по идентификаторам внешнего источника данных (сопоставление с данными OSM)
+        Index('ix_routes_source_external_source_id', 'source', 'external_source_id')
     )
 
     id: Mapped[UUID] = mapped_column(sqlalchemy.types.Uuid, primary_key=True, default=uuid4)
@@ -22,6 +25,12 @@ class Route(Base):
     external_source_id: Mapped[Optional[str]]
     name: Mapped[str]
     final_stop_order: Mapped[int]
+    # Момент последней синхронизации маршрута с внешним источником данных (изменения OSM после этого момента
+    # приводят к перестроению маршрута при инкрементальной синхронизации)
+    external_synced_at: Mapped[Optional[datetime]] = mapped_column(sqlalchemy.types.DateTime(timezone=True))
+    # Версия записи о маршруте увеличивается при каждом изменении маршрута или его остановок (используется как часть
+    # ключа кэша маршрутов)
+    version: Mapped[int] = mapped_column(default=1, server_default='1')
 
     stops: Mapped[List['RouteStop']] = relationship(lazy='selectin', order_by='asc(RouteStop.stop_order)')
     segments: Mapped[List['RouteSegment']] = relationship(lazy='selectin', order_by='asc(RouteSegment.segment_order)')
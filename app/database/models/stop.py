@@ -2,7 +2,7 @@ from typing import Optional
 from uuid import UUID, uuid4
 
 import sqlalchemy.types
-from sqlalchemy import CheckConstraint
+from sqlalchemy import CheckConstraint, Index
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.database.database import Base
@@ -18,7 +18,10 @@ class Stop(Base):
     # Определение ограничений
     __table_args__ = (
         CheckConstraint('-90 <= lat and lat <= 90', name='lat_constraint'),
-        CheckConstraint('-180 <= lon and lon <= 180', name='lon_constraint')
+        CheckConstraint('-180 <= lon and lon <= 180', name='lon_constraint'),
+        # Поиск остановок по идентификаторам внешнего источника данных (сопоставление с данными OSM) и
+        # исключение повторяющихся записей об остановках одного источника
+        Index('ix_stops_source_external_source_id', 'source', 'external_source_id', unique=True)
     )
 
     # Поля таблицы
@@ -1,12 +1,15 @@
 import ast
+import dataclasses
 import json
 import os
-from typing import Optional, List
+from typing import Optional, List, AsyncIterator, Hashable, Callable, Awaitable, Any
 
 from fastapi import File
 from sqlalchemy import select, asc
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.api_schemas import GetBusDataResponse, TruncatedSpeedProfile, ApplyClusteringResponse
+from app.api.api_schemas import GetBusDataResponse, TruncatedSpeedProfile, ApplyClusteringResponse, \
+    BusDataStreamEntry, SyncRoutesResponse
 from app.common_types import BBox
 from app.database.daos.base_dao import BaseDAO
 from app.database.daos.clustering_profile_dao import ClusteringProfileDAO
@@ -16,18 +19,36 @@ from app.database.daos.stop_dao import StopDAO
 from app.database.models import RouteSegment, SegmentSpeed, SpeedData, ClusteringData
 from app.schemas.clustering_profile_schema import ClusteringDataSchema, ClusteringProfileSchema, \
     TruncatedClusteringProfileSchema, ClusteredStopSchema
-from app.schemas.enums import BusDataProvider, Weekday
-from app.schemas.route import RouteSchema
-from app.schemas.speed_profile_schema import SpeedProfileSchema, SpeedDataSchema
+from app.schemas.enums import BusDataProvider, Weekday, GeometryEncoding
+from app.schemas.route import RouteSchema, TruncatedRouteSchema
+from app.schemas.route_geometry import GEOMETRY_ENCODING_CONTEXT_KEY
+from app.schemas.speed_profile_schema import SpeedProfileSchema, SpeedDataSchema, SpeedProfileSliceSchema
 from app.schemas.stop import StopSchema
 from app.schemas.stops_clustering import StopsClusteringParams, CorrespondenceNode, CorrespondenceEntry, \
     ClusteredCorrespondenceEntry
-from app.services.bus_data.local.local_bus_data_provider import LocalBusDataProvider
+from app.services.bus_data.geometry_simplification import simplify_route, simplify_routes
+from app.services.bus_data.local.local_bus_data_provider import LocalBusDataProvider, route_cache
 from app.services.bus_data.osm.osm_bus_data_provider import OSMBusDataProvider
+from app.services.bus_data.osm.osm_routes_synchronizer import OSMRoutesSynchronizer
+from app.services.bus_data.tiles.vector_tiles import vector_tile_cache
 from app.services.stops_clustering.stops_clustering_provider import StopsClusteringProvider
+from app.services.traffic_flow.speed_profile_arrays import SpeedProfileArrays, speed_profile_cache
 from app.services.traffic_flow.tomtom.tomtom_traffic_flow_provider import TomtomTrafficFlowProvider
+from app.single_flight import SingleFlight
 from config import SRC_PATH
 
+# Выполняющиеся в данный момент ресурсоёмкие операции (одновременные одинаковые запросы получают результат одного
+# выполнения операции)
+dispatcher_flights = SingleFlight()
+
+
+class RoutesNotFoundError(ValueError):
+    """ Исключение: часть запрошенных маршрутов отсутствует в локальной базе данных """
+
+    def __init__(self, routes_ids: List[str]):
+        super().__init__(f'Non-existing routes: {", ".join(routes_ids)}')
+        self.routes_ids = routes_ids
+
 
 class Dispatcher:
     """ Класс узла диспетчеризации """
@@ -35,72 +56,134 @@ class Dispatcher:
     def __init__(self, session):
         self.session = session
 
-    async def get_bus_data(self, source: BusDataProvider, bbox: Optional[BBox]) -> GetBusDataResponse:
-        """ Получение данных об остановках и маршрутах """
+    async def get_bus_data(self, source: BusDataProvider, bbox: Optional[BBox],
+                           tolerance: Optional[float] = None) -> GetBusDataResponse:
+        """ Получение данных об остановках и маршрутах (с упрощением геометрии маршрутов при заданном допуске) """
 
-        if source is BusDataProvider.LOCAL:  # Провайдер данных - локальная база данных
-            stops, routes = await LocalBusDataProvider(self.session).get_bus_data_in_bbox(bbox)
-        elif source is BusDataProvider.OSM:  # Провайдер данных - интерфейс Overpass API
-            # Подготовка данных о заранее синхронизированных остановках и маршрутах
-            db_stops_mapping = await LocalBusDataProvider(self.session).prepare_local_stops_mapping(bbox)
-            db_routes_mapping = await LocalBusDataProvider(self.session).prepare_local_routes_mapping(bbox)
-            # Запрос данных
-            stops, routes = await OSMBusDataProvider(db_stops_mapping, db_routes_mapping).get_bus_data_in_bbox(bbox)
-        else:
-            raise ValueError('Non-existing bus data source!')
-
-        return GetBusDataResponse(stops=stops, routes=routes)
+        stops, routes = await self.__fetch_bus_data(source, 'bus_data', bbox,
+                                                    lambda provider: provider.get_bus_data_in_bbox(bbox))
+        return GetBusDataResponse(stops=stops, routes=simplify_routes(routes, tolerance))
 
     async def get_bus_stops(self, source: BusDataProvider, bbox: Optional[BBox]) -> List[StopSchema]:
         """ Получение данных об остановках """
-        if source is BusDataProvider.LOCAL:  # Провайдер данных - локальная база данных
-            return await LocalBusDataProvider(self.session).get_stops_in_bbox(bbox)
-        elif source is BusDataProvider.OSM:  # Провайдер данных - интерфейс Overpass API
-            # Подготовка данных о заранее синхронизированных остановках
-            db_stops_mapping = await LocalBusDataProvider(self.session).prepare_local_stops_mapping(bbox)
-            # Запрос данных
-            return await OSMBusDataProvider(db_stops_mapping).get_stops_in_bbox(bbox)
-        else:
-            raise ValueError('Non-existing bus data source!')
+        return await self.__fetch_bus_data(source, 'stops', bbox, lambda provider: provider.get_stops_in_bbox(bbox))
 
     async def create_bus_stops(self, stop_schemas: List[StopSchema]) -> List[StopSchema]:
         """ Создание записей об остановках """
         db_stops = await StopDAO(self.session).create_all(stop_schemas)
+        # Построенные векторные плитки становятся неактуальными
+        vector_tile_cache.clear()
         out_stops_schemas = [LocalBusDataProvider.db_stop_as_schema(db_stop) for db_stop in db_stops]
         return out_stops_schemas
 
     async def delete_bus_stops(self, stops_ids: List[str]) -> List[StopSchema]:
         """ Удаление записей об остановках """
         db_stops = await StopDAO(self.session).delete_all(stops_ids)
+        # Построенные векторные плитки становятся неактуальными
+        vector_tile_cache.clear()
         out_stops_schemas = [LocalBusDataProvider.db_stop_as_schema(db_stop) for db_stop in db_stops]
         return out_stops_schemas
 
-    async def get_bus_routes(self, source: BusDataProvider, bbox: Optional[BBox]) -> List[RouteSchema]:
-        """ Получение данных о маршрутах """
+    async def get_bus_routes(self, source: BusDataProvider, bbox: Optional[BBox],
+                             tolerance: Optional[float] = None) -> List[RouteSchema]:
+        """ Получение данных о маршрутах (с упрощением геометрии маршрутов при заданном допуске) """
+        routes = await self.__fetch_bus_data(source, 'routes', bbox, lambda provider: provider.get_routes_in_bbox(bbox))
+        return simplify_routes(routes, tolerance)
+
+    async def sync_osm_routes(self) -> SyncRoutesResponse:
+        """ Инкрементальная синхронизация маршрутов OSM, сохранённых в локальной базе данных """
+        sync_result = await OSMRoutesSynchronizer(self.session).sync()
+        # Построенные векторные плитки и кэшированные маршруты становятся неактуальными
+        vector_tile_cache.clear()
+        route_cache.clear()
+        return SyncRoutesResponse(**dataclasses.asdict(sync_result))
+
+    async def stream_bus_data(self, source: BusDataProvider, bbox: Optional[BBox],
+                              geometry_encoding: GeometryEncoding = GeometryEncoding.NODES,
+                              tolerance: Optional[float] = None) -> AsyncIterator[str]:
+        """ Потоковое получение данных об остановках и маршрутах (NDJSON: сначала остановки, затем маршруты) """
+        provider = self.__get_bus_data_provider(source)
+        context = {GEOMETRY_ENCODING_CONTEXT_KEY: geometry_encoding}
+        for stop in await provider.get_stops_in_bbox(bbox):
+            yield BusDataStreamEntry(type='stop', data=stop).model_dump_json() + '\n'
+        async for route in provider.iter_routes_in_bbox(bbox):
+            route = simplify_route(route, tolerance)
+            yield BusDataStreamEntry(type='route', data=route).model_dump_json(context=context) + '\n'
+
+    async def stream_bus_routes(self, source: BusDataProvider, bbox: Optional[BBox],
+                                geometry_encoding: GeometryEncoding = GeometryEncoding.NODES,
+                                tolerance: Optional[float] = None) -> AsyncIterator[str]:
+        """ Потоковое получение данных о маршрутах (NDJSON: по одному маршруту в строке) """
+        provider = self.__get_bus_data_provider(source)
+        context = {GEOMETRY_ENCODING_CONTEXT_KEY: geometry_encoding}
+        async for route in provider.iter_routes_in_bbox(bbox):
+            yield simplify_route(route, tolerance).model_dump_json(context=context) + '\n'
+
+    def __get_bus_data_provider(self, source: BusDataProvider) -> LocalBusDataProvider | OSMBusDataProvider:
+        """ Создание провайдера данных об остановках и маршрутах """
         if source is BusDataProvider.LOCAL:  # Провайдер данных - локальная база данных
-            return await LocalBusDataProvider(self.session).get_routes_in_bbox(bbox)
+            return LocalBusDataProvider(self.session)
         elif source is BusDataProvider.OSM:  # Провайдер данных - интерфейс Overpass API
-            # Подготовка данных о заранее синхронизированных остановках и маршрутах
-            db_stops_mapping = await LocalBusDataProvider(self.session).prepare_local_stops_mapping(bbox)
-            db_routes_mapping = await LocalBusDataProvider(self.session).prepare_local_routes_mapping(bbox)
-            # Запрос данных
-            return await OSMBusDataProvider(db_stops_mapping, db_routes_mapping).get_routes_in_bbox(bbox)
+            # Заранее синхронизированные остановки и маршруты запрашиваются из локальной базы данных по id объектов
+            # OSM после получения ответа Overpass API
+            return OSMBusDataProvider(local_data_provider=LocalBusDataProvider(self.session))
         else:
             raise ValueError('Non-existing bus data source!')
 
+    async def __fetch_bus_data(self, source: BusDataProvider, operation: str, bbox: Optional[BBox],
+                               fetch: Callable[[LocalBusDataProvider | OSMBusDataProvider], Awaitable[Any]]) -> Any:
+        """ Получение данных от провайдера (одновременные одинаковые запросы к Overpass API объединяются) """
+        if source is BusDataProvider.OSM:
+            # Координаты рамки округляются до 1e-7 градуса (около 1 см), чтобы незначимые различия не влияли на ключ
+            bbox_key = tuple(round(coord, 7) for coord in bbox) if bbox is not None else None
+            return await self.__coalesced(
+                (operation, source, bbox_key), lambda dispatcher: fetch(dispatcher.__get_bus_data_provider(source))
+            )
+        return await fetch(self.__get_bus_data_provider(source))
+
+    async def __coalesced(self, key: Hashable, run: Callable[['Dispatcher'], Awaitable[Any]]) -> Any:
+        """
+        Выполнение операции с объединением одновременных одинаковых запросов (ключ - нормализованные параметры)
+
+        Результат операции используется несколькими запросами, каждый из которых может завершиться раньше неё, поэтому
+        операция намеренно отделена от сессии запроса: она выполняется в новой сессии, получающей отдельное соединение
+        из пула соединений движка текущей сессии, вне транзакции вызывающего. Незафиксированные изменения текущей
+        сессии операции не видны, а изменения, выполненные операцией, фиксируются независимо от текущей сессии.
+        """
+
+        async def flight():
+            async with AsyncSession(bind=self.session.bind, expire_on_commit=False, autoflush=False) as session:
+                return await run(Dispatcher(session))
+
+        return await dispatcher_flights.run(key, flight)
+
+    async def get_bus_data_tile(self, z: int, x: int, y: int) -> bytes:
+        """ Получение векторной плитки с данными об остановках и маршрутах из локальной базы данных """
+        return await LocalBusDataProvider(self.session).get_vector_tile(z, x, y)
+
     async def get_bus_routes_by_ids(self, routes_ids: List[str]):
         return await LocalBusDataProvider(self.session).get_routes_by_ids(routes_ids)
 
     async def create_bus_routes(self, route_schemas: List[RouteSchema]) -> List[RouteSchema]:
         """ Создание записей об маршрутах """
         db_routes = await RouteDAO(self.session).create_all(route_schemas)
+        # Построенные векторные плитки и кэшированные маршруты становятся неактуальными
+        vector_tile_cache.clear()
+        route_cache.clear()
         out_routes_schemas = [LocalBusDataProvider.db_route_as_schema(db_route) for db_route in db_routes]
         return out_routes_schemas
 
-    async def delete_bus_routes(self, routes_ids: List[str]) -> List[RouteSchema]:
+    async def delete_bus_routes(self, routes_ids: List[str]) -> List[TruncatedRouteSchema]:
         """ Удаление записей о маршрутах """
         db_routes = await RouteDAO(self.session).delete_all(routes_ids)
-        out_routes_schemas = [LocalBusDataProvider.db_route_as_schema(db_route) for db_route in db_routes]
+        # Построенные векторные плитки и кэшированные маршруты становятся неактуальными
+        vector_tile_cache.clear()
+        route_cache.clear()
+        out_routes_schemas = [
+            TruncatedRouteSchema(id=str(db_route.id), source=BusDataProvider.LOCAL,
+                                 external_source_id=db_route.external_source_id, name=db_route.name)
+            for db_route in db_routes
+        ]
         return out_routes_schemas
 
     async def upload_speed_data(self, speed_data_files: List[File], name: str) -> SpeedDataSchema | None:
@@ -155,18 +238,30 @@ class Dispatcher:
 
     async def generate_speed_profile(self, profile_name: str, routes_ids: List[str],
                                      speed_data_id: str) -> SpeedProfileSchema:
+        """ Генерация профиля скорости для выбранных маршрутов (одновременные одинаковые запросы объединяются) """
+        key = ('speed_profile', profile_name, tuple(sorted(set(routes_ids))), speed_data_id)
+        return await self.__coalesced(key, lambda dispatcher: dispatcher.__generate_speed_profile(
+            profile_name, routes_ids, speed_data_id
+        ))
+
+    async def __generate_speed_profile(self, profile_name: str, routes_ids: List[str],
+                                       speed_data_id: str) -> SpeedProfileSchema:
         """ Генерация профиля скорости для выбранных маршрутов """
 
-        # Получение записей о маршрутах из локальной базы данных
-        routes = [
-            LocalBusDataProvider.db_route_as_schema(
-                await RouteDAO(self.session).get_by_id(route_id)
-            ) for route_id in routes_ids
-        ]
+        # Получение записей о маршрутах из локальной базы данных одним запросом (только геометрия и сегменты). Записи
+        # используются как для сопоставления с транспортными потоками, так и для сохранения скоростей сегментов
+        db_routes = await RouteDAO(self.session).get_all_with_geometry_by_ids(routes_ids)
+
+        # Профиль скорости не строится по части маршрутов: отсутствующие маршруты передаются клиенту
+        missing_routes_ids = sorted(set(routes_ids) - {str(db_route.id) for db_route in db_routes})
+        if missing_routes_ids:
+            raise RoutesNotFoundError(missing_routes_ids)
+        routes = [LocalBusDataProvider.db_route_as_schema(db_route) for db_route in db_routes]
 
         # Создание записи о профиле скорости
         routes_speed_mapping = await TomtomTrafficFlowProvider(self.session).create_speed_profile(routes, speed_data_id)
-        _speed_profile = await SpeedProfileDAO(self.session).create(profile_name, routes_speed_mapping, speed_data_id)
+        _speed_profile = await SpeedProfileDAO(self.session).create(profile_name, routes_speed_mapping, speed_data_id,
+                                                                    db_routes)
         return SpeedProfileSchema(
             id=str(_speed_profile.id),
             name=profile_name,
@@ -223,12 +318,57 @@ class Dispatcher:
             speed_data_id=str(db_speed_profile.speed_data_id)
         )
 
+    async def get_speed_profile_slice(self, profile_id: str, routes_ids: List[str], weekday: Weekday, hour_from: int,
+                                      hour_to: int) -> SpeedProfileSliceSchema | None:
+        """ Получение скоростей сегментов выбранных маршрутов профиля скорости за день недели и интервал часов """
+
+        # Профиль загружается в виде плотного массива один раз (одновременные запросы загрузки объединяются)
+        speed_profile_arrays = speed_profile_cache.get(profile_id)
+        if speed_profile_arrays is None:
+            speed_profile_arrays = await self.__coalesced(
+                ('speed_profile_arrays', profile_id),
+                lambda dispatcher: dispatcher.__load_speed_profile_arrays(profile_id)
+            )
+        if speed_profile_arrays is None:
+            return None
+
+        return SpeedProfileSliceSchema(
+            id=profile_id,
+            weekday=weekday,
+            hour_from=hour_from,
+            hour_to=hour_to,
+            routes=speed_profile_arrays.slice(routes_ids, weekday, hour_from, hour_to)
+        )
+
+    async def __load_speed_profile_arrays(self, profile_id: str) -> SpeedProfileArrays | None:
+        """ Загрузка профиля скорости в виде плотного массива (с сохранением в кэш) """
+
+        # Проверка на существование искомой записи
+        generation = speed_profile_cache.generation
+        db_speed_profile = await SpeedProfileDAO(self.session).get_by_id(profile_id)
+        if db_speed_profile is None:
+            return None
+
+        # Получение скоростей сегментов маршрутов одним запросом без создания объектов моделей
+        stmt = (
+            select(RouteSegment.route_id, SegmentSpeed.weekday, SegmentSpeed.hour_interval,
+                   SegmentSpeed.segment_order, SegmentSpeed.speed)
+            .join(SegmentSpeed, SegmentSpeed.route_segment_id == RouteSegment.id)
+            .where(SegmentSpeed.speed_profile_id == db_speed_profile.id)
+        )
+        rows = [(str(route_id), *values) for route_id, *values in (await self.session.execute(stmt)).all()]
+
+        speed_profile_arrays = SpeedProfileArrays.from_rows(rows)
+        speed_profile_cache.put(profile_id, speed_profile_arrays, generation)
+        return speed_profile_arrays
+
     async def delete_speed_profile(self, profile_id: str) -> SpeedProfileSchema | None:
         """ Удаление профиля скорости """
         speed_profile = await self.get_speed_profile(profile_id)
         if speed_profile is None:
             return None
         await SpeedProfileDAO(self.session).delete_by_id(profile_id)
+        speed_profile_cache.clear()
         return speed_profile
 
     async def upload_clustering_data(self, clustering_data_file: File, name: str) -> ClusteringDataSchema:
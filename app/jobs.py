@@ -0,0 +1,223 @@
+import asyncio
+import multiprocessing
+import queue
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from concurrent.futures import Future
+from datetime import datetime, timezone, timedelta
+from multiprocessing.queues import Queue
+from typing import Callable, Awaitable, Any, Dict, Iterable, Iterator, List, Set
+
+from app.logger import logger
+from app.schemas.enums import JobType, JobStatus
+from app.schemas.job import JobSchema
+from config import app_config
+
+# Очередь сообщений о прогрессе выполнения задач. Очередь создаётся в основном процессе и передаётся процессам общего
+# пула при их запуске, поэтому прогресс может передаваться как из основного процесса, так и из процессов пула
+progress_queue: Queue | None = None
+
+
+def get_progress_queue() -> Queue:
+    """ Получение очереди сообщений о прогрессе выполнения задач (с созданием при первом обращении) """
+    global progress_queue
+    if progress_queue is None:
+        progress_queue = multiprocessing.Queue()
+    return progress_queue
+
+
+def init_worker_progress_queue(worker_progress_queue: Queue):
+    """ Инициализация очереди сообщений о прогрессе в процессе общего пула """
+    global progress_queue
+    progress_queue = worker_progress_queue
+
+
+def report_progress(job_id: str | None, steps: int = 1):
+    """ Передача сообщения о выполнении шагов задачи (вне задачи сообщение не передаётся) """
+    if job_id is not None:
+        get_progress_queue().put((job_id, steps))
+
+
+def track_progress(iterable: Iterable, job_id: str | None) -> Iterator:
+    """ Обход последовательности с передачей сообщения о выполнении шага задачи после каждого элемента """
+    for item in iterable:
+        yield item
+        report_progress(job_id)
+
+
+@dataclass
+class Job:
+    """ Фоновая задача """
+    id: str
+    type: JobType
+    status: JobStatus = JobStatus.PENDING
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    done_steps: int = 0
+    total_steps: int = 0
+    result: Any = None
+    error: str | None = None
+    task: asyncio.Task | None = None
+    # Вычисления задачи, переданные в общий пул процессов и ещё не завершённые
+    pool_futures: Set[Future] = field(default_factory=set)
+
+    @property
+    def is_finished(self) -> bool:
+        """ Проверка завершения задачи (успешного или нет) """
+        return self.status in (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+    def as_schema(self) -> JobSchema:
+        progress = None
+        if self.status is JobStatus.COMPLETED:
+            progress = 1.0
+        elif self.total_steps > 0:
+            progress = min(self.done_steps / self.total_steps, 1.0)
+        return JobSchema(id=self.id, type=self.type, status=self.status, progress=progress,
+                         created_at=self.created_at, started_at=self.started_at, finished_at=self.finished_at,
+                         error=self.error)
+
+
+# Фоновая задача, в рамках которой выполняется текущий код (None - код выполняется вне задачи)
+current_job: ContextVar[Job | None] = ContextVar('current_job', default=None)
+
+
+def current_job_id() -> str | None:
+    """ Идентификатор текущей фоновой задачи (передаётся в вычисления, выполняемые в общем пуле процессов) """
+    job = current_job.get()
+    return job.id if job is not None else None
+
+
+def track_pool_future(future: Future):
+    """ Учёт вычислений текущей задачи, переданных в общий пул процессов (вне задачи вычисления не учитываются) """
+    job = current_job.get()
+    if job is not None:
+        job.pool_futures.add(future)
+        future.add_done_callback(job.pool_futures.discard)
+
+
+def add_progress_steps(steps: int):
+    """ Увеличение общего количества шагов текущей задачи """
+    job = current_job.get()
+    if job is not None:
+        job.total_steps += steps
+
+
+class JobManager:
+    """
+    Реестр фоновых задач
+
+    Задачи выполняются в цикле событий приложения, ресурсоёмкие вычисления задач выполняются в общем пуле процессов.
+    Одновременно выполняется не более max_concurrent задач, остальные задачи ожидают в порядке поступления.
+    Завершённые задачи хранятся в реестре (не более history_size задач и не дольше ttl секунд) до получения
+    результата клиентом.
+    """
+
+    def __init__(self, max_concurrent: int, history_size: int, ttl: int):
+        self.max_concurrent = max_concurrent
+        self.history_size = history_size
+        self.ttl = ttl
+        self.jobs: Dict[str, Job] = {}
+        self.semaphore: asyncio.Semaphore | None = None
+
+    def submit(self, job_type: JobType, run: Callable[[], Awaitable[Any]]) -> Job:
+        """ Постановка задачи в очередь выполнения """
+
+        # Семафор создаётся при первой постановке задачи (в цикле событий приложения)
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        job = Job(id=str(uuid.uuid4()), type=job_type)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self.__run(job, run))
+        self.__evict_finished()
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """ Получение задачи по идентификатору """
+        self.__collect_progress()
+        self.__evict_finished()
+        return self.jobs.get(job_id)
+
+    def get_all(self) -> List[Job]:
+        """ Получение всех задач реестра """
+        self.__collect_progress()
+        self.__evict_finished()
+        return list(self.jobs.values())
+
+    def cancel(self, job_id: str) -> Job | None:
+        """
+        Отмена задачи
+
+        Вычисления, ожидающие в очереди пула процессов, отменяются. Уже выполняющиеся вычисления прервать нельзя,
+        поэтому до их завершения задача находится в состоянии CANCELLING (результат вычислений не используется).
+        """
+        job = self.get(job_id)
+        if job is not None and not job.is_finished and job.status is not JobStatus.CANCELLING:
+            job.status = JobStatus.CANCELLING
+            job.task.cancel()
+        return job
+
+    async def shutdown(self):
+        """ Отмена всех незавершённых задач """
+        tasks = [job.task for job in self.jobs.values() if not job.is_finished]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __run(self, job: Job, run: Callable[[], Awaitable[Any]]):
+        """ Выполнение задачи с отслеживанием её состояния """
+        try:
+            async with self.semaphore:
+                job.status = JobStatus.RUNNING
+                job.started_at = datetime.now(timezone.utc)
+                current_job.set(job)
+                job.result = await run()
+                job.status = JobStatus.COMPLETED
+        except asyncio.CancelledError:
+            # Ожидание завершения выполняющихся вычислений задачи в пуле процессов (повторная отмена задачи
+            # прерывает ожидание). Набор вычислений копируется: завершённые вычисления удаляются из него в потоке пула
+            job.status = JobStatus.CANCELLING
+            pool_futures = [asyncio.wrap_future(future) for future in list(job.pool_futures) if not future.cancel()]
+            if pool_futures:
+                try:
+                    await asyncio.wait(pool_futures)
+                except asyncio.CancelledError:
+                    pass
+            job.status = JobStatus.CANCELLED
+        except Exception as e:
+            logger.exception(f'JOBS | Job {job.id} ({job.type.value}) failed')
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now(timezone.utc)
+
+    def __collect_progress(self):
+        """ Получение накопленных сообщений о прогрессе выполнения задач """
+        if progress_queue is None:
+            return
+        while True:
+            try:
+                job_id, steps = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.done_steps += steps
+
+    def __evict_finished(self):
+        """
+        Удаление завершённых задач, хранящихся дольше ttl секунд, и наиболее давно созданных завершённых задач
+        сверх ограничения размера истории
+        """
+        expiration_time = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        finished_jobs = [job for job in self.jobs.values() if job.is_finished]
+        for i, job in enumerate(finished_jobs):
+            if i < len(finished_jobs) - self.history_size or job.finished_at < expiration_time:
+                del self.jobs[job.id]
+
+
+# Общий реестр фоновых задач приложения
+job_manager = JobManager(max_concurrent=app_config.JOBS_MAX_CONCURRENT, history_size=app_config.JOBS_HISTORY_SIZE,
+                         ttl=app_config.JOBS_TTL)
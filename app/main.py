@@ -1,12 +1,37 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 
 from config import app_config
 from app.api.router import router
+from app.database.database import engine
+from app.jobs import job_manager
+from app.middleware import CompressionMiddleware
+from app.process_pool import shutdown_process_pool
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    # Отмена фоновых задач, остановка общего пула процессов и закрытие соединений с базой данных при завершении
+    # работы приложения
+    await job_manager.shutdown()
+    await shutdown_process_pool()
+    await engine.dispose()
 
-app = FastAPI(title="Geo Preprocessing Module", version="0.1.0")
+# Сериализация ответов в JSON выполняется библиотекой orjson
+app = FastAPI(title="Geo Preprocessing Module", version="0.1.0", lifespan=lifespan,
+              default_response_class=ORJSONResponse)
 app.include_router(router)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=app_config.COMPRESSION_MINIMUM_SIZE,
+    gzip_level=app_config.GZIP_COMPRESS_LEVEL,
+    brotli_quality=app_config.BROTLI_QUALITY
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -0,0 +1,76 @@
+import brotli
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Классы сжатия ответов расширяют внутренние классы промежуточного слоя GZip Starlette (IdentityResponder,
+# apply_compression), поэтому версия Starlette зафиксирована в pyproject.toml
+
+
+class FlushingGZipResponder(GZipResponder):
+    """ Сжатие ответа алгоритмом gzip со сбросом буфера после каждой части потокового ответа """
+
+    # Стандартная реализация Starlette накапливает сжатые данные потокового ответа до его завершения, из-за чего
+    # клиент не получает первые строки NDJSON до окончания построения всех маршрутов
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        self.gzip_file.write(body)
+        if more_body:
+            self.gzip_file.flush()
+        else:
+            self.gzip_file.close()
+
+        body = self.gzip_buffer.getvalue()
+        self.gzip_buffer.seek(0)
+        self.gzip_buffer.truncate()
+
+        return body
+
+
+class BrotliResponder(IdentityResponder):
+    """ Сжатие ответа алгоритмом brotli (со сбросом буфера после каждой части потокового ответа) """
+
+    content_encoding = 'br'
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        body = self.compressor.process(body)
+        if more_body:
+            return body + self.compressor.flush()
+        return body + self.compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Промежуточный слой сжатия ответов
+
+    Алгоритм сжатия выбирается по заголовку Accept-Encoding запроса: brotli (при поддержке клиентом), иначе gzip.
+    Ответы размером меньше minimum_size байт передаются без сжатия.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        # Определение поддерживаемых клиентом алгоритмов сжатия
+        accept_encoding = Headers(scope=scope).get('Accept-Encoding', '')
+        encodings = {encoding.split(';')[0].strip() for encoding in accept_encoding.split(',')}
+
+        if 'br' in encodings:
+            responder = BrotliResponder(self.app, self.minimum_size, quality=self.brotli_quality)
+        elif 'gzip' in encodings:
+            responder = FlushingGZipResponder(self.app, self.minimum_size, compresslevel=self.gzip_level)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+
+        await responder(scope, receive, send)
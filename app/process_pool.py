@@ -0,0 +1,37 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Any
+
+from app.jobs import get_progress_queue, init_worker_progress_queue, track_pool_future
+from config import app_config
+
+# Общий пул процессов для ресурсоёмких вычислений. Пул создаётся однократно при первом обращении и используется
+# всеми запросами, что ограничивает общее количество процессов значением PROCESS_POOL_WORKERS_NUM
+process_pool: ProcessPoolExecutor | None = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """ Получение общего пула процессов (с созданием при первом обращении) """
+    global process_pool
+    if process_pool is None:
+        # Процессы пула получают очередь сообщений о прогрессе выполнения фоновых задач при запуске
+        process_pool = ProcessPoolExecutor(max_workers=app_config.PROCESS_POOL_WORKERS_NUM,
+                                           initializer=init_worker_progress_queue, initargs=(get_progress_queue(),))
+    return process_pool
+
+
+async def run_in_process_pool(func: Callable, *args) -> Any:
+    """ Выполнение функции в общем пуле процессов без блокировки цикла событий """
+    # Вычисления учитываются в текущей фоновой задаче (при отмене задачи ожидается их завершение)
+    future = get_process_pool().submit(func, *args)
+    track_pool_future(future)
+    return await asyncio.wrap_future(future)
+
+
+async def shutdown_process_pool():
+    """ Остановка общего пула процессов """
+    global process_pool
+    if process_pool is not None:
+        pool, process_pool = process_pool, None
+        # Ожидание завершения процессов выполняется вне цикла событий
+        await asyncio.to_thread(pool.shutdown, wait=True)
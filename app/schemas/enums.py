@@ -24,3 +24,23 @@ class Weekday(Enum):
     FRIDAY = 'friday'
     SATURDAY = 'saturday'
     SUNDAY = 'sunday'
+
+class GeometryEncoding(Enum):
+    NODES = 'nodes'
+    POLYLINE = 'polyline'
+    DELTA = 'delta'
+
+class JobType(Enum):
+    BUS_DATA = 'bus_data'
+    SPEED_PROFILE = 'speed_profile'
+    CLUSTERING_PROFILES_GENERATION = 'clustering_profiles_generation'
+    CLUSTERING_PROFILE_REALIZATION = 'clustering_profile_realization'
+
+class JobStatus(Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    # Отмена запрошена, вычисления задачи в пуле процессов ещё выполняются
+    CANCELLING = 'cancelling'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
@@ -0,0 +1,18 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+from app.schemas.enums import JobType, JobStatus
+
+
+class JobSchema(BaseModel):
+    id: str
+    type: JobType
+    status: JobStatus
+    # Доля выполненных шагов задачи (None - количество шагов задачи неизвестно)
+    progress: Optional[float] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
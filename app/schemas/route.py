@@ -4,7 +4,7 @@ from uuid import UUID
 from pydantic import BaseModel, Extra
 
 from app.schemas.enums import BusDataProvider
-from app.schemas.route_geometry import RouteGeometryType
+from app.schemas.route_geometry import RouteGeometry
 from app.schemas.route_segment import RouteSegmentSchema
 from app.schemas.stop import StopSchema
 
@@ -17,4 +17,11 @@ class RouteSchema(BaseModel, extra=Extra.allow):
     stops: List[StopSchema]
     final_stop_order: Optional[int] = None
     segments: List[RouteSegmentSchema]
-    geometry: List[RouteGeometryType]
+    geometry: RouteGeometry
+
+
+class TruncatedRouteSchema(BaseModel):
+    id: str | UUID
+    source: BusDataProvider
+    external_source_id: Optional[str] = None
+    name: str
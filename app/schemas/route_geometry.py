@@ -1,6 +1,12 @@
-from pydantic import BaseModel
+from typing import List, Iterable, Iterator, Any
 
-from app.schemas.enums import RouteGeometryNodeType, RouteObstacleType
+import numpy as np
+from haversine import haversine_vector, Unit
+from pydantic import BaseModel, GetCoreSchemaHandler
+from pydantic_core import core_schema
+
+from app.schemas.enums import RouteGeometryNodeType, RouteObstacleType, GeometryEncoding
+from app.utils import encode_polyline, decode_polyline
 
 
 class RouteGeometryNodeSchema(BaseModel):
@@ -16,3 +22,369 @@ class RouteStopPositionSchema(RouteGeometryNodeSchema):
 
 
 RouteGeometryType = RouteGeometryNodeSchema | RouteStopPositionSchema | RouteObstacleSchema
+
+
+# Коды типов узлов и препятствий, используемые в массивах RouteGeometry (индекс в списке значений перечисления)
+NODE_TYPES = list(RouteGeometryNodeType)
+OBSTACLE_TYPES = list(RouteObstacleType)
+GEOMETRY_CODE = NODE_TYPES.index(RouteGeometryNodeType.GEOMETRY)
+OBSTACLE_CODE = NODE_TYPES.index(RouteGeometryNodeType.OBSTACLE)
+STOP_POSITION_CODE = NODE_TYPES.index(RouteGeometryNodeType.STOP_POSITION)
+NO_OBSTACLE_CODE = -1
+
+# Ключ контекста сериализации pydantic, определяющий формат представления геометрии, и количество знаков после
+# запятой, сохраняемых при компактном представлении координат (6 знаков - точность около 0.1 м)
+GEOMETRY_ENCODING_CONTEXT_KEY = 'geometry_encoding'
+COORDINATES_PRECISION = 6
+
+# Средний радиус Земли и размер пикселя карты (Web Mercator, плитки 256 пикселей) на экваторе на нулевом уровне
+# масштабирования (в метрах)
+EARTH_RADIUS = 6371008.8
+EQUATOR_PIXEL_SIZE = 2 * np.pi * 6378137 / 256
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """ Допуск упрощения геометрии (в метрах), соответствующий размеру пикселя на экваторе на уровне масштабирования """
+    return EQUATOR_PIXEL_SIZE / 2 ** zoom
+
+
+class RouteGeometry:
+    """ Компактное представление геометрии маршрута в виде параллельных массивов NumPy """
+
+    # Геометрия маршрута содержит по одному узлу на каждый узел OSM, поэтому хранение узлов в виде отдельных
+    # pydantic-объектов требует значительного объёма памяти. Внутри сервисов геометрия хранится в виде массивов:
+    # - lat, lon - координаты узлов;
+    # - node_type - код типа узла (индекс в NODE_TYPES);
+    # - obstacle_type - код типа препятствия (индекс в OBSTACLE_TYPES, -1 для узлов, не являющихся препятствиями);
+    # - stop_ref - идентификатор соответствующей остановки (None для узлов, не являющихся местами остановок).
+    # Преобразование в pydantic-схемы узлов выполняется только на границе API (при сериализации)
+
+    __slots__ = ('lat', 'lon', 'node_type', 'obstacle_type', 'stop_ref')
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, node_type: np.ndarray, obstacle_type: np.ndarray,
+                 stop_ref: np.ndarray):
+        """ Инициализация геометрии """
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.node_type = np.asarray(node_type, dtype=np.int8)
+        self.obstacle_type = np.asarray(obstacle_type, dtype=np.int8)
+        self.stop_ref = np.asarray(stop_ref, dtype=object)
+
+    @staticmethod
+    def empty() -> 'RouteGeometry':
+        """ Создание пустой геометрии """
+        return RouteGeometry(np.empty(0), np.empty(0), np.empty(0), np.empty(0), np.empty(0, dtype=object))
+
+    @staticmethod
+    def from_nodes(nodes: Iterable[RouteGeometryType]) -> 'RouteGeometry':
+        """ Построение геометрии по списку узлов в формате pydantic-схем """
+        builder = RouteGeometryBuilder()
+        for node in nodes:
+            if isinstance(node, RouteStopPositionSchema):
+                builder.add_stop_position(node.lat, node.lon, node.corresponding_stop_id)
+            elif isinstance(node, RouteObstacleSchema):
+                builder.add_obstacle(node.lat, node.lon, node.obstacle_type)
+            else:
+                builder.add_node(node.lat, node.lon)
+        return builder.build()
+
+    @staticmethod
+    def concatenate(geometries: List['RouteGeometry']) -> 'RouteGeometry':
+        """ Объединение нескольких геометрий """
+        if len(geometries) == 0:
+            return RouteGeometry.empty()
+        return RouteGeometry(*(
+            np.concatenate([getattr(geometry, field) for geometry in geometries])
+            for field in RouteGeometry.__slots__
+        ))
+
+    @property
+    def stop_position_indices(self) -> np.ndarray:
+        """ Индексы узлов, являющихся местами остановок """
+        return np.flatnonzero(self.node_type == STOP_POSITION_CODE)
+
+    def edge_distances(self, unit: Unit = Unit.METERS) -> np.ndarray:
+        """ Расчёт расстояний между соседними узлами геометрии (рёбрами) """
+        if len(self) < 2:
+            return np.empty(0)
+        points = np.column_stack((self.lat, self.lon))
+        return haversine_vector(points[:-1], points[1:], unit)
+
+    def reduce_segments(self, edge_values: np.ndarray) -> np.ndarray:
+        """
+        Суммирование значений рёбер в пределах участков между соседними местами остановок
+
+        На вход подаётся массив размерности (N - 1, ...), где N - количество узлов геометрии: i-ая строка соответствует
+        ребру между i-ым и (i + 1)-ым узлами. В качестве результата возвращается массив размерности (M - 1, ...), где
+        M - количество мест остановок: k-ая строка содержит сумму значений рёбер между k-ым и (k + 1)-ым местами
+        остановок. Рёбра до первого и после последнего места остановки не учитываются.
+        """
+
+        edge_values = np.asarray(edge_values)
+        stop_position_indices = self.stop_position_indices
+
+        if len(stop_position_indices) < 2:
+            return np.zeros((0, *edge_values.shape[1:]), dtype=edge_values.dtype)
+
+        # Добавление нулевого ребра в конец массива (последнее место остановки может быть последним узлом геометрии,
+        # тогда индекс начала последнего интервала выходит за границы массива рёбер)
+        padded_edge_values = np.concatenate((edge_values, np.zeros((1, *edge_values.shape[1:]), edge_values.dtype)))
+
+        # Суммирование по интервалам [p_k, p_(k+1)) (интервал после последнего места остановки отбрасывается)
+        return np.add.reduceat(padded_edge_values, stop_position_indices, axis=0)[:-1]
+
+    def segment_obstacle_counts(self) -> np.ndarray:
+        """ Подсчёт препятствий каждого типа (столбцы OBSTACLE_TYPES) на участках между местами остановок """
+
+        # Каждое препятствие относится к ребру, которое в нём заканчивается
+        obstacles_one_hot = self.obstacle_type[1:, None] == np.arange(len(OBSTACLE_TYPES))[None, :]
+
+        return self.reduce_segments(obstacles_one_hot.astype(np.int64))
+
+    def simplify(self, tolerance: float) -> 'RouteGeometry':
+        """
+        Упрощение геометрии алгоритмом Дугласа-Пекера (допуск задаётся в метрах)
+
+        Места остановок и препятствия сохраняются всегда и разбивают геометрию на независимые участки. Итерации
+        алгоритма выполняются одновременно для всех участков: на каждой итерации для каждого участка между соседними
+        сохранёнными узлами определяется наиболее удалённый от него узел, и, если расстояние превышает допуск, узел
+        сохраняется. Итерации продолжаются, пока сохраняются новые узлы.
+        """
+
+        if len(self) < 3 or tolerance <= 0:
+            return self
+
+        # Проекция координат на касательную плоскость в центре геометрии (в метрах)
+        lat0 = np.radians(self.lat.mean())
+        x = np.radians(self.lon) * np.cos(lat0) * EARTH_RADIUS
+        y = np.radians(self.lat) * EARTH_RADIUS
+
+        # Изначально сохраняются концы геометрии, места остановок и препятствия
+        keep = self.node_type != GEOMETRY_CODE
+        keep[[0, -1]] = True
+
+        node_indices = np.arange(len(self))
+        while True:
+            kept_indices = np.flatnonzero(keep)
+
+            # Определение участка (пары соседних сохранённых узлов) для каждого узла
+            intervals = np.minimum(np.searchsorted(kept_indices, node_indices, side='right') - 1,
+                                   len(kept_indices) - 2)
+            start, end = kept_indices[intervals], kept_indices[intervals + 1]
+
+            # Расчёт расстояний от узлов до отрезков, соединяющих концы их участков
+            dx, dy = x[end] - x[start], y[end] - y[start]
+            length_sq = dx ** 2 + dy ** 2
+            t = np.clip(((x - x[start]) * dx + (y - y[start]) * dy) / np.where(length_sq > 0, length_sq, 1), 0, 1)
+            distances = np.hypot(x - (x[start] + t * dx), y - (y[start] + t * dy))
+            distances[keep] = 0
+
+            # Определение наиболее удалённого узла каждого участка
+            order = np.lexsort((-distances, intervals))
+            is_first = np.concatenate(([True], intervals[order][1:] != intervals[order][:-1]))
+            farthest = order[is_first]
+
+            new_indices = farthest[distances[farthest] > tolerance]
+            if len(new_indices) == 0:
+                break
+            keep[new_indices] = True
+
+        return RouteGeometry(*(getattr(self, field)[keep] for field in RouteGeometry.__slots__))
+
+    def node(self, i: int) -> RouteGeometryType:
+        """ Получение узла геометрии в формате pydantic-схемы """
+        node_type = NODE_TYPES[self.node_type[i]]
+        lat, lon = float(self.lat[i]), float(self.lon[i])
+        if node_type is RouteGeometryNodeType.STOP_POSITION:
+            return RouteStopPositionSchema(type=node_type, lat=lat, lon=lon, corresponding_stop_id=self.stop_ref[i])
+        elif node_type is RouteGeometryNodeType.OBSTACLE:
+            return RouteObstacleSchema(type=node_type, lat=lat, lon=lon,
+                                       obstacle_type=OBSTACLE_TYPES[self.obstacle_type[i]])
+        return RouteGeometryNodeSchema(type=node_type, lat=lat, lon=lon)
+
+    def to_nodes(self) -> List[RouteGeometryType]:
+        """ Преобразование геометрии в список узлов в формате pydantic-схем """
+        return [self.node(i) for i in range(len(self))]
+
+    def to_dicts(self, json_mode: bool = False) -> List[dict]:
+        """ Преобразование геометрии в список словарей (без создания pydantic-объектов) """
+
+        # В режиме JSON перечисления заменяются их значениями
+        node_types = [node_type.value for node_type in NODE_TYPES] if json_mode else NODE_TYPES
+        obstacle_types = [obstacle_type.value for obstacle_type in OBSTACLE_TYPES] if json_mode else OBSTACLE_TYPES
+
+        nodes = []
+        for lat, lon, node_type, obstacle_type, stop_ref in zip(self.lat.tolist(), self.lon.tolist(),
+                                                                 self.node_type.tolist(),
+                                                                 self.obstacle_type.tolist(), self.stop_ref):
+            node = {'type': node_types[node_type], 'lat': lat, 'lon': lon}
+            if node_type == STOP_POSITION_CODE:
+                node['corresponding_stop_id'] = stop_ref
+            elif node_type == OBSTACLE_CODE:
+                node['obstacle_type'] = obstacle_types[obstacle_type]
+            nodes.append(node)
+
+        return nodes
+
+    def encode(self, encoding: GeometryEncoding, precision: int = COORDINATES_PRECISION) -> dict:
+        """
+        Компактное представление геометрии
+
+        Координаты округляются до precision знаков после запятой и представляются в виде разностей целых чисел
+        (первое значение - абсолютное): в формате Encoded Polyline (одна строка с чередующимися lat, lon) или
+        в виде двух массивов чисел. Типы узлов передаются разреженно: индексы препятствий с их типами и индексы мест
+        остановок с идентификаторами соответствующих остановок, остальные узлы являются узлами геометрии.
+        """
+
+        # Расчёт разностей округлённых координат (без накопления ошибки округления)
+        scale = 10 ** precision
+        lat_deltas = np.diff(np.round(self.lat * scale).astype(np.int64), prepend=0)
+        lon_deltas = np.diff(np.round(self.lon * scale).astype(np.int64), prepend=0)
+
+        data = {'encoding': encoding.value, 'precision': precision}
+        if encoding is GeometryEncoding.POLYLINE:
+            data['polyline'] = encode_polyline(np.column_stack((lat_deltas, lon_deltas)).ravel())
+        elif encoding is GeometryEncoding.DELTA:
+            data['lat'] = lat_deltas.tolist()
+            data['lon'] = lon_deltas.tolist()
+        else:
+            raise ValueError(f'Unsupported compact geometry encoding: {encoding}')
+
+        # Разреженные аннотации препятствий и мест остановок
+        obstacle_indices = np.flatnonzero(self.node_type == OBSTACLE_CODE)
+        stop_position_indices = self.stop_position_indices
+        data['obstacles'] = {
+            'indices': obstacle_indices.tolist(),
+            'types': [OBSTACLE_TYPES[code].value for code in self.obstacle_type[obstacle_indices].tolist()]
+        }
+        data['stop_positions'] = {
+            'indices': stop_position_indices.tolist(),
+            'stop_ids': self.stop_ref[stop_position_indices].tolist()
+        }
+
+        return data
+
+    @staticmethod
+    def decode(data: dict) -> 'RouteGeometry':
+        """ Восстановление геометрии из компактного представления """
+
+        encoding = GeometryEncoding(data['encoding'])
+        if encoding is GeometryEncoding.POLYLINE:
+            deltas = decode_polyline(data['polyline']).reshape(-1, 2)
+            lat_deltas, lon_deltas = deltas[:, 0], deltas[:, 1]
+        elif encoding is GeometryEncoding.DELTA:
+            lat_deltas, lon_deltas = np.asarray(data['lat'], dtype=np.int64), np.asarray(data['lon'], dtype=np.int64)
+        else:
+            raise ValueError(f'Unsupported compact geometry encoding: {encoding}')
+
+        scale = 10 ** data['precision']
+        nodes_count = len(lat_deltas)
+
+        # Восстановление типов узлов по разреженным аннотациям
+        node_type = np.full(nodes_count, GEOMETRY_CODE, dtype=np.int8)
+        obstacle_type = np.full(nodes_count, NO_OBSTACLE_CODE, dtype=np.int8)
+        stop_ref = np.full(nodes_count, None, dtype=object)
+
+        obstacle_indices = np.asarray(data['obstacles']['indices'], dtype=np.int64)
+        node_type[obstacle_indices] = OBSTACLE_CODE
+        obstacle_type[obstacle_indices] = [
+            OBSTACLE_TYPES.index(RouteObstacleType(value)) for value in data['obstacles']['types']
+        ]
+
+        stop_position_indices = np.asarray(data['stop_positions']['indices'], dtype=np.int64)
+        node_type[stop_position_indices] = STOP_POSITION_CODE
+        stop_ref[stop_position_indices] = [str(stop_id) for stop_id in data['stop_positions']['stop_ids']]
+
+        return RouteGeometry(np.cumsum(lat_deltas) / scale, np.cumsum(lon_deltas) / scale, node_type, obstacle_type,
+                             stop_ref)
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def __iter__(self) -> Iterator[RouteGeometryType]:
+        return (self.node(i) for i in range(len(self)))
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return RouteGeometry(*(getattr(self, field)[item] for field in RouteGeometry.__slots__))
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("Route geometry index out of range")
+        return self.node(item)
+
+    def __add__(self, other: 'RouteGeometry') -> 'RouteGeometry':
+        return RouteGeometry.concatenate([self, other])
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, RouteGeometry):
+            return NotImplemented
+        return all(np.array_equal(getattr(self, field), getattr(other, field)) for field in RouteGeometry.__slots__)
+
+    def __repr__(self) -> str:
+        return f"RouteGeometry(nodes={len(self)})"
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source_type: Any, handler: GetCoreSchemaHandler) \
+            -> core_schema.CoreSchema:
+        """
+        Схема pydantic: валидация из списка узлов и сериализация в список узлов
+
+        Формат сериализации может быть изменён через контекст сериализации (ключ GEOMETRY_ENCODING_CONTEXT_KEY со
+        значением GeometryEncoding): в этом случае геометрия сериализуется в компактном представлении (см. encode).
+        """
+
+        # Во внешнем представлении (API, JSON-схема) геометрия остаётся списком узлов
+        from_nodes_schema = core_schema.no_info_after_validator_function(
+            cls.from_nodes, handler.generate_schema(List[RouteGeometryType])
+        )
+
+        return core_schema.json_or_python_schema(
+            json_schema=from_nodes_schema,
+            python_schema=core_schema.union_schema([core_schema.is_instance_schema(cls), from_nodes_schema]),
+            serialization=core_schema.plain_serializer_function_ser_schema(cls.__serialize, info_arg=True)
+        )
+
+    @staticmethod
+    def __serialize(geometry: 'RouteGeometry', info: core_schema.SerializationInfo) -> List[dict] | dict:
+        """ Сериализация геометрии с учётом формата, заданного в контексте сериализации """
+        encoding = (info.context or {}).get(GEOMETRY_ENCODING_CONTEXT_KEY, GeometryEncoding.NODES)
+        if encoding is GeometryEncoding.NODES:
+            return geometry.to_dicts(json_mode=info.mode_is_json())
+        return geometry.encode(encoding)
+
+
+class RouteGeometryBuilder:
+    """ Класс для последовательного построения геометрии маршрута """
+
+    def __init__(self):
+        self.lat = []
+        self.lon = []
+        self.node_type = []
+        self.obstacle_type = []
+        self.stop_ref = []
+
+    def __add(self, lat: float, lon: float, node_type: int, obstacle_type: int, stop_ref: str | None):
+        self.lat.append(float(lat))
+        self.lon.append(float(lon))
+        self.node_type.append(node_type)
+        self.obstacle_type.append(obstacle_type)
+        self.stop_ref.append(stop_ref)
+
+    def add_node(self, lat: float, lon: float):
+        """ Добавление узла геометрии """
+        self.__add(lat, lon, GEOMETRY_CODE, NO_OBSTACLE_CODE, None)
+
+    def add_obstacle(self, lat: float, lon: float, obstacle_type: RouteObstacleType):
+        """ Добавление препятствия """
+        self.__add(lat, lon, OBSTACLE_CODE, OBSTACLE_TYPES.index(obstacle_type), None)
+
+    def add_stop_position(self, lat: float, lon: float, stop_ref: str):
+        """ Добавление места остановки """
+        self.__add(lat, lon, STOP_POSITION_CODE, NO_OBSTACLE_CODE, str(stop_ref))
+
+    def build(self) -> RouteGeometry:
+        """ Построение геометрии """
+        stop_ref = np.empty(len(self.stop_ref), dtype=object)
+        stop_ref[:] = self.stop_ref
+        return RouteGeometry(self.lat, self.lon, self.node_type, self.obstacle_type, stop_ref)
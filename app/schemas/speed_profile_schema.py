@@ -2,6 +2,8 @@ from typing import Dict, List
 
 from pydantic import BaseModel
 
+from app.schemas.enums import Weekday
+
 
 SegmentSpeeds = List[float]
 HourIntervalsToSpeeds = Dict[int, SegmentSpeeds]
@@ -17,3 +19,11 @@ class SpeedProfileSchema(BaseModel):
     name: str
     speed_data_id: str
     routes: RouteIdToWeekday
+
+class SpeedProfileSliceSchema(BaseModel):
+    id: str
+    weekday: Weekday
+    hour_from: int
+    hour_to: int
+    # Скорости сегментов маршрутов по часам интервала (NaN-значения передаются как null)
+    routes: Dict[str, List[SegmentSpeeds]]
@@ -0,0 +1,39 @@
+import hashlib
+from typing import List
+
+from app.cache import LRUCache
+from app.schemas.route import RouteSchema
+
+# Общий кэш упрощённой геометрии маршрутов (ключ - идентификатор маршрута, допуск и отпечаток исходной геометрии,
+# поэтому изменение геометрии маршрута с тем же идентификатором не приводит к использованию устаревшего результата)
+simplified_geometry_cache = LRUCache(max_size=8192)
+
+
+def geometry_fingerprint(route: RouteSchema) -> bytes:
+    """ Отпечаток геометрии маршрута (координаты и типы узлов) """
+    geometry = route.geometry
+    digest = hashlib.blake2b(digest_size=16)
+    for array in (geometry.lat, geometry.lon, geometry.node_type):
+        digest.update(array.tobytes())
+    return digest.digest()
+
+
+def simplify_route(route: RouteSchema, tolerance: float | None) -> RouteSchema:
+    """ Упрощение геометрии маршрута (с использованием кэша) """
+
+    if tolerance is None:
+        return route
+
+    key = (route.id, tolerance, geometry_fingerprint(route))
+    geometry = simplified_geometry_cache.get(key)
+    if geometry is None:
+        geometry = route.geometry.simplify(tolerance)
+        simplified_geometry_cache.put(key, geometry)
+
+    # Остановки и сегменты маршрута не изменяются (протяжённость сегментов рассчитана по исходной геометрии)
+    return route.model_copy(update={'geometry': geometry})
+
+
+def simplify_routes(routes: List[RouteSchema], tolerance: float | None) -> List[RouteSchema]:
+    """ Упрощение геометрии маршрутов """
+    return [simplify_route(route, tolerance) for route in routes]
@@ -1,20 +1,79 @@
 import time
-from typing import List, Optional, Tuple
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, AsyncIterator, Dict, Sequence
+from uuid import UUID
 
+import numpy as np
+import pygeos
 from haversine import haversine, Unit
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
+from app.cache import LRUCache
 from app.common_types import BBox
 from app.database.daos.route_dao import RouteDAO
 from app.database.daos.stop_dao import StopDAO
 from app.database.models import Stop, Route, RouteGeometryNode, RouteObstacleNode, RouteStopPositionNode
 from app.logger import logger
-from app.schemas.enums import BusDataProvider, RouteGeometryNodeType
+from app.schemas.enums import BusDataProvider, RouteObstacleType
 from app.schemas.route import RouteSchema
-from app.schemas.route_geometry import RouteGeometryNodeSchema, RouteObstacleSchema, RouteStopPositionSchema
+from app.schemas.route_geometry import RouteGeometryBuilder, OBSTACLE_CODE, OBSTACLE_TYPES
 from app.schemas.route_segment import RouteSegmentSchema
 from app.schemas.stop import StopSchema
+from app.services.bus_data.tiles.vector_tiles import TileProjection, VectorTileLayer, encode_vector_tile, \
+    vector_tile_cache, TILE_BUFFER
+
+# Общий кэш маршрутов локальной базы данных, преобразованных в схемы (ключ - id и версия записи о маршруте). При
+# чтении маршрутов из базы данных запрашиваются только id и версии записей, полностью загружаются и преобразуются
+# лишь маршруты, отсутствующие в кэше
+route_cache = LRUCache(max_size=2048)
+
+
+@dataclass
+class VectorTileSource:
+    """
+    Исходные данные векторных плиток: все маршруты и остановки локальной базы данных с их ограничивающими рамками
+
+    Данные формируются однократно для поколения кэша векторных плиток (кэш очищается при любом изменении маршрутов и
+    остановок), поэтому при построении пирамиды плиток база данных не запрашивается для каждой плитки, а в проекцию
+    попадают только маршруты, рамка которых пересекает плитку.
+    """
+    routes: List[RouteSchema]
+    # Ограничивающие рамки маршрутов (min_lon, min_lat, max_lon, max_lat), NaN для маршрутов менее чем из двух узлов
+    routes_bounds: np.ndarray
+    stops: List[StopSchema]
+    # Координаты остановок (lon, lat)
+    stops_coords: np.ndarray
+
+    @staticmethod
+    def build(routes: List[RouteSchema], stops: List[StopSchema]) -> 'VectorTileSource':
+        """ Формирование исходных данных векторных плиток с расчётом рамок по массивам координат геометрии """
+        routes_bounds = np.full((len(routes), 4), np.nan)
+        for i, route in enumerate(routes):
+            if len(route.geometry) >= 2:
+                lat, lon = route.geometry.lat, route.geometry.lon
+                routes_bounds[i] = (lon.min(), lat.min(), lon.max(), lat.max())
+        stops_coords = np.array([(stop.lon, stop.lat) for stop in stops], dtype=np.float64).reshape(-1, 2)
+        return VectorTileSource(routes=routes, routes_bounds=routes_bounds, stops=stops, stops_coords=stops_coords)
+
+    def routes_in_bbox(self, bbox: BBox) -> List[RouteSchema]:
+        """ Маршруты, ограничивающая рамка которых пересекает заданную рамку """
+        with np.errstate(invalid='ignore'):
+            mask = (
+                (self.routes_bounds[:, 2] >= bbox[0]) & (self.routes_bounds[:, 0] <= bbox[2]) &
+                (self.routes_bounds[:, 3] >= bbox[1]) & (self.routes_bounds[:, 1] <= bbox[3])
+            )
+        return [self.routes[i] for i in np.flatnonzero(mask).tolist()]
+
+    def stops_in_bbox(self, bbox: BBox) -> List[StopSchema]:
+        """ Остановки внутри заданной рамки """
+        lon, lat = self.stops_coords[:, 0], self.stops_coords[:, 1]
+        mask = (lon >= bbox[0]) & (lon <= bbox[2]) & (lat >= bbox[1]) & (lat <= bbox[3])
+        return [self.stops[i] for i in np.flatnonzero(mask).tolist()]
+
+
+# Исходные данные векторных плиток (ключ - поколение кэша векторных плиток)
+vector_tile_source_cache = LRUCache(max_size=1)
 
 
 class LocalBusDataProvider:
@@ -82,26 +141,26 @@ class LocalBusDataProvider:
 
     async def get_routes_in_bbox(self, bbox: BBox) -> List[RouteSchema]:
         """ Получение всех маршрутов внутри ограничивающей рамки """
+        return [route async for route in self.iter_routes_in_bbox(bbox)]
 
-        routes_in_bbox = []
+    async def iter_routes_in_bbox(self, bbox: BBox) -> AsyncIterator[RouteSchema]:
+        """ Последовательное получение маршрутов внутри ограничивающей рамки (с преобразованием по мере запроса) """
 
-        # Получение и обход всех маршрутов из базы данных
-        all_db_routes = await RouteDAO(self.session).get_all()
-        for route in all_db_routes:
+        # Получение и обход всех маршрутов из базы данных (с использованием кэша маршрутов)
+        all_routes = await self.__get_cached_routes(await RouteDAO(self.session).get_versions())
+        for route in all_routes:
 
             is_inside_bbox = True
 
             # Обход всех остановок маршрута: если хотя бы одна остановка находится вне
             # ограничивающей рамки, то маршрут не добавляется в выходной список
-            for route_stop in route.stops:
+            for stop in route.stops:
 
                 if bbox is None:
                     break
 
                 # Проверка принадлежности координат остановки к области ограничивающей рамки
-                lon = route_stop.stop.lon
-                lat = route_stop.stop.lat
-                is_inside_bbox = (bbox[0] <= lon <= bbox[2]) and (bbox[1] <= lat <= bbox[3])
+                is_inside_bbox = (bbox[0] <= stop.lon <= bbox[2]) and (bbox[1] <= stop.lat <= bbox[3])
 
                 # Если остановка находится внутри рамки, то она добавляется в выходной массив
                 if not is_inside_bbox:
@@ -109,13 +168,125 @@ class LocalBusDataProvider:
                     break
 
             if is_inside_bbox:
-                routes_in_bbox.append(self.db_route_as_schema(route))
+                yield route
+
+    # Допуск упрощения геометрии маршрутов в системе координат плитки (около 1 пикселя при отображении плитки
+    # размером 512 пикселей) и минимальные уровни масштабирования для отображения остановок и препятствий
+    TILE_SIMPLIFICATION_TOLERANCE = 8
+    TILE_STOPS_MIN_ZOOM = 12
+    TILE_OBSTACLES_MIN_ZOOM = 14
+
+    async def get_vector_tile(self, z: int, x: int, y: int) -> bytes:
+        """ Получение векторной плитки (Mapbox Vector Tile) с маршрутами, остановками и препятствиями """
+
+        # Использование ранее построенной плитки
+        tile = vector_tile_cache.get((z, x, y))
+        if tile is not None:
+            return tile
+
+        # Для несуществующих плиток возвращается пустая плитка
+        projection = TileProjection(z, x, y)
+        if not projection.is_valid:
+            return b''
+
+        # Отбор остановок и маршрутов, пересекающих плитку (с учётом буферной зоны плитки)
+        generation = vector_tile_cache.generation
+        tile_source = await self.__get_vector_tile_source(generation)
+        bbox = projection.bbox(buffer=TILE_BUFFER)
+        stops = tile_source.stops_in_bbox(bbox) if z >= self.TILE_STOPS_MIN_ZOOM else []
+        routes = tile_source.routes_in_bbox(bbox)
+
+        tile = self.build_vector_tile(projection, stops, routes)
+        vector_tile_cache.put((z, x, y), tile, generation)
+
+        return tile
+
+    async def __get_vector_tile_source(self, generation: int) -> VectorTileSource:
+        """ Получение исходных данных векторных плиток для поколения кэша плиток (с формированием при отсутствии) """
+        tile_source = vector_tile_source_cache.get(generation)
+        if tile_source is None:
+            routes, stops = await self.get_routes_in_bbox(None), await self.get_stops_in_bbox(None)
+            tile_source = VectorTileSource.build(routes, stops)
+            vector_tile_source_cache.put(generation, tile_source)
+        return tile_source
+
+    @classmethod
+    def build_vector_tile(cls, projection: TileProjection, stops: List[StopSchema], routes: List[RouteSchema]) \
+            -> bytes:
+        """ Построение векторной плитки """
+
+        routes_layer = VectorTileLayer('routes', projection.extent)
+        stops_layer = VectorTileLayer('stops', projection.extent)
+        obstacles_layer = VectorTileLayer('obstacles', projection.extent)
+
+        # Границы плитки с учётом буферной зоны в системе координат плитки
+        min_coord, max_coord = -TILE_BUFFER, projection.extent + TILE_BUFFER
+
+        # Проекция геометрии маршрутов в систему координат плитки и отбор маршрутов, пересекающих плитку
+        routes_points = []
+        for route in routes:
+            if len(route.geometry) < 2:
+                continue
+            points = projection.project(route.geometry.lat, route.geometry.lon)
+            if np.all(points.max(axis=0) >= min_coord) and np.all(points.min(axis=0) <= max_coord):
+                routes_points.append((route, points))
+
+        # Обрезка геометрии маршрутов по границам плитки и упрощение с допуском, заданным в системе координат
+        # плитки (с уменьшением масштаба допуск в градусах растёт, поэтому детализация соответствует масштабу)
+        if len(routes_points) > 0:
+            linestrings = pygeos.linestrings([points for _, points in routes_points])
+            clipped_linestrings = pygeos.clip_by_rect(linestrings, min_coord, min_coord, max_coord, max_coord)
+            simplified_linestrings = pygeos.simplify(clipped_linestrings, cls.TILE_SIMPLIFICATION_TOLERANCE)
+            for (route, _), linestring in zip(routes_points, simplified_linestrings):
+                parts = [pygeos.get_coordinates(part) for part in pygeos.get_parts(linestring)]
+                routes_layer.add_linestring(parts, {'id': route.id, 'name': route.name})
+
+        # Препятствия маршрутов (препятствия, общие для нескольких маршрутов, добавляются однократно)
+        if projection.z >= cls.TILE_OBSTACLES_MIN_ZOOM:
+            obstacles = {}
+            for route, points in routes_points:
+                for i in np.flatnonzero(route.geometry.node_type == OBSTACLE_CODE).tolist():
+                    point = np.rint(points[i])
+                    if np.all((point >= min_coord) & (point <= max_coord)):
+                        obstacle_type = OBSTACLE_TYPES[route.geometry.obstacle_type[i]].value
+                        obstacles[tuple(point.tolist())] = obstacle_type
+            obstacles_layer.add_points(np.array(list(obstacles.keys())).reshape(-1, 2),
+                                       [{'obstacle_type': obstacle_type} for obstacle_type in obstacles.values()])
+
+        # Остановки, находящиеся в пределах плитки
+        if projection.z >= cls.TILE_STOPS_MIN_ZOOM and len(stops) > 0:
+            stops_points = projection.project([stop.lat for stop in stops], [stop.lon for stop in stops])
+            is_inside_tile = np.all((stops_points >= min_coord) & (stops_points <= max_coord), axis=1)
+            stops_layer.add_points(stops_points[is_inside_tile], [
+                {'id': stop.id, 'name': stop.name} for stop, is_inside in zip(stops, is_inside_tile) if is_inside
+            ])
 
-        return routes_in_bbox
+        return encode_vector_tile([routes_layer, stops_layer, obstacles_layer])
 
     async def get_routes_by_ids(self, routes_ids: List[str]) -> List[RouteSchema]:
-        db_routes = await RouteDAO(self.session).get_all_by_ids(routes_ids)
-        return [self.db_route_as_schema(db_route) for db_route in db_routes]
+        return await self.__get_cached_routes(await RouteDAO(self.session).get_versions(routes_ids))
+
+    async def __get_cached_routes(self, routes_versions: Sequence[Tuple[UUID, int]]) -> List[RouteSchema]:
+        """
+        Получение маршрутов по id и версиям записей
+
+        Маршруты берутся из кэша, отсутствующие в кэше маршруты загружаются из базы данных одним запросом и
+        сохраняются в кэш. Маршруты, удалённые после получения версий, пропускаются.
+        """
+
+        # Поиск маршрутов в кэше
+        generation = route_cache.generation
+        routes = {route_id: route_cache.get((route_id, version)) for route_id, version in routes_versions}
+
+        # Загрузка и преобразование отсутствующих в кэше маршрутов
+        missing_routes_ids = [str(route_id) for route_id, route in routes.items() if route is None]
+        if len(missing_routes_ids) > 0:
+            for db_route in await RouteDAO(self.session).get_all_by_ids(missing_routes_ids):
+                route = self.db_route_as_schema(db_route)
+                route_cache.put((db_route.id, db_route.version), route, generation)
+                routes[db_route.id] = route
+
+        return [route for route in routes.values() if route is not None]
 
     @staticmethod
     def db_stop_as_schema(db_stop: Stop) -> StopSchema:
@@ -148,34 +319,14 @@ class LocalBusDataProvider:
                 )
             )
 
-        route_geometry_schemas = []
+        route_geometry = RouteGeometryBuilder()
         for node in db_route.geometry:
             if type(node) is RouteGeometryNode:
-                route_geometry_schemas.append(
-                    RouteGeometryNodeSchema(
-                        type=node.type,
-                        lat=node.lat,
-                        lon=node.lon
-                    )
-                )
+                route_geometry.add_node(node.lat, node.lon)
             elif type(node) is RouteObstacleNode:
-                route_geometry_schemas.append(
-                    RouteObstacleSchema(
-                        type=RouteGeometryNodeType.OBSTACLE,
-                        lat=node.lat,
-                        lon=node.lon,
-                        obstacle_type=node.obstacle_type
-                    )
-                )
+                route_geometry.add_obstacle(node.lat, node.lon, RouteObstacleType(node.obstacle_type))
             elif type(node) is RouteStopPositionNode:
-                route_geometry_schemas.append(
-                    RouteStopPositionSchema(
-                        type=RouteGeometryNodeType.STOP_POSITION,
-                        lat=node.lat,
-                        lon=node.lon,
-                        corresponding_stop_id=str(node.corresponding_stop_id)
-                    )
-                )
+                route_geometry.add_stop_position(node.lat, node.lon, str(node.corresponding_stop_id))
 
         return RouteSchema(
             id=str(db_route.id),
@@ -185,59 +336,18 @@ class LocalBusDataProvider:
             stops=stops_schemas,
             final_stop_order=db_route.final_stop_order,
             segments=route_segments_schemas,
-            geometry=route_geometry_schemas
+            geometry=route_geometry.build()
         )
 
-    async def prepare_local_stops_mapping(self, bbox):
-        stops_in_bbox = {}
-
-        # Получение и обход всех остановок из базы данных
-        all_db_stops = await StopDAO(self.session).get_all()
-        for stop in all_db_stops:
-
-            if stop.external_source_id is None:
-                continue
-
-            # Проверка принадлежности координат остановки к области ограничивающей рамки
-            is_inside_bbox = (bbox[0] <= stop.lon <= bbox[2]) and (bbox[1] <= stop.lat <= bbox[3])
-
-            # Если остановка находится внутри рамки, то она добавляется в выходной массив
-            if is_inside_bbox:
-                stops_in_bbox[stop.external_source_id] = self.db_stop_as_schema(stop)
-
-        return stops_in_bbox
-
-    async def prepare_local_routes_mapping(self, bbox):
-
-        routes_in_bbox = {}
-
-        # Получение и обход всех маршрутов из базы данных
-        all_db_routes = await RouteDAO(self.session).get_all()
-        for route in all_db_routes:
-
-            if route.external_source_id is None:
-                continue
-
-            is_inside_bbox = True
-
-            # Обход всех остановок маршрута: если хотя бы одна остановка находится вне
-            # ограничивающей рамки, то маршрут не добавляется в выходной список
-            for route_stop in route.stops:
-
-                if bbox is None:
-                    break
-
-                # Проверка принадлежности координат остановки к области ограничивающей рамки
-                lon = route_stop.stop.lon
-                lat = route_stop.stop.lat
-                is_inside_bbox = (bbox[0] <= lon <= bbox[2]) and (bbox[1] <= lat <= bbox[3])
-
-                # Если остановка находится внутри рамки, то она добавляется в выходной массив
-                if not is_inside_bbox:
-                    is_inside_bbox = False
-                    break
-
-            if is_inside_bbox:
-                routes_in_bbox[route.external_source_id] = self.db_route_as_schema(route)
-
-        return routes_in_bbox
+    async def get_stops_by_external_ids(self, external_ids: List[str],
+                                        source: BusDataProvider = BusDataProvider.OSM) -> Dict[str, StopSchema]:
+        """ Получение остановок по идентификаторам внешнего источника данных (в формате внешний id -> остановка) """
+        db_stops = await StopDAO(self.session).get_all_by_external_ids(external_ids, source)
+        return {db_stop.external_source_id: self.db_stop_as_schema(db_stop) for db_stop in db_stops}
+
+    async def get_routes_by_external_ids(self, external_ids: List[str],
+                                         source: BusDataProvider = BusDataProvider.OSM) -> Dict[str, RouteSchema]:
+        """ Получение маршрутов по идентификаторам внешнего источника данных (в формате внешний id -> маршрут) """
+        routes_versions = await RouteDAO(self.session).get_versions_by_external_ids(external_ids, source)
+        routes = await self.__get_cached_routes([(route_id, version) for route_id, version, _ in routes_versions])
+        return {route.external_source_id: route for route in routes}
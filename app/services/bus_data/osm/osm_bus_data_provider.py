@@ -1,22 +1,32 @@
+import asyncio
 import dataclasses
+import itertools
 import time
 import uuid
-from typing import List, Dict, Tuple, Any
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Dict, Tuple, AsyncIterator, Deque
 
-import utm
+import numpy as np
 from haversine import haversine, Unit
-from overpy import Overpass, Relation as OSMRelation, Node as OSMNode, RelationNode, RelationWay, Relation
+from overpy import Overpass, Relation as OSMRelation, Node as OSMNode, RelationNode, RelationWay, Relation, Result, \
+    RelationRelation
 from overpy.exception import OverPyException
 
 from app.common_types import BBox
 from app.logger import logger
-from app.schemas.enums import BusDataProvider, RouteGeometryNodeType, RouteObstacleType
+from app.process_pool import run_in_process_pool
+from app.schemas.enums import BusDataProvider, RouteObstacleType
 from app.schemas.route import RouteSchema
-from app.schemas.route_geometry import RouteGeometryNodeSchema, RouteStopPositionSchema, RouteObstacleSchema
+from app.schemas.route_geometry import RouteGeometry, RouteGeometryBuilder, OBSTACLE_TYPES
 from app.schemas.route_segment import RouteSegmentSchema
 from app.schemas.stop import StopSchema
-from app.services.bus_data.osm.wrappers import OSMWayWrapper, KDTreeWrapper
-from app.utils import utm_point_from_latlon, project_point_on_segment, frechet_distance
+from app.services.bus_data.local.local_bus_data_provider import LocalBusDataProvider
+from app.services.bus_data.osm.route_pairing import RoutePairingIndex
+from app.services.bus_data.osm.spatial_index import BBoxSpatialIndex, UTMNodeTable
+from app.services.bus_data.osm.wrappers import OSMWayWrapper
+from app.utils import project_utm_point_on_segment
+from config import app_config
 
 
 class OSMBusDataProvider:
@@ -25,15 +35,24 @@ class OSMBusDataProvider:
     # Документация Overpass API: https://dev.overpass-api.de/overpass-doc/en/
     # Веб-приложение для выполнения запросов: https://overpass-turbo.eu/#
 
+    # Количество маршрутов на процесс пула, построение которых выполняется с опережением при последовательном получении
+    ROUTES_BUILD_AHEAD_PER_WORKER = 2
+
     def __init__(self, local_stops_mapping: Dict[str, StopSchema] | None = None,
                  local_routes_mapping: Dict[str, RouteSchema] | None = None,
-                 overpass_api_mock=None):
+                 overpass_api_mock=None, local_data_provider: LocalBusDataProvider | None = None,
+                 reuse_local_routes: bool = True):
         if overpass_api_mock is None:
             self.api = Overpass()
         else:
             self.api = overpass_api_mock
         self.local_stops_mapping = local_stops_mapping or {}
         self.local_routes_mapping = local_routes_mapping or {}
+        # Провайдер данных локальной базы данных: остановки и маршруты, заранее синхронизированные с локальной базой
+        # данных, запрашиваются по id объектов OSM, присутствующих в ответе Overpass API (при reuse_local_routes=False
+        # сохранённые маршруты строятся заново, пр. при синхронизации)
+        self.local_data_provider = local_data_provider
+        self.reuse_local_routes = reuse_local_routes
 
     async def get_bus_data_in_bbox(self, bbox: BBox) -> Tuple[List[StopSchema], List[RouteSchema]]:
         """ Получение данных об автобусных маршрутах, остановках и препятствиях в ограниченной рамкой области """
@@ -84,11 +103,14 @@ class OSMBusDataProvider:
             logger.debug(f"BUS DATA > OSM | Failed to fetch route stops data!")
             return []
 
+        # Получение соответствий заранее синхронизированным остановкам
+        local_stops_mapping = await self.__get_local_stops_mapping([str(node.id) for node in response.nodes])
+
         # Формирование выходного списка остановок
         stops = []
         for node in response.nodes:
-            if str(node.id) in self.local_stops_mapping:
-                db_stop = self.local_stops_mapping[str(node.id)]
+            if str(node.id) in local_stops_mapping:
+                db_stop = local_stops_mapping[str(node.id)]
                 stops.append(db_stop)
             else:
                 stops.append(StopSchema(
@@ -101,6 +123,87 @@ class OSMBusDataProvider:
 
         return stops
 
+    async def get_routes_changes(self, routes_ids: List[int], since: datetime) -> Tuple[set, set, Dict[int, List[int]]]:
+        """
+        Определение маршрутов, изменённых в OSM после указанного момента
+
+        Маршрут считается изменённым, если после указанного момента изменилось отношение маршрута, любая из его дорог
+        (в том числе узлы геометрии дорог) или любой из его узлов (платформы и места остановок). Проверяются также
+        другие направления мастер-маршрутов, так как направления объединяются в один итоговый маршрут.
+
+        В качестве результата возвращаются id существующих в OSM маршрутов, id изменённых маршрутов (включая другие
+        направления мастер-маршрутов) и состав мастер-маршрутов.
+        """
+
+        ids_filter = ','.join(map(str, routes_ids))
+        changed_filter = f'(changed:"{since.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}")'
+
+        # Запрос существующих маршрутов и их мастер-маршрутов
+        existence_query_string = f"""
+            relation(id:{ids_filter}) -> .stored_routes;
+            .stored_routes out ids;
+            rel(br.stored_routes)[type=route_master]; out;
+        """
+
+        # Запрос изменённых маршрутов (с учётом изменений дорог и узлов)
+        changes_query_string = f"""
+            relation(id:{ids_filter}) -> .stored_routes;
+            rel(br.stored_routes)[type=route_master] -> .stored_route_masters;
+            (
+              .stored_routes;
+              rel(r.stored_route_masters)[route~"^(bus|trolleybus)$"];
+            ) -> .routes;
+            way(r.routes) -> .ways;
+            node(r.routes) -> .member_nodes;
+            node(w.ways) -> .way_nodes;
+
+            way.ways{changed_filter} -> .changed_ways;
+            node.way_nodes{changed_filter} -> .changed_way_nodes;
+            way.ways(bn.changed_way_nodes) -> .changed_geometry_ways;
+            node.member_nodes{changed_filter} -> .changed_member_nodes;
+            (
+              rel.routes{changed_filter};
+              rel.routes(bw.changed_ways);
+              rel.routes(bw.changed_geometry_ways);
+              rel.routes(bn.changed_member_nodes);
+            );
+            out ids;
+        """
+
+        # Отправка запросов к Overpass API
+        logger.debug("GP > BUS DATA > OSM | Fetching routes changes...")
+        start = time.perf_counter()
+        existence_response = self.api.query(existence_query_string)
+        changes_response = self.api.query(changes_query_string)
+        end = time.perf_counter()
+        logger.debug(f"GP > BUS DATA > OSM | Done in {end - start:3.2f} s!")
+
+        existing_ids, route_masters = set(), {}
+        for rel in existence_response.relations:
+            if rel.tags.get('type') == 'route_master':
+                route_masters[rel.id] = [m.ref for m in rel.members if type(m) is RelationRelation]
+            else:
+                existing_ids.add(rel.id)
+
+        changed_ids = {rel.id for rel in changes_response.relations}
+
+        return existing_ids, changed_ids, route_masters
+
+    @staticmethod
+    def affected_routes(routes_ids: List[int], changed_ids: set, route_masters: Dict[int, List[int]]) -> List[int]:
+        """ Отбор маршрутов, требующих перестроения (изменён сам маршрут или другое направление мастер-маршрута) """
+
+        # Формирование соответствий id маршрута -> id маршрутов того же мастер-маршрута
+        route_master_members = {}
+        for member_ids in route_masters.values():
+            for member_id in member_ids:
+                route_master_members.setdefault(member_id, set()).update(member_ids)
+
+        return [
+            route_id for route_id in routes_ids
+            if route_id in changed_ids or not changed_ids.isdisjoint(route_master_members.get(route_id, ()))
+        ]
+
     @dataclasses.dataclass
     class RouteRawData:
         """ Класс-контейнер для группировки данных, необходимых для построения маршрута OSM """
@@ -108,24 +211,68 @@ class OSMBusDataProvider:
         # становятся громоздкими и нечитаемыми
         node_by_id: Dict[int, OSMNode]
         way_by_id: Dict[int, OSMWayWrapper]
-        global_stop_positions: List[OSMNode]
-        global_stop_positions_kd_tree: KDTreeWrapper
+        # Таблица координат узлов маршрута в системе координат UTM (рассчитывается однократно для всего ответа
+        # Overpass API, все геометрические расчёты при построении маршрута используют её)
+        utm_table: UTMNodeTable
+        # Результаты запросов к общему пространственному индексу для каждой платформы маршрута (в порядке следования):
+        # ближайшие глобальные места остановок и ближайшие отрезки дорог маршрута в формате (id дороги, индекс отрезка)
+        platforms_global_stop_positions: List[List[OSMNode]]
+        platforms_way_segments: List[List[Tuple[int, int]]]
+        local_stops_mapping: Dict[str, StopSchema]
 
-    async def get_routes_in_bbox(self, bbox: BBox) -> List[RouteSchema]:
+    @dataclasses.dataclass
+    class ExtractedRoute:
+        """ Класс-контейнер для остановок и геометрии маршрута OSM до объединения пар маршрутов """
+        id: int
+        name: str
+        stops: List[StopSchema]
+        geometry: RouteGeometry
+
+    async def get_routes_in_bbox(self, bbox: BBox, routes_ids: List[int] | None = None) -> List[RouteSchema]:
         """ Получение всех маршрутов внутри ограничивающей рамки """
+        return [route async for route in self.iter_routes_in_bbox(bbox, routes_ids)]
+
+    async def iter_routes_in_bbox(self, bbox: BBox, routes_ids: List[int] | None = None) -> AsyncIterator[RouteSchema]:
+        """
+        Последовательное получение маршрутов внутри ограничивающей рамки
+
+        Извлечение остановок и геометрии и определение пар маршрутов выполняются для всех маршрутов сразу (пары
+        определяются по всему набору маршрутов), а итоговые маршруты строятся в пуле процессов с опережением (не более
+        ROUTES_BUILD_AHEAD_PER_WORKER маршрутов на процесс пула) и возвращаются в исходном порядке по мере готовности,
+        что позволяет передавать клиенту первые маршруты до завершения построения остальных без простоя пула.
+        Маршруты, построение которых завершилось ошибкой, пропускаются.
+
+        При заданном списке routes_ids запрашиваются только указанные маршруты и другие направления их
+        мастер-маршрутов (необходимы для определения пар маршрутов).
+        """
 
         # Преобразование ограничивающей рамки в формат OSM
         formatted_bbox = self.as_osm_bbox(bbox)
 
         # Формирование строки запроса
-        query_string = f"""
-            // Автобусные и троллейбусные маршруты
+        if routes_ids is None:
+            routes_statement = f"""
             (
               relation[route=bus]{str(formatted_bbox)};
               relation[route=trolleybus]{str(formatted_bbox)};
-            ) -> .routes;
+            ) -> .routes;"""
+        else:
+            routes_statement = f"""
+            relation(id:{','.join(map(str, routes_ids))}) -> .selected_routes;
+            rel(br.selected_routes)[type=route_master] -> .selected_route_masters;
+            (
+              .selected_routes;
+              rel(r.selected_route_masters)[route~"^(bus|trolleybus)$"];
+            ) -> .routes;"""
+
+        query_string = f"""
+            // Автобусные и троллейбусные маршруты
+            {routes_statement}
             .routes out geom;
 
+            // Мастер-маршруты (объединяют направления движения одного маршрута)
+            rel(br.routes)[type=route_master]; out;
+
             // Платформы и места остановок
             node[highway=bus_stop][public_transport=stop_position]{str(formatted_bbox)}; out;
             node[highway=bus_stop][public_transport=platform]{str(formatted_bbox)}; out;
@@ -147,7 +294,120 @@ class OSMBusDataProvider:
             logger.debug(f"GP > BUS DATA > OSM | Done in {end - start:3.2f} s!")
         except OverPyException:
             logger.debug(f"GP > BUS DATA > OSM | Failed to fetch routes data!")
-            return []
+            return
+
+        # Получение соответствий заранее синхронизированным остановкам (платформы являются участниками отношений
+        # маршрутов)
+        local_stops_mapping = await self.__get_local_stops_mapping(list({
+            str(member.ref) for rel in response.relations for member in rel.members if type(member) is RelationNode
+        }))
+
+        # Подготовка исходных данных, извлечение маршрутов и определение пар маршрутов в пуле процессов
+        extracted_routes, route_pairs = await self.__plan_routes(response, bbox, local_stops_mapping)
+
+        # Получение заранее синхронизированных маршрутов (полностью загружаются только найденные маршруты)
+        local_routes_mapping = await self.__get_local_routes_mapping([str(route_id) for route_id, _ in route_pairs])
+
+        # Задачи построения итоговых маршрутов в порядке следования маршрутов
+        window = self.ROUTES_BUILD_AHEAD_PER_WORKER * app_config.PROCESS_POOL_WORKERS_NUM
+        pending_routes: Deque[asyncio.Future] = deque()
+        route_pairs_iter = iter(route_pairs)
+        try:
+            while True:
+                # Постановка в пул задач построения следующих маршрутов в пределах окна
+                for route_id, pair_route_id in itertools.islice(
+                        route_pairs_iter, max(window - len(pending_routes), 0)
+                ):
+                    if str(route_id) in local_routes_mapping:
+                        # Маршруты, заранее синхронизированные с локальной базой данных, не строятся повторно
+                        route_future = asyncio.get_running_loop().create_future()
+                        route_future.set_result(local_routes_mapping[str(route_id)])
+                    else:
+                        route_future = asyncio.ensure_future(self.__build_route(
+                            extracted_routes[route_id],
+                            extracted_routes[pair_route_id] if pair_route_id is not None else None
+                        ))
+                    pending_routes.append(route_future)
+
+                if len(pending_routes) == 0:
+                    break
+
+                route = await pending_routes.popleft()
+                if route is not None:
+                    yield route
+        finally:
+            # Отмена построения маршрутов, не переданных получателю (пр. при разрыве соединения клиентом)
+            for route_future in pending_routes:
+                route_future.cancel()
+
+    @staticmethod
+    async def __build_route(route: ExtractedRoute, paired_route: ExtractedRoute | None) -> RouteSchema | None:
+        """ Построение итогового маршрута в пуле процессов (при ошибке маршрут пропускается, как и при извлечении) """
+        try:
+            return await run_in_process_pool(OSMBusDataProvider.build_route_job, route, paired_route)
+        except Exception:
+            logger.debug(f"Failed to build route <OSM #({route.id})>")
+            return None
+
+    async def __get_local_stops_mapping(self, stops_ids: List[str]) -> Dict[str, StopSchema]:
+        """ Получение соответствий id остановок OSM -> остановки локальной базы данных """
+        if self.local_data_provider is None:
+            return self.local_stops_mapping
+        return {**self.local_stops_mapping, **await self.local_data_provider.get_stops_by_external_ids(stops_ids)}
+
+    async def __get_local_routes_mapping(self, routes_ids: List[str]) -> Dict[str, RouteSchema]:
+        """ Получение соответствий id маршрутов OSM -> маршруты локальной базы данных """
+        if self.local_data_provider is None or not self.reuse_local_routes:
+            return self.local_routes_mapping
+        return {**self.local_routes_mapping, **await self.local_data_provider.get_routes_by_external_ids(routes_ids)}
+
+    @staticmethod
+    async def __plan_routes(response: Result, bbox: BBox, local_stops_mapping: Dict[str, StopSchema]) \
+            -> Tuple[Dict[int, ExtractedRoute], List[Tuple[int, int | None]]]:
+        """
+        Подготовка маршрутов к построению в общем пуле процессов
+
+        Построение маршрутов требует значительных вычислительных ресурсов, поэтому выполняется вне цикла событий в
+        несколько этапов:
+        1) Подготовка исходных данных (одна задача): индексация узлов и дорог, построение общего пространственного
+           индекса мест остановок и отрезков дорог, фильтрация маршрутов, группировка маршрутов по мастер-маршрутам
+           и формирование независимого набора данных для каждого маршрута.
+        2) Извлечение остановок и геометрии (отдельная задача для каждого маршрута).
+        3) Определение пар маршрутов (одна задача).
+        4) Объединение пар маршрутов и построение сегментов (отдельная задача для каждого итогового маршрута,
+           выполняется в iter_routes_in_bbox по мере запроса маршрутов).
+        """
+
+        # Подготовка исходных данных маршрутов
+        prepared_routes, route_masters = await run_in_process_pool(
+            OSMBusDataProvider.prepare_routes_job, response, bbox, local_stops_mapping
+        )
+
+        if len(prepared_routes) == 0:
+            return {}, []
+
+        # Парсинг маршрутов с их разбором на набор остановок и геометрию (параллельно для каждого маршрута)
+        jobs = [
+            run_in_process_pool(OSMBusDataProvider.extract_route_job, route_relation, route_raw_data)
+            for route_relation, route_raw_data in prepared_routes
+        ]
+        extracted_routes = {
+            result.id: result for result in await asyncio.gather(*jobs) if result is not None
+        }
+
+        # Определение парных маршрутов (для расчёта достаточно остановок маршрутов)
+        route_pairs = await run_in_process_pool(
+            OSMBusDataProvider.plan_route_pairs_job,
+            {route_id: route.stops for route_id, route in extracted_routes.items()},
+            route_masters
+        )
+
+        return extracted_routes, route_pairs
+
+    @staticmethod
+    def prepare_routes_job(response: Result, bbox: BBox, local_stops_mapping: Dict[str, StopSchema]) \
+            -> Tuple[List[Tuple[OSMRelation, RouteRawData]], Dict[int, List[int]]]:
+        """ Задача пула процессов: подготовка исходных данных для построения маршрутов """
 
         # Формирование соответствий id -> узел
         node_by_id = {}
@@ -159,101 +419,223 @@ class OSMBusDataProvider:
         for way in response.ways:
             way_by_id[way.id] = OSMWayWrapper(id=way.id, nodes=way.nodes, tags=way.tags)
 
-        # Парсинг найденных в границах рамки мест остановки общественного транспорта, построение kd-дерева
-        # (необходимо для разрешения ситуаций с отсутствующими в объекте маршрута данными)
-        global_stop_positions = []
-        for node in node_by_id.values():
-            if node.tags.get('public_transport') == 'stop_position':
-                global_stop_positions.append(node)
-        global_stop_positions_as_utm_points = [utm.from_latlon(float(node.lat), float(node.lon))[:2] for node in
-                                               global_stop_positions]
-        global_stop_positions_kd_tree = KDTreeWrapper(global_stop_positions_as_utm_points)
+        # Построение общего пространственного индекса мест остановок и отрезков дорог в границах рамки
+        # (необходим для разрешения ситуаций с отсутствующими в объекте маршрута данными)
+        spatial_index = BBoxSpatialIndex(node_by_id, way_by_id)
 
-        # Группировка данных после парсинга
-        route_raw_data = self.RouteRawData(node_by_id, way_by_id, global_stop_positions, global_stop_positions_kd_tree)
+        # Разделение отношений на маршруты и мастер-маршруты
+        route_relations = []
+        route_masters = {}
+        for rel in response.relations:
+            if rel.tags.get('type') == 'route_master':
+                route_masters[rel.id] = [m.ref for m in rel.members if type(m) is RelationRelation]
+            else:
+                route_relations.append(rel)
 
         # Фильтрация маршрутов, находящихся за пределами ограничивающей рамки
-        bbox_route_relations = await self.__filter_exceeding_routes(response.relations, node_by_id, bbox)
+        bbox_route_relations = OSMBusDataProvider.__filter_exceeding_routes(route_relations, node_by_id, bbox)
 
         # Фильтрация "плохих" маршрутов (пр. не содержащих дороги или остановки)
-        filtered_route_relations = await self.__filter_bad_routes(bbox_route_relations)
+        filtered_route_relations = OSMBusDataProvider.__filter_bad_routes(bbox_route_relations)
 
-        # Парсинг маршрутов с их разбором на набор остановок и геометрию
-        routes = {}
+        # Формирование независимых наборов данных для каждого маршрута
+        prepared_routes = []
         for route_relation in filtered_route_relations:
             try:
-                stops, geometry = await self.__extract_route_stops_and_geometry(route_relation, route_raw_data)
-                routes[route_relation.id] = (stops, geometry, route_relation)
-            except Exception as e:
+                prepared_routes.append(OSMBusDataProvider.__slice_route_raw_data(
+                    route_relation, node_by_id, way_by_id, spatial_index, local_stops_mapping
+                ))
+            except KeyError:
                 logger.debug(f"Failed to build route <OSM #({route_relation.id})>")
 
+        return prepared_routes, route_masters
+
+    @staticmethod
+    def __slice_route_raw_data(route_relation: OSMRelation, node_by_id: Dict[int, OSMNode],
+                               way_by_id: Dict[int, OSMWayWrapper], spatial_index: BBoxSpatialIndex,
+                               local_stops_mapping: Dict[str, StopSchema]) -> Tuple[OSMRelation, RouteRawData]:
+        """
+        Формирование набора данных, необходимого для построения отдельного маршрута
+
+        Объекты overpy содержат ссылку на весь результат запроса, поэтому для передачи в задачи пула процессов
+        создаются их "отвязанные" копии, включающие только узлы и дороги самого маршрута. Поиск ближайших к платформам
+        мест остановок и отрезков дорог выполняется здесь же по общему пространственному индексу, в задачу передаются
+        только его результаты.
+        """
+
+        # Копирование узлов (с сохранением единственной копии для каждого идентификатора)
+        sliced_node_by_id = {}
+
+        def detach_node(node: OSMNode) -> OSMNode:
+            if node.id not in sliced_node_by_id:
+                sliced_node_by_id[node.id] = OSMNode(node_id=node.id, lat=node.lat, lon=node.lon,
+                                                     tags=dict(node.tags), attributes={})
+            return sliced_node_by_id[node.id]
+
+        # Копирование участников маршрута
+        members = []
+        sliced_way_by_id = {}
+        platforms = []
+        for m in route_relation.members:
+            if type(m) is RelationNode:
+                members.append(RelationNode(ref=m.ref, role=m.role, attributes={}))
+                node = detach_node(node_by_id[m.ref])
+                if m.role and m.role.startswith('platform'):
+                    platforms.append(node)
+            elif type(m) is RelationWay:
+                members.append(RelationWay(ref=m.ref, role=m.role, attributes={}))
+                if m.ref not in sliced_way_by_id:
+                    way = way_by_id[m.ref]
+                    sliced_way_by_id[m.ref] = OSMWayWrapper(id=way.id, tags=dict(way.tags),
+                                                            nodes=[detach_node(node) for node in way.nodes])
+        detached_route_relation = OSMRelation(rel_id=route_relation.id, tags=dict(route_relation.tags),
+                                              members=members, attributes={})
+
+        # Запросы к общему пространственному индексу: глобальные места остановок вблизи платформ маршрута и отрезки
+        # дорог маршрута вблизи платформ
+        platforms_as_utm_points = spatial_index.utm_table.get_points(node.id for node in platforms)
+        platforms_global_stop_positions = [
+            [detach_node(node) for node in stop_positions]
+            for stop_positions in spatial_index.query_stop_positions(platforms_as_utm_points, r=30)
+        ]
+        platforms_way_segments = spatial_index.query_way_segments(platforms_as_utm_points, r=50,
+                                                                  way_ids=sliced_way_by_id.keys())
+
+        # Координаты узлов маршрута в системе координат UTM
+        sliced_utm_table = spatial_index.utm_table.slice(sliced_node_by_id.keys())
+
+        route_raw_data = OSMBusDataProvider.RouteRawData(
+            sliced_node_by_id, sliced_way_by_id, sliced_utm_table, platforms_global_stop_positions,
+            platforms_way_segments, local_stops_mapping
+        )
+
+        return detached_route_relation, route_raw_data
+
+    @staticmethod
+    def extract_route_job(route_relation: OSMRelation, route_raw_data: RouteRawData) -> ExtractedRoute | None:
+        """ Задача пула процессов: извлечение остановок и геометрии отдельного маршрута """
+
+        try:
+            stops, geometry = OSMBusDataProvider.__extract_route_stops_and_geometry(route_relation, route_raw_data)
+        except Exception as e:
+            logger.debug(f"Failed to build route <OSM #({route_relation.id})>")
+            return None
+
+        return OSMBusDataProvider.ExtractedRoute(
+            id=route_relation.id,
+            name=(route_relation.tags.get('name') or 'Безымянный маршрут'),
+            stops=stops,
+            geometry=geometry
+        )
+
+    @staticmethod
+    def plan_route_pairs_job(routes_stops: Dict[int, List[StopSchema]],
+                             route_masters: Dict[int, List[int]] | None = None) -> List[Tuple[int, int | None]]:
+        """
+        Задача пула процессов: определение парных маршрутов
+
+        В качестве результата возвращается список итоговых маршрутов в формате (id маршрута, id парного маршрута),
+        для маршрутов без пары (в том числе круговых) id парного маршрута равен None.
+        """
+
+        # Формирование соответствий id маршрута -> id маршрутов того же мастер-маршрута
+        # (в OSM направления движения одного маршрута объединяются отношением route_master). Мастер-маршруты,
+        # от которых в рамке осталось одно направление, не учитываются
+        route_master_members = {}
+        for member_ids in (route_masters or {}).values():
+            member_ids = [member_id for member_id in member_ids if member_id in routes_stops]
+            if len(member_ids) < 2:
+                continue
+            for member_id in member_ids:
+                route_master_members[member_id] = member_ids
+
+        # Построение индекса для отбора маршрутов-кандидатов при поиске пары
+        pairing_index = RoutePairingIndex(routes_stops)
+
         # Инициализация словаря для кэширования расстояний между маршрутами
-        self.cached_distances = {}
+        cached_distances = {}
 
         # Инициализация списка обработанных маршрутов
         processed_route_ids = []
 
-        # Инициализация выходного списка маршрутов
-        routes_out = []
+        # Инициализация выходного списка пар маршрутов
+        route_pairs = []
 
         # Обход всех маршрутов (с целью определения парного маршрута)
-        for route_id, (stops, geometry, rel) in routes.items():
+        for route_id, stops in routes_stops.items():
 
             # Маршруты, которые уже были определены как пара для другого маршрута, отбрасываются
             if route_id in processed_route_ids:
                 continue
 
             # Проверка, является ли маршрут круговым
-            is_cyclic = await self.__is_route_cyclic(stops)
+            is_cyclic = OSMBusDataProvider.__is_route_cyclic(stops)
 
             if is_cyclic:
                 # Добавление кругового маршрута (особой обработки не требуется)
-                processed_route_ids.append(rel.id)
-                final_stop_order = None
+                processed_route_ids.append(route_id)
+                pair_route_id = None
             else:
-                # Если маршрут не является круговым, то производится попытка найти парный маршрут
-                has_pair, pair_route_id = await self.__find_matching_route(route_id, routes, processed_route_ids)
-
-                if has_pair:
-                    # Если парный маршрут найден
-
-                    # Получение параметров парного маршрута
-                    paired_stops, paired_geometry, paired_rel = routes[pair_route_id]
+                # Если маршрут не является круговым, то производится попытка найти парный маршрут: для маршрутов,
+                # входящих в мастер-маршрут, пара ищется только среди других направлений того же мастер-маршрута,
+                # для остальных - среди маршрутов без мастер-маршрута, отобранных индексом
+                if route_id in route_master_members:
+                    candidate_ids = [
+                        other_id for other_id in route_master_members[route_id] if other_id != route_id
+                    ]
+                else:
+                    candidate_ids = [
+                        other_id for other_id in pairing_index.get_candidates(route_id)
+                        if other_id not in route_master_members
+                    ]
 
-                    # Объединение пары маршрутов
-                    stops, geometry, final_stop_order = await self.__join_route_pair(
-                        stops, geometry,
-                        paired_stops, paired_geometry
-                    )
+                has_pair, pair_route_id = OSMBusDataProvider.__find_matching_route(
+                    route_id, candidate_ids, pairing_index, processed_route_ids, cached_distances,
+                    is_route_master_member=route_id in route_master_members
+                )
 
-                    # Отметка маршрутов как уже обработанных
-                    processed_route_ids.append(rel.id)
+                if has_pair:
+                    # Если парный маршрут найден, то оба маршрута отмечаются как уже обработанные
+                    processed_route_ids.append(route_id)
                     processed_route_ids.append(pair_route_id)
                 else:
                     # Иначе считается, что у маршрута нет пары
-                    final_stop_order = None
+                    pair_route_id = None
 
-            route_segments = self.construct_route_segments(stops, geometry)
+            route_pairs.append((route_id, pair_route_id))
 
-            if str(route_id) in self.local_routes_mapping:
-                routes_out.append(self.local_routes_mapping[str(route_id)])
-            else:
-                # Создание объекта маршрута и добавление в общий список маршрутов
-                route = RouteSchema(
-                    id=str(rel.id),
-                    source=BusDataProvider.OSM,
-                    name=(rel.tags.get('name') or 'Безымянный маршрут'),
-                    stops=stops,
-                    final_stop_order=final_stop_order,
-                    geometry=geometry,
-                    segments=route_segments
-                )
-                routes_out.append(route)
+        return route_pairs
 
-        return routes_out
+    @staticmethod
+    def build_route_job(route: ExtractedRoute, paired_route: ExtractedRoute | None = None) -> RouteSchema:
+        """ Задача пула процессов: объединение пары маршрутов и построение сегментов итогового маршрута """
+
+        stops, geometry = route.stops, route.geometry
+
+        if paired_route is not None:
+            # Объединение пары маршрутов
+            stops, geometry, final_stop_order = OSMBusDataProvider.__join_route_pair(
+                stops, geometry,
+                paired_route.stops, paired_route.geometry
+            )
+        else:
+            final_stop_order = None
+
+        route_segments = OSMBusDataProvider.construct_route_segments(stops, geometry)
+
+        # Создание объекта маршрута
+        return RouteSchema(
+            id=str(route.id),
+            source=BusDataProvider.OSM,
+            name=route.name,
+            stops=stops,
+            final_stop_order=final_stop_order,
+            geometry=geometry,
+            segments=route_segments
+        )
 
     @staticmethod
-    async def __bind_platforms_to_stop_positions(route_relation: OSMRelation, route_raw_data: RouteRawData)\
+    def __bind_platforms_to_stop_positions(route_relation: OSMRelation, route_raw_data: RouteRawData)\
             -> Tuple[List[OSMNode], List[OSMNode]]:
         """
         Связывание платформ и мест остановок транспорта
@@ -275,53 +657,46 @@ class OSMBusDataProvider:
         # Распаковка сгруппированных данных маршрута
         node_by_id = route_raw_data.node_by_id
         way_by_id = route_raw_data.way_by_id
-        global_stop_positions = route_raw_data.global_stop_positions
-        global_stop_positions_kd_tree = route_raw_data.global_stop_positions_kd_tree
+        utm_table = route_raw_data.utm_table
 
         # Подготовка локальных данных платформ
         platforms = []
         for m in route_relation.members:
             if type(m) is RelationNode and m.role.startswith('platform'):
                 platforms.append(node_by_id[m.ref])
-        platforms_as_utm_points = [utm_point_from_latlon(node.lat, node.lon) for node in platforms]
 
         # Подготовка локальных данных мест остановок
         raw_stop_positions = []
         for m in route_relation.members:
             if type(m) is RelationNode and m.role.startswith('stop'):
                 raw_stop_positions.append(node_by_id[m.ref])
-        stop_positions_as_utm_points = [utm_point_from_latlon(node.lat, node.lon) for node in raw_stop_positions]
-        stop_positions_kd_tree = KDTreeWrapper(stop_positions_as_utm_points)
 
-        # Определение для каждой платформы ближайшего места остановки (на основе локальных данных)
-        platforms_closest_stop_position_indices, _ = stop_positions_kd_tree.query_radius(
-            platforms_as_utm_points, return_distance=True, sort_results=True, r=30
-        )
-        stop_positions = []
-        for i, platform in enumerate(platforms_closest_stop_position_indices):
-            closest_stop_position_indices = platforms_closest_stop_position_indices[i]
-            if len(closest_stop_position_indices) == 0:
-                stop_positions.append(None)
-            else:
-                closest_stop_positions = [raw_stop_positions[j] for j in closest_stop_position_indices]
-                closest_stop_position = closest_stop_positions[0]
-                stop_positions.append(closest_stop_position)
+        # Определение для каждой платформы ближайшего места остановки (на основе локальных данных).
+        # Число остановок маршрута невелико, поэтому расстояния рассчитываются по таблице координат UTM
+        # непосредственно (матрица расстояний платформа - место остановки), без построения kd-дерева
+        platforms_as_utm_points = utm_table.get_points(node.id for node in platforms)
+        stop_positions = [None] * len(platforms)
+        if len(platforms) > 0 and len(raw_stop_positions) > 0:
+            stop_positions_as_utm_points = utm_table.get_points(node.id for node in raw_stop_positions)
+            distances = np.linalg.norm(
+                platforms_as_utm_points[:, None, :] - stop_positions_as_utm_points[None, :, :], axis=2
+            )
+            closest_stop_position_indices = distances.argmin(axis=1)
+            for i, j in enumerate(closest_stop_position_indices):
+                if distances[i, j] <= 30:
+                    stop_positions[i] = raw_stop_positions[j]
 
         # Если каждой платформе было сопоставлено место остановки - выход из функции
         if None not in stop_positions:
             return platforms, stop_positions
 
-        # Определение для каждой платформы ближайшего места остановки (на основе глобальных данных)
+        # Определение для каждой платформы ближайшего места остановки (на основе глобальных данных, найденных по
+        # общему пространственному индексу)
         for i, (platform, stop_position) in enumerate(zip(platforms, stop_positions)):
             if stop_position is None:
-                closest_stop_position_indices, _ = global_stop_positions_kd_tree.query_radius(
-                    [platforms_as_utm_points[i]], return_distance=True, sort_results=True, r=30
-                )
-
-                if len(closest_stop_position_indices[0]) > 0:
-                    closest_stop_positions = [global_stop_positions[j] for j in closest_stop_position_indices[0]]
-                    closest_stop_position = closest_stop_positions[0]
-                    stop_positions[i] = closest_stop_position
+                closest_stop_positions = route_raw_data.platforms_global_stop_positions[i]
+                if len(closest_stop_positions) > 0:
+                    stop_positions[i] = closest_stop_positions[0]
 
         # Если каждой платформе было сопоставлено место остановки - выход из функции
         if None not in stop_positions:
@@ -329,31 +704,21 @@ class OSMBusDataProvider:
 
         # Определение для каждой платформы ближайшего места остановки (вручную)
 
-        # Извлечение всех дорог маршрута
-        route_ways = []
-        for m in route_relation.members:
-            if type(m) is RelationWay:
-                route_ways.append(way_by_id[m.ref])
-
-        # Преобразование дорог в набор отрезков
-        way_segments = []
-        way_segments_as_utm_points = []
-        for way in route_ways:
-            for i, (node1, node2) in enumerate(zip(way.nodes, way.nodes[1:])):
-                way_segments.append((node1, node2, i, way.id))
-                way_segments_as_utm_points.append(utm.from_latlon(float(node1.lat), float(node1.lon))[:2])
-                way_segments_as_utm_points.append(utm.from_latlon(float(node2.lat), float(node2.lon))[:2])
-        way_segment_kd_tree = KDTreeWrapper(way_segments_as_utm_points, leaf_size=40)
+        # Фиксация узлов дорог маршрута до начала обработки (при обработке в дороги могут добавляться новые узлы,
+        # тогда как индексы отрезков соответствуют исходной геометрии)
+        way_nodes_by_id = {way_id: list(way.nodes) for way_id, way in way_by_id.items()}
 
         # Обход всех платформ, для которых не было найдено место остановки
         for i, (platform, stop_position) in enumerate(zip(platforms, stop_positions)):
             if stop_position is None:
 
-                # Определение ближайших отрезков дороги
-                closest_way_segments_indices = way_segment_kd_tree.query_radius([platforms_as_utm_points[i]], r=50)[0]
-                if len(closest_way_segments_indices) == 0:
+                # Определение ближайших отрезков дороги (на основе общего пространственного индекса)
+                if len(route_raw_data.platforms_way_segments[i]) == 0:
                     break
-                closest_way_segments = [way_segments[i // 2] for i in closest_way_segments_indices]
+                closest_way_segments = [
+                    (way_nodes_by_id[way_id][j], way_nodes_by_id[way_id][j + 1], j, way_id)
+                    for way_id, j in route_raw_data.platforms_way_segments[i]
+                ]
 
                 best_segment = None
                 best_position = None
@@ -367,21 +732,23 @@ class OSMBusDataProvider:
                 for segment in closest_way_segments:
 
                     node1, node2, segment_index, way_id = segment
+                    utm_node1, utm_node2 = utm_table.get_points((node1.id, node2.id))
 
                     # Расстояние между началом сегмента и платформой
-                    dist_to_node1 = haversine((node1.lat, node1.lon), (platform.lat, platform.lon),
-                                              unit=Unit.METERS)
+                    dist_to_node1 = float(np.linalg.norm(utm_node1 - platforms_as_utm_points[i]))
 
                     # Расстояние между концом сегмента и платформой
-                    dist_to_node2 = haversine((node2.lat, node2.lon), (platform.lat, platform.lon),
-                                              unit=Unit.METERS)
+                    dist_to_node2 = float(np.linalg.norm(utm_node2 - platforms_as_utm_points[i]))
 
                     # Расчёт проекции платформы на отрезок и проекционного расстояния
-                    projected_position, projection_distance = project_point_on_segment(
-                        ((node1.lat, node1.lon), (node2.lat, node2.lon)),
-                        (platform.lat, platform.lon),
+                    utm_projected_position, projection_distance = project_utm_point_on_segment(
+                        (utm_node1, utm_node2),
+                        platforms_as_utm_points[i],
                         0.1
                     )
+                    projected_position = None
+                    if utm_projected_position is not None:
+                        projected_position = utm_table.to_latlon(utm_projected_position)
 
                     # Группировка рассчитанных точек и расстояний для выбора лучшей
                     candidates = list(zip(
@@ -451,8 +818,9 @@ class OSMBusDataProvider:
 
         raise ValueError(f"Cannot resolve stop position for route #({route_relation.id})")
 
-    async def __extract_route_stops_and_geometry(self, route_relation: OSMRelation, route_raw_data: RouteRawData) \
-            -> Tuple[List[StopSchema], List[RouteGeometryNodeSchema]]:
+    @staticmethod
+    def __extract_route_stops_and_geometry(route_relation: OSMRelation, route_raw_data: RouteRawData) \
+            -> Tuple[List[StopSchema], RouteGeometry]:
         """
         Извлечение информации об остановках и геометрии маршрута
 
@@ -472,24 +840,19 @@ class OSMBusDataProvider:
 
         # Связывание платформ и мест остановок транспорта
         # (с разрешением конфликтов при отсутствии места остановки)
-        platforms, stop_positions = await self.__bind_platforms_to_stop_positions(route_relation, route_raw_data)
+        platforms, stop_positions = OSMBusDataProvider.__bind_platforms_to_stop_positions(route_relation,
+                                                                                          route_raw_data)
         assert len(stop_positions) == len(platforms)
 
         # Получение объектов дорог, по которым проходит маршрут
         route_ways_members = [m for m in route_relation.members if type(m) is RelationWay]
         ways = [route_raw_data.way_by_id[m.ref] for m in route_ways_members]
 
-        # Инициализация списка для сохранения пройденных узлов.
+        # Инициализация геометрии для сохранения пройденных узлов.
         # Первый узел - место первой остановки автобуса
         first_stop_node = stop_positions[0]
-        route_nodes = [
-            RouteStopPositionSchema(
-                type=RouteGeometryNodeType.STOP_POSITION,
-                lat=first_stop_node.lat,
-                lon=first_stop_node.lon,
-                corresponding_stop_id=str(platforms[0].id)
-            )
-        ]
+        route_nodes = RouteGeometryBuilder()
+        route_nodes.add_stop_position(first_stop_node.lat, first_stop_node.lon, str(platforms[0].id))
 
         # Курсор для отслеживания индекса следующей по ходу движения остановки
         next_stop_position_index = 1
@@ -598,51 +961,22 @@ class OSMBusDataProvider:
 
                 if node.id == stop_positions[next_stop_position_index].id:
                     # Добавление очередного места остановки
-                    route_nodes.append(RouteStopPositionSchema(
-                        type=RouteGeometryNodeType.STOP_POSITION,
-                        lat=node.lat,
-                        lon=node.lon,
-                        corresponding_stop_id=str(platforms[next_stop_position_index].id)
-                    ))
+                    route_nodes.add_stop_position(node.lat, node.lon, str(platforms[next_stop_position_index].id))
                     next_stop_position_index += 1
                 elif node.tags.get('highway') == 'crossing':
                     # Добавление пешеходного перехода
-                    route_nodes.append(RouteObstacleSchema(
-                        type=RouteGeometryNodeType.OBSTACLE,
-                        obstacle_type=RouteObstacleType.CROSSING,
-                        lat=node.lat,
-                        lon=node.lon
-                    ))
+                    route_nodes.add_obstacle(node.lat, node.lon, RouteObstacleType.CROSSING)
                 elif node.tags.get('highway') == 'traffic_signals':
                     # Добавление светофора
-                    route_nodes.append(RouteObstacleSchema(
-                        type=RouteGeometryNodeType.OBSTACLE,
-                        obstacle_type=RouteObstacleType.TRAFFIC_SIGNALS,
-                        lat=node.lat,
-                        lon=node.lon
-                    ))
+                    route_nodes.add_obstacle(node.lat, node.lon, RouteObstacleType.TRAFFIC_SIGNALS)
                 elif node.tags.get('traffic_calming') in ('bump', 'hump', 'table'):
                     # Добавление лежачего полицейского
-                    route_nodes.append(RouteObstacleSchema(
-                        type=RouteGeometryNodeType.OBSTACLE,
-                        obstacle_type=RouteObstacleType.SPEEDBUMP,
-                        lat=node.lat,
-                        lon=node.lon
-                    ))
+                    route_nodes.add_obstacle(node.lat, node.lon, RouteObstacleType.SPEEDBUMP)
                 elif way.tags.get('junction') in ('roundabout', 'circular') and not last_was_roundabout:
-                    route_nodes.append(RouteObstacleSchema(
-                        type=RouteGeometryNodeType.OBSTACLE,
-                        obstacle_type=RouteObstacleType.ROUNDABOUT,
-                        lat=node.lat,
-                        lon=node.lon
-                    ))
+                    route_nodes.add_obstacle(node.lat, node.lon, RouteObstacleType.ROUNDABOUT)
                 else:
                     # Добавление узла геометрии
-                    route_nodes.append(RouteGeometryNodeSchema(
-                        type=RouteGeometryNodeType.GEOMETRY,
-                        lat=node.lat,
-                        lon=node.lon
-                    ))
+                    route_nodes.add_node(node.lat, node.lon)
 
                 # Обновление последнего посещённого узла
                 last_node_id = node.id
@@ -658,17 +992,18 @@ class OSMBusDataProvider:
             if next_stop_position_index == len(stop_positions):
                 break
 
-        for node in route_nodes:
-            if node.type != RouteGeometryNodeType.STOP_POSITION:
-                continue
-            if node.corresponding_stop_id in self.local_stops_mapping:
-                node.corresponding_stop_id = self.local_stops_mapping[str(node.corresponding_stop_id)].id
+        # Замена идентификаторов остановок на идентификаторы остановок локальной базы данных
+        geometry = route_nodes.build()
+        local_stops_mapping = route_raw_data.local_stops_mapping
+        for i in geometry.stop_position_indices:
+            if geometry.stop_ref[i] in local_stops_mapping:
+                geometry.stop_ref[i] = str(local_stops_mapping[geometry.stop_ref[i]].id)
 
         # Формирование отдельного списка платформ
         stops = []
         for node in platforms:
-            if str(node.id) in self.local_stops_mapping:
-                db_stop = self.local_stops_mapping[str(node.id)]
+            if str(node.id) in local_stops_mapping:
+                db_stop = local_stops_mapping[str(node.id)]
                 stops.append(db_stop)
             else:
                 stops.append(
@@ -682,15 +1017,15 @@ class OSMBusDataProvider:
                 )
 
         # Проверка совпадения количества платформ и остановок, а также их соответствия друг другу
-        stop_positions = [n for n in route_nodes if n.type == RouteGeometryNodeType.STOP_POSITION]
-        for stop_position, platform_node in zip(stop_positions, stops):
-            assert str(stop_position.corresponding_stop_id) == str(platform_node.id)
-        assert len(platforms) == len(stop_positions)
+        stop_refs = geometry.stop_ref[geometry.stop_position_indices]
+        for stop_ref, platform_node in zip(stop_refs, stops):
+            assert str(stop_ref) == str(platform_node.id)
+        assert len(platforms) == len(stop_refs)
 
-        return stops, route_nodes
+        return stops, geometry
 
     @staticmethod
-    async def __filter_exceeding_routes(route_relations: List[Relation], node_by_id: Dict[int, OSMNode], bbox: BBox):
+    def __filter_exceeding_routes(route_relations: List[Relation], node_by_id: Dict[int, OSMNode], bbox: BBox):
         """ Фильтрация маршрутов по вхождению в ограничивающую рамку """
 
         # Инициализация списка отфильтрованных маршрутов
@@ -719,7 +1054,7 @@ class OSMBusDataProvider:
         return filtered_route_relations
 
     @staticmethod
-    async def __filter_bad_routes(route_relations: List[Relation]):
+    def __filter_bad_routes(route_relations: List[Relation]):
         """ Фильтрация некорректных маршрутов """
 
         # В базе данных OSM могут встречаться пустые маршруты, маршруты без остановок или с одной остановкой,
@@ -747,9 +1082,13 @@ class OSMBusDataProvider:
         return filtered_route_relations
 
     @staticmethod
-    async def __is_route_cyclic(route_stops: List[StopSchema], tolerance=1000):
+    def __is_route_cyclic(route_stops: List[StopSchema], tolerance=1000):
         """ Проверка того, является ли маршрут круговым """
 
+        # Маршрут из одной остановки не может быть ни круговым, ни парным
+        if len(route_stops) < 2:
+            return False
+
         # Определение по расстоянию между первой и последней остановкой
         # (для круговых маршрутов оно должно быть небольшим)
         distance_between_first_and_last_stop = haversine(
@@ -760,40 +1099,45 @@ class OSMBusDataProvider:
 
         return distance_between_first_and_last_stop < tolerance
 
-    async def __find_matching_route(self, route_id: int, all_routes: Any, processed_route_ids,
-                                    tolerance: float = 3000) -> Tuple[bool, int | None]:
+    @staticmethod
+    def __find_matching_route(route_id: int, candidate_ids: List[int], pairing_index: RoutePairingIndex,
+                              processed_route_ids, cached_distances: Dict, is_route_master_member: bool = False) \
+            -> Tuple[bool, int | None]:
         """ Определение маршрута со схожей геометрией """
 
-        # Извлечение остановок интересующего маршрута
-        stops, _, _ = all_routes[route_id]
-
         # Инициализация переменных для хранения ближайшего маршрута и минимального расстояния Фреше
         closest_route_id = None
         min_frechet_dist = 0
         has_pair = False
 
-        # Обход всех маршрутов
-        for other_id, (other_stops, _, _) in all_routes.items():
+        # Уже обработанные маршруты не рассматриваются
+        candidate_ids = [other_id for other_id in candidate_ids if other_id not in processed_route_ids]
 
-            # Тот же самый маршрут и уже обработанные маршруты не рассматриваются
-            if route_id == other_id or other_id in processed_route_ids:
-                continue
+        # Если мастер-маршрут содержит единственное оставшееся направление, то оно считается парным без расчёта
+        # расстояния Фреше (при наличии нескольких вариантов выбирается ближайший по геометрии)
+        if is_route_master_member and len(candidate_ids) == 1:
+            return True, candidate_ids[0]
 
-            # Проверка того, было ли уже рассчитано расстояния между двумя маршрутами
-            cache_key = frozenset((route_id, other_id))
-            cached_value = self.cached_distances.get(cache_key)
-            if cached_value:
-                # Получение кэшированного расстояния Фреше
-                dist = cached_value
-            else:
-                # Расчёт расстояния Фреше и кэширование результата
-                stops_as_points = [(stop.lat, stop.lon) for stop in stops]
-                other_stops_as_points = [(stop.lat, stop.lon) for stop in other_stops]
-                dist = frechet_distance(stops_as_points, other_stops_as_points[::-1])
-                self.cached_distances[cache_key] = dist
+        # Расстояние Фреше рассчитывается только для маршрутов, представленных в индексе
+        if route_id not in pairing_index:
+            return has_pair, closest_route_id
+        candidate_ids = [other_id for other_id in candidate_ids if other_id in pairing_index]
+
+        # Пакетный расчёт расстояний Фреше для пар маршрутов, расстояния для которых ещё не были рассчитаны,
+        # и кэширование результатов
+        not_cached_ids = [
+            other_id for other_id in candidate_ids if frozenset((route_id, other_id)) not in cached_distances
+        ]
+        distances = pairing_index.frechet_distances([(route_id, other_id) for other_id in not_cached_ids])
+        for other_id, dist in zip(not_cached_ids, distances):
+            cached_distances[frozenset((route_id, other_id))] = float(dist)
+
+        # Обход маршрутов-кандидатов
+        for other_id in candidate_ids:
+            dist = cached_distances[frozenset((route_id, other_id))]
 
             # Определение ближайшего маршрута
-            if dist < tolerance and (closest_route_id is None or dist < min_frechet_dist):
+            if dist < pairing_index.tolerance and (closest_route_id is None or dist < min_frechet_dist):
                 closest_route_id = other_id
                 min_frechet_dist = dist
                 has_pair = True
@@ -801,7 +1145,7 @@ class OSMBusDataProvider:
         return has_pair, closest_route_id
 
     @staticmethod
-    async def __join_route_pair(first_route_stops, first_route_geometry, second_route_stops, second_route_geometry):
+    def __join_route_pair(first_route_stops, first_route_geometry, second_route_stops, second_route_geometry):
         """ Объединение пары маршрутов """
 
         # В OSM противоположные направления движения по одному и тому же маршруту
@@ -835,64 +1179,34 @@ class OSMBusDataProvider:
         return stops, geometry, final_stop_order
 
     @staticmethod
-    def construct_route_segments(stops: List[StopSchema], geometry: List[RouteGeometryNodeSchema]) -> List[RouteSegmentSchema]:
-        geometry_cursor = 1
+    def construct_route_segments(stops: List[StopSchema], geometry: RouteGeometry) -> List[RouteSegmentSchema]:
+        """ Построение сегментов маршрута (участков между соседними остановками) """
 
-        stop_cursor = 0
-        distance = 0
-        crossings = 0
-        traffic_signals = 0
-        speedbumps = 0
-        roundabouts = 0
+        # Расчёт протяжённости участков и количества препятствий на них за один проход по массивам геометрии. Участок
+        # включает все рёбра между соседними местами остановок (в т.ч. ребро, выходящее из места первой остановки)
+        distances = geometry.reduce_segments(geometry.edge_distances())
+        obstacle_counts = geometry.segment_obstacle_counts()
 
-        last_node = None
+        crossings = obstacle_counts[:, OBSTACLE_TYPES.index(RouteObstacleType.CROSSING)]
+        traffic_signals = obstacle_counts[:, OBSTACLE_TYPES.index(RouteObstacleType.TRAFFIC_SIGNALS)]
+        speedbumps = obstacle_counts[:, OBSTACLE_TYPES.index(RouteObstacleType.SPEEDBUMP)]
+        roundabouts = obstacle_counts[:, OBSTACLE_TYPES.index(RouteObstacleType.ROUNDABOUT)]
 
         route_segments = []
-
-        while geometry_cursor < len(geometry):
-
-            geometry_node = geometry[geometry_cursor]
-
-            if last_node is None:
-                last_node = geometry_node
+        for i in range(len(distances)):
+            # Участки между совпадающими остановками (пр. в месте объединения пары маршрутов) не сохраняются
+            if str(stops[i].id) == str(stops[i + 1].id):
                 continue
-
-            distance += haversine(
-                (last_node.lat, last_node.lon),
-                (geometry_node.lat, geometry_node.lon),
-                unit=Unit.METERS
-            )
-
-            if type(geometry_node) is RouteStopPositionSchema:
-                if str(stops[stop_cursor].id) != str(stops[stop_cursor+1].id):
-                    route_segments.append(RouteSegmentSchema(
-                        stop_from_id=str(stops[stop_cursor].id),
-                        stop_to_id=str(stops[stop_cursor+1].id),
-                        segment_order=stop_cursor,
-                        distance=distance,
-                        crossings=crossings,
-                        traffic_signals=traffic_signals,
-                        speedbumps=speedbumps,
-                        roundabouts=roundabouts
-                    ))
-                stop_cursor += 1
-                distance = 0
-                crossings = 0
-                traffic_signals = 0
-                speedbumps = 0
-                roundabouts = 0
-            elif type(geometry_node) is RouteObstacleSchema:
-                if geometry_node.obstacle_type is RouteObstacleType.CROSSING:
-                    crossings += 1
-                elif geometry_node.obstacle_type is RouteObstacleType.TRAFFIC_SIGNALS:
-                    traffic_signals += 1
-                elif geometry_node.obstacle_type is RouteObstacleType.SPEEDBUMP:
-                    speedbumps += 1
-                elif geometry_node.obstacle_type is RouteObstacleType.ROUNDABOUT:
-                    roundabouts += 1
-
-            last_node = geometry_node
-            geometry_cursor += 1
+            route_segments.append(RouteSegmentSchema(
+                stop_from_id=str(stops[i].id),
+                stop_to_id=str(stops[i + 1].id),
+                segment_order=i,
+                distance=float(distances[i]),
+                crossings=int(crossings[i]),
+                traffic_signals=int(traffic_signals[i]),
+                speedbumps=int(speedbumps[i]),
+                roundabouts=int(roundabouts[i])
+            ))
 
         return route_segments
 
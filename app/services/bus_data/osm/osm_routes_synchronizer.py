@@ -0,0 +1,156 @@
+import dataclasses
+import time
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.daos.route_dao import RouteDAO
+from app.logger import logger
+from app.schemas.enums import BusDataProvider
+from app.services.bus_data.local.local_bus_data_provider import LocalBusDataProvider
+from app.services.bus_data.osm.osm_bus_data_provider import OSMBusDataProvider
+
+
+class OSMRoutesSynchronizer:
+    """
+    Класс, выполняющий инкрементальную синхронизацию маршрутов OSM, сохранённых в локальной базе данных
+
+    Для каждого маршрута хранится момент его последней синхронизации. При синхронизации в OSM запрашиваются только
+    маршруты, изменённые после этого момента (с учётом изменений дорог и узлов), после чего перестраиваются и
+    обновляются на месте только они. Маршруты, удалённые из OSM, удаляются из локальной базы данных.
+    """
+
+    # Запас времени при определении изменений (данные Overpass API отстают от основной базы данных OSM, поэтому
+    # изменения, внесённые незадолго до синхронизации, могут появиться в Overpass API только после неё)
+    SYNC_TIME_MARGIN = timedelta(hours=1)
+
+    # Расширение ограничивающей рамки перестраиваемых маршрутов (в градусах) для учёта изменений их геометрии
+    SYNC_BBOX_MARGIN = 0.01
+
+    @dataclasses.dataclass
+    class SyncResult:
+        """ Класс-контейнер для результатов синхронизации (id маршрутов в локальной базе данных) """
+        updated: List[str]
+        deleted: List[str]
+        failed: List[str]
+        unchanged: int
+
+    def __init__(self, session: AsyncSession, overpass_api_mock=None):
+        self.session = session
+        self.overpass_api_mock = overpass_api_mock
+
+    async def sync(self) -> SyncResult:
+        """ Синхронизация маршрутов OSM, сохранённых в локальной базе данных """
+
+        logger.info("BUS DATA > OSM SYNC | SYNCING STORED ROUTES")
+        start = time.perf_counter()
+        synced_at = datetime.now(timezone.utc)
+        route_dao = RouteDAO(self.session)
+
+        # Получение внешних идентификаторов и моментов синхронизации сохранённых маршрутов (маршруты с внешним
+        # идентификатором, не являющимся id отношения OSM, не синхронизируются)
+        db_route_ids: Dict[int, UUID] = {}
+        never_synced_ids = set()
+        last_synced_at = synced_at
+        for db_route_id, external_source_id, external_synced_at in \
+                await route_dao.get_external_routes_sync_state(BusDataProvider.OSM):
+            if not external_source_id.isdigit():
+                continue
+            db_route_ids[int(external_source_id)] = db_route_id
+            if external_synced_at is None:
+                never_synced_ids.add(int(external_source_id))
+            else:
+                last_synced_at = min(last_synced_at, external_synced_at)
+
+        if len(db_route_ids) == 0:
+            return self.SyncResult(updated=[], deleted=[], failed=[], unchanged=0)
+
+        # Остановки, уже сохранённые в локальной базе данных, используются повторно, а сохранённые маршруты
+        # строятся заново
+        osm_provider = OSMBusDataProvider(overpass_api_mock=self.overpass_api_mock,
+                                          local_data_provider=LocalBusDataProvider(self.session),
+                                          reuse_local_routes=False)
+
+        # Определение удалённых и изменённых маршрутов (маршруты, ни разу не синхронизированные, перестраиваются)
+        routes_ids = list(db_route_ids.keys())
+        existing_ids, changed_ids, route_masters = await osm_provider.get_routes_changes(
+            routes_ids, last_synced_at - self.SYNC_TIME_MARGIN
+        )
+        deleted_ids = [route_id for route_id in routes_ids if route_id not in existing_ids]
+        existing_routes_ids = [route_id for route_id in routes_ids if route_id in existing_ids]
+        affected_ids = set(osm_provider.affected_routes(existing_routes_ids, changed_ids, route_masters))
+        affected_ids |= never_synced_ids & existing_ids
+
+        # Удаление маршрутов, удалённых из OSM, одним запросом. Удаление, обновление маршрутов и моментов
+        # синхронизации фиксируются одной транзакцией, поэтому ошибка перестроения не оставляет синхронизацию
+        # применённой частично
+        if len(deleted_ids) > 0:
+            await route_dao.delete_all([str(db_route_ids[route_id]) for route_id in deleted_ids], commit=False)
+
+        # Перестроение и обновление изменённых маршрутов
+        updated_ids = set()
+        if len(affected_ids) > 0:
+            updated_ids = await self.__update_routes(
+                osm_provider, [db_route_ids[route_id] for route_id in affected_ids], sorted(affected_ids)
+            )
+
+        # Неизменённые и обновлённые маршруты считаются синхронизированными на момент начала синхронизации,
+        # маршруты, которые не удалось перестроить, будут проверены повторно при следующей синхронизации
+        failed_ids = affected_ids - updated_ids
+        await route_dao.set_synced_at(
+            [db_route_ids[route_id] for route_id in existing_routes_ids if route_id not in failed_ids], synced_at,
+            commit=False
+        )
+        await self.session.commit()
+
+        end = time.perf_counter()
+        log_message = "\n".join([
+            f"BUS DATA > OSM SYNC | Done:",
+            f"BUS DATA > OSM SYNC | * Updated routes: {len(updated_ids)}",
+            f"BUS DATA > OSM SYNC | * Deleted routes: {len(deleted_ids)}",
+            f"BUS DATA > OSM SYNC | * Failed routes: {len(failed_ids)}",
+            f"BUS DATA > OSM SYNC | * Processing time: {end - start:3.2f} s"
+        ])
+        logger.info(log_message)
+
+        return self.SyncResult(
+            updated=[str(db_route_ids[route_id]) for route_id in sorted(updated_ids)],
+            deleted=[str(db_route_ids[route_id]) for route_id in deleted_ids],
+            failed=[str(db_route_ids[route_id]) for route_id in sorted(failed_ids)],
+            unchanged=len(existing_routes_ids) - len(affected_ids)
+        )
+
+    async def __update_routes(self, osm_provider: OSMBusDataProvider, db_routes_ids: List[UUID],
+                              routes_ids: List[int]) -> set:
+        """
+        Перестроение маршрутов и обновление записей о них (возвращаются id обновлённых маршрутов OSM)
+
+        Изменения не фиксируются: транзакция фиксируется после установки моментов синхронизации.
+        """
+
+        route_dao = RouteDAO(self.session)
+
+        # Маршруты перестраиваются в рамке, охватывающей их сохранённую геометрию
+        bbox = await route_dao.get_geometry_bbox(db_routes_ids)
+        if bbox is None:
+            return set()
+        bbox = (bbox[0] - self.SYNC_BBOX_MARGIN, bbox[1] - self.SYNC_BBOX_MARGIN,
+                bbox[2] + self.SYNC_BBOX_MARGIN, bbox[3] + self.SYNC_BBOX_MARGIN)
+
+        db_routes = {
+            _route.external_source_id: _route
+            for _route in await route_dao.get_all_by_ids([str(db_route_id) for db_route_id in db_routes_ids])
+        }
+
+        # Обновление записей о маршрутах (маршруты других направлений мастер-маршрутов, построенные для определения
+        # пар, не сохраняются)
+        updated_ids = set()
+        async for route in osm_provider.iter_routes_in_bbox(bbox, routes_ids):
+            if route.id not in db_routes:
+                continue
+            await route_dao.update(db_routes[route.id], route, commit=False)
+            updated_ids.add(int(route.id))
+
+        return updated_ids
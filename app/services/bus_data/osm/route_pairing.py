@@ -0,0 +1,102 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pygeos
+
+from app.schemas.stop import StopSchema
+from app.services.bus_data.osm.wrappers import KDTreeWrapper
+from app.utils import utm_point_from_latlon
+
+
+class RoutePairingIndex:
+    """ Индекс для отбора маршрутов-кандидатов при поиске парного маршрута """
+
+    # Парный маршрут проходит по тем же остановкам в обратном порядке, поэтому расстояние Фреше рассчитывается между
+    # ломанной маршрута и развёрнутой ломанной кандидата. Расстояние Фреше не может быть меньше расстояния между
+    # соответствующими концами ломанных, а каждая вершина одной ломанной удалена от другой ломанной не более чем на
+    # расстояние Фреше. Поэтому точный расчёт имеет смысл только для маршрутов, у которых:
+    # 1) начало кандидата находится в пределах допуска от конца маршрута, а конец кандидата - от начала маршрута;
+    # 2) ограничивающие рамки, расширенные на величину допуска, взаимно покрывают друг друга.
+
+    def __init__(self, routes_stops: Dict[int, List[StopSchema]], tolerance: float = 3000):
+        """ Инициализация индекса """
+
+        self.tolerance = tolerance
+
+        # Маршруты, содержащие менее двух остановок, не могут быть представлены в виде ломанной и в индекс не входят
+        # (для таких маршрутов парный маршрут не определяется)
+        routes_stops = {route_id: stops for route_id, stops in routes_stops.items() if len(stops) >= 2}
+        self.route_ids = list(routes_stops.keys())
+
+        # Кэширование остановок маршрутов в виде ломанных в системе координат UTM (однократно для каждого маршрута)
+        self.utm_polylines = {
+            route_id: [utm_point_from_latlon(stop.lat, stop.lon) for stop in stops]
+            for route_id, stops in routes_stops.items()
+        }
+
+        # Построение геометрий Pygeos (прямых и развёрнутых ломанных) непосредственно из массивов координат
+        self.linestrings = {
+            route_id: pygeos.linestrings(polyline) for route_id, polyline in self.utm_polylines.items()
+        }
+        self.reversed_linestrings = {
+            route_id: pygeos.linestrings(polyline[::-1]) for route_id, polyline in self.utm_polylines.items()
+        }
+
+        # Организация начальных и конечных точек маршрутов в kd-деревья
+        start_points = [self.utm_polylines[route_id][0] for route_id in self.route_ids]
+        end_points = [self.utm_polylines[route_id][-1] for route_id in self.route_ids]
+        self.start_points_kd_tree = KDTreeWrapper(start_points, leaf_size=40)
+        self.end_points_kd_tree = KDTreeWrapper(end_points, leaf_size=40)
+
+        # Расчёт ограничивающих рамок маршрутов в формате (min x, min y, max x, max y)
+        self.bounds = {}
+        for route_id, polyline in self.utm_polylines.items():
+            points = np.array(polyline)
+            self.bounds[route_id] = (*points.min(axis=0), *points.max(axis=0))
+
+    def __contains__(self, route_id: int) -> bool:
+        """ Проверка наличия маршрута в индексе """
+        return route_id in self.utm_polylines
+
+    def frechet_distances(self, route_pairs: List[Tuple[int, int]]) -> np.ndarray:
+        """ Пакетный расчёт расстояний Фреше между маршрутами и развёрнутыми маршрутами-кандидатами """
+
+        if len(route_pairs) == 0:
+            return np.empty(0)
+
+        first_geometries = np.array([self.linestrings[route_id] for route_id, _ in route_pairs])
+        second_geometries = np.array([self.reversed_linestrings[other_id] for _, other_id in route_pairs])
+
+        return pygeos.frechet_distance(first_geometries, second_geometries)
+
+    def get_candidates(self, route_id: int) -> List[int]:
+        """ Получение списка маршрутов, которые могут быть парными для заданного маршрута """
+
+        if route_id not in self:
+            return []
+
+        polyline = self.utm_polylines[route_id]
+
+        # Маршруты, начинающиеся вблизи конца заданного маршрута
+        starts_near_end_indices = self.start_points_kd_tree.query_radius([polyline[-1]], r=self.tolerance)[0]
+
+        # Маршруты, заканчивающиеся вблизи начала заданного маршрута
+        ends_near_start_indices = self.end_points_kd_tree.query_radius([polyline[0]], r=self.tolerance)[0]
+
+        candidate_indices = set(starts_near_end_indices) & set(ends_near_start_indices)
+
+        # Сохранение исходного порядка маршрутов и фильтрация по ограничивающим рамкам
+        candidates = []
+        for i in sorted(candidate_indices):
+            other_id = self.route_ids[i]
+            if other_id != route_id and self.__bounds_match(route_id, other_id):
+                candidates.append(other_id)
+
+        return candidates
+
+    def __bounds_match(self, route_id: int, other_id: int) -> bool:
+        """ Проверка взаимного покрытия ограничивающих рамок, расширенных на величину допуска """
+        min_x, min_y, max_x, max_y = self.bounds[route_id]
+        other_min_x, other_min_y, other_max_x, other_max_y = self.bounds[other_id]
+        return (abs(min_x - other_min_x) <= self.tolerance and abs(min_y - other_min_y) <= self.tolerance and
+                abs(max_x - other_max_x) <= self.tolerance and abs(max_y - other_max_y) <= self.tolerance)
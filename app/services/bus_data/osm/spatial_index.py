@@ -0,0 +1,128 @@
+from typing import Dict, List, Tuple, Iterable, Set
+
+import numpy as np
+import utm
+from overpy import Node as OSMNode
+
+from app.services.bus_data.osm.wrappers import OSMWayWrapper, KDTreeWrapper
+from app.utils import Point, utm_points_from_latlon
+
+
+class UTMNodeTable:
+    """ Таблица координат узлов OSM в системе координат UTM (id узла -> (x, y)) """
+
+    # Координаты хранятся в плотном массиве размерности (N, 2), строки которого упорядочены по возрастанию id узлов.
+    # Поиск строки по id выполняется бинарным поиском, что позволяет получать координаты сразу для набора узлов
+
+    def __init__(self, node_ids: np.ndarray, points: np.ndarray, zone_number: int | None, zone_letter: str | None):
+        """ Инициализация таблицы """
+        self.node_ids = node_ids
+        self.points = points
+        self.zone_number = zone_number
+        self.zone_letter = zone_letter
+
+    @staticmethod
+    def from_nodes(nodes: Iterable[OSMNode]) -> 'UTMNodeTable':
+        """ Построение таблицы по набору узлов (с векторизованной проекцией координат) """
+
+        # Исключение повторяющихся узлов
+        unique_nodes = {node.id: node for node in nodes}
+        node_ids = np.array(sorted(unique_nodes.keys()), dtype=np.int64)
+
+        # Проекция координат всех узлов за один вызов
+        points, zone_number, zone_letter = utm_points_from_latlon(
+            [float(unique_nodes[node_id].lat) for node_id in node_ids],
+            [float(unique_nodes[node_id].lon) for node_id in node_ids]
+        )
+
+        return UTMNodeTable(node_ids, points, zone_number, zone_letter)
+
+    def __len__(self) -> int:
+        """ Количество узлов в таблице """
+        return len(self.node_ids)
+
+    def __contains__(self, node_id: int) -> bool:
+        """ Проверка наличия узла в таблице """
+        i = np.searchsorted(self.node_ids, node_id)
+        return i < len(self.node_ids) and self.node_ids[i] == node_id
+
+    def __getitem__(self, node_id: int) -> Point:
+        """ Получение координат узла """
+        return tuple(self.get_points([node_id])[0])
+
+    def get_points(self, node_ids: Iterable[int]) -> np.ndarray:
+        """ Получение координат набора узлов в виде массива размерности (N, 2) """
+
+        node_ids = np.fromiter(node_ids, dtype=np.int64)
+        indices = np.searchsorted(self.node_ids, node_ids)
+
+        # Проверка наличия всех узлов в таблице
+        if np.any(indices >= len(self.node_ids)) or np.any(self.node_ids[indices] != node_ids):
+            raise KeyError("Node is missing in UTM table")
+
+        return self.points[indices]
+
+    def slice(self, node_ids: Iterable[int]) -> 'UTMNodeTable':
+        """ Формирование таблицы, содержащей только заданные узлы """
+        node_ids = np.unique(np.fromiter(node_ids, dtype=np.int64))
+        return UTMNodeTable(node_ids, self.get_points(node_ids), self.zone_number, self.zone_letter)
+
+    def to_latlon(self, utm_point: Point) -> Tuple[float, float]:
+        """ Конвертация точки из UTM (в зоне таблицы) в latlon """
+        return utm.to_latlon(utm_point[0], utm_point[1], zone_number=self.zone_number, zone_letter=self.zone_letter)
+
+
+class BBoxSpatialIndex:
+    """ Общий пространственный индекс мест остановок и отрезков дорог в пределах ограничивающей рамки """
+
+    # Индекс строится однократно для всего ответа Overpass API и используется при подготовке данных всех маршрутов
+    # (вместо построения отдельных kd-деревьев для каждого маршрута)
+
+    def __init__(self, node_by_id: Dict[int, OSMNode], way_by_id: Dict[int, OSMWayWrapper]):
+        """ Инициализация индекса """
+
+        # Таблица координат всех узлов (включая узлы дорог) в системе координат UTM
+        # (проекция выполняется однократно для каждого узла)
+        self.utm_table = UTMNodeTable.from_nodes(
+            [*node_by_id.values(), *(node for way in way_by_id.values() for node in way.nodes)]
+        )
+
+        # Организация мест остановок общественного транспорта в kd-дерево
+        self.stop_positions = [
+            node for node in node_by_id.values() if node.tags.get('public_transport') == 'stop_position'
+        ]
+        self.stop_positions_kd_tree = KDTreeWrapper(self.utm_table.get_points(node.id for node in self.stop_positions))
+
+        # Организация отрезков дорог в kd-дерево (по начальной и конечной точке каждого отрезка)
+        self.way_segments: List[Tuple[int, int]] = []
+        way_segments_node_ids = []
+        for way in way_by_id.values():
+            for j, (node1, node2) in enumerate(zip(way.nodes, way.nodes[1:])):
+                self.way_segments.append((way.id, j))
+                way_segments_node_ids.append(node1.id)
+                way_segments_node_ids.append(node2.id)
+        self.way_segments_kd_tree = KDTreeWrapper(self.utm_table.get_points(way_segments_node_ids), leaf_size=40)
+
+    def query_stop_positions(self, utm_points: List[Point], r: float) -> List[List[OSMNode]]:
+        """ Поиск мест остановок в радиусе от точек (в порядке возрастания расстояния) """
+        indices, _ = self.stop_positions_kd_tree.query_radius(utm_points, r=r, return_distance=True,
+                                                              sort_results=True)
+        return [[self.stop_positions[j] for j in point_indices] for point_indices in indices]
+
+    def query_way_segments(self, utm_points: List[Point], r: float, way_ids: Iterable[int] | Set[int]) \
+            -> List[List[Tuple[int, int]]]:
+        """ Поиск отрезков заданных дорог, начало или конец которых находится в радиусе от точек """
+
+        way_ids = set(way_ids)
+
+        # Отрезок попадает в результат однократно, даже если в радиус попадают обе его точки
+        result = []
+        for point_indices in self.way_segments_kd_tree.query_radius(utm_points, r=r):
+            segments = []
+            for j in point_indices:
+                segment = self.way_segments[j // 2]
+                if segment[0] in way_ids and segment not in segments:
+                    segments.append(segment)
+            result.append(segments)
+
+        return result
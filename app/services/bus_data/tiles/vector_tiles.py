@@ -0,0 +1,190 @@
+import math
+import struct
+from typing import List, Dict, Tuple, Iterable
+
+import numpy as np
+
+from app.cache import LRUCache
+from app.common_types import BBox
+
+# Спецификация формата Mapbox Vector Tile: https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+
+# Размер плитки в собственной системе координат и ширина буферной зоны за её границами
+# (геометрия в буферной зоне не обрезается, чтобы линии на стыках соседних плиток не разрывались)
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+# Типы геометрии объектов и команды кодирования геометрии
+POINT_GEOMETRY_TYPE = 1
+LINESTRING_GEOMETRY_TYPE = 2
+MOVE_TO_COMMAND = 1
+LINE_TO_COMMAND = 2
+
+# Типы полей Protocol Buffers
+VARINT_WIRE_TYPE = 0
+LENGTH_DELIMITED_WIRE_TYPE = 2
+
+
+def encode_varints(values) -> bytes:
+    """ Кодирование последовательности неотрицательных целых чисел в формате varint (Protocol Buffers) """
+
+    values = np.asarray(values, dtype=np.uint64)
+
+    if len(values) == 0:
+        return b''
+
+    # Разбиение на блоки по 7 бит (64-битное число содержит не более 10 блоков), начиная с младших, и определение
+    # количества значимых блоков для каждого числа (не менее одного блока)
+    max_chunks = 10
+    shifted_values = values[:, None] >> (7 * np.arange(max_chunks, dtype=np.uint64))[None, :]
+    chunks = shifted_values & np.uint64(0x7f)
+    chunks_count = np.maximum(1, np.count_nonzero(shifted_values, axis=1))
+
+    # Установка флага продолжения для всех блоков, кроме последнего, и отбор значимых блоков
+    chunk_positions = np.arange(max_chunks)[None, :]
+    chunks |= np.where(chunk_positions < chunks_count[:, None] - 1, 0x80, 0).astype(np.uint64)
+
+    return chunks[chunk_positions < chunks_count[:, None]].astype(np.uint8).tobytes()
+
+
+def zigzag(values: np.ndarray) -> np.ndarray:
+    """ Перенос знака целых чисел в младший бит """
+    values = np.asarray(values, dtype=np.int64)
+    return np.where(values < 0, ~(values << 1), values << 1)
+
+
+def encode_field(field_number: int, value: bytes | int) -> bytes:
+    """ Кодирование поля сообщения Protocol Buffers (целое число или последовательность байт) """
+    if isinstance(value, int):
+        return encode_varints([field_number << 3 | VARINT_WIRE_TYPE, value])
+    return encode_varints([field_number << 3 | LENGTH_DELIMITED_WIRE_TYPE, len(value)]) + value
+
+
+class TileProjection:
+    """ Проекция координат в систему координат плитки (Web Mercator) """
+
+    def __init__(self, z: int, x: int, y: int, extent: int = TILE_EXTENT):
+        """ Инициализация проекции """
+        self.z, self.x, self.y = z, x, y
+        self.extent = extent
+
+    @property
+    def tiles_num(self) -> int:
+        """ Количество плиток по каждой из осей на уровне масштабирования """
+        return 2 ** self.z
+
+    @property
+    def is_valid(self) -> bool:
+        """ Проверка существования плитки на уровне масштабирования """
+        return 0 <= self.x < self.tiles_num and 0 <= self.y < self.tiles_num
+
+    def bbox(self, buffer: int = 0) -> BBox:
+        """ Ограничивающая рамка плитки (с учётом буферной зоны, заданной в системе координат плитки) """
+
+        def lon(tile_x: float) -> float:
+            return tile_x / self.tiles_num * 360 - 180
+
+        def lat(tile_y: float) -> float:
+            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / self.tiles_num))))
+
+        padding = buffer / self.extent
+        return (lon(self.x - padding), lat(self.y + 1 + padding),
+                lon(self.x + 1 + padding), lat(self.y - padding))
+
+    def project(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """ Проекция координат в систему координат плитки (ось y направлена вниз) """
+        lat = np.radians(np.clip(np.asarray(lat, dtype=np.float64), -85.0511, 85.0511))
+        tile_x = (np.asarray(lon, dtype=np.float64) + 180) / 360 * self.tiles_num
+        tile_y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * self.tiles_num
+        return np.column_stack(((tile_x - self.x) * self.extent, (tile_y - self.y) * self.extent))
+
+
+class VectorTileLayer:
+    """ Слой векторной плитки """
+
+    def __init__(self, name: str, extent: int = TILE_EXTENT):
+        """ Инициализация слоя """
+        self.name = name
+        self.extent = extent
+        self.features: List[bytes] = []
+
+        # Ключи и значения атрибутов объектов хранятся в слое однократно (объекты ссылаются на них по индексу)
+        self.keys: Dict[str, int] = {}
+        self.values: Dict[Tuple[type, str | int | float | bool], int] = {}
+
+    def add_points(self, points: np.ndarray, properties: List[Dict]):
+        """ Добавление точечных объектов (по одному объекту на каждую точку) """
+        points = np.rint(points).astype(np.int64)
+        for point, point_properties in zip(points, properties):
+            geometry = np.concatenate(([MOVE_TO_COMMAND | 1 << 3], zigzag(point)))
+            self.__add_feature(POINT_GEOMETRY_TYPE, geometry, point_properties)
+
+    def add_linestring(self, parts: Iterable[np.ndarray], properties: Dict):
+        """ Добавление линейного объекта, состоящего из одной или нескольких ломанных """
+
+        geometry = []
+        cursor = np.zeros(2, dtype=np.int64)
+        for part in parts:
+            # Округление координат и исключение повторяющихся точек
+            part = np.rint(part).astype(np.int64)
+            part = part[np.concatenate(([True], np.any(part[1:] != part[:-1], axis=1)))]
+            if len(part) < 2:
+                continue
+
+            # Координаты кодируются разностями относительно предыдущей точки (курсор сохраняется между ломанными)
+            deltas = zigzag(np.diff(part, axis=0, prepend=cursor[None, :]))
+            geometry.append([MOVE_TO_COMMAND | 1 << 3, *deltas[0]])
+            geometry.append([LINE_TO_COMMAND | (len(part) - 1) << 3])
+            geometry.append(deltas[1:].ravel())
+            cursor = part[-1]
+
+        if len(geometry) > 0:
+            self.__add_feature(LINESTRING_GEOMETRY_TYPE, np.concatenate(geometry), properties)
+
+    def encode(self) -> bytes:
+        """ Кодирование слоя """
+        return b''.join([
+            encode_field(15, 2),
+            encode_field(1, self.name.encode()),
+            *(encode_field(2, feature) for feature in self.features),
+            *(encode_field(3, key.encode()) for key in self.keys),
+            *(encode_field(4, self.__encode_value(value)) for _, value in self.values),
+            encode_field(5, self.extent)
+        ])
+
+    def __add_feature(self, geometry_type: int, geometry: np.ndarray, properties: Dict):
+        """ Добавление объекта """
+
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(self.keys.setdefault(key, len(self.keys)))
+            tags.append(self.values.setdefault((type(value), value), len(self.values)))
+
+        self.features.append(b''.join([
+            encode_field(2, encode_varints(tags)),
+            encode_field(3, geometry_type),
+            encode_field(4, encode_varints(geometry))
+        ]))
+
+    @staticmethod
+    def __encode_value(value: str | int | float | bool) -> bytes:
+        """ Кодирование значения атрибута """
+        if isinstance(value, bool):
+            return encode_field(7, int(value))
+        elif isinstance(value, int):
+            return encode_field(6, int(zigzag([value])[0]))
+        elif isinstance(value, float):
+            return encode_varints([3 << 3 | 1]) + struct.pack('<d', value)
+        return encode_field(1, str(value).encode())
+
+
+def encode_vector_tile(layers: List[VectorTileLayer]) -> bytes:
+    """ Кодирование векторной плитки (пустые слои не кодируются) """
+    return b''.join(encode_field(3, layer.encode()) for layer in layers if len(layer.features) > 0)
+
+
+# Общий кэш векторных плиток. Плитки строятся по данным локальной базы данных, поэтому кэш очищается при любом
+# создании или удалении остановок и маршрутов
+vector_tile_cache = LRUCache(max_size=4096)
@@ -5,8 +5,9 @@ from typing import List, Tuple
 
 from sklearn.cluster import HDBSCAN
 from sklearn.neighbors import KNeighborsClassifier
-from tqdm import tqdm
 
+from app.jobs import current_job_id, add_progress_steps, track_progress
+from app.process_pool import run_in_process_pool
 from app.schemas.clustering_profile_schema import TruncatedClusteringProfileSchema
 from app.schemas.stops_clustering import CorrespondenceNode, CorrespondenceEntry, StopsClusteringParams, \
     StopsClusteringAlgorithm, ClusteredCorrespondenceNode, ClusteredCorrespondenceEntry
@@ -28,14 +29,38 @@ class StopsClusteringProvider:
         nodes = [CorrespondenceNode(**json_node) for json_node in data.get('nodes')]
         correspondence = [CorrespondenceEntry(**json_corr) for json_corr in data.get('correspondence')]
 
-        # Задание границ поиска параметров
-        hdbscan_min_cluster_size_range = range(2, 52, 2)
-        hdbscan_min_samples_range = range(2, 22, 2)
+        # Перебор параметров по сетке в общем пуле процессов
+        add_progress_steps(len(self.HDBSCAN_MIN_CLUSTER_SIZE_RANGE))
+        sifted_results = await run_in_process_pool(
+            StopsClusteringProvider.grid_search_job, nodes, correspondence, params, current_job_id()
+        )
+
+        return [
+            TruncatedClusteringProfileSchema(
+                name=name,
+                clusters_count=result_entry[0],
+                clustering_score=result_entry[1],
+                clustering_params=result_entry[2],
+            ) for i, result_entry in enumerate(sifted_results)
+        ]
+
+    # Границы поиска параметров по сетке
+    HDBSCAN_MIN_CLUSTER_SIZE_RANGE = range(2, 52, 2)
+    HDBSCAN_MIN_SAMPLES_RANGE = range(2, 22, 2)
+
+    @staticmethod
+    def grid_search_job(nodes: List[CorrespondenceNode], correspondence: List[CorrespondenceEntry],
+                        params: StopsClusteringParams, job_id: str | None = None) \
+            -> List[Tuple[int, float, StopsClusteringParams]]:
+        """ Перебор параметров кластеризации по сетке (количество кластеров, оценка и параметры лучших вариантов) """
+
+        hdbscan_min_cluster_size_range = StopsClusteringProvider.HDBSCAN_MIN_CLUSTER_SIZE_RANGE
+        hdbscan_min_samples_range = StopsClusteringProvider.HDBSCAN_MIN_SAMPLES_RANGE
 
         # Перебор параметров с сохранением результатов
         results = {}
         params.algorithm_params = {}
-        for hdbscan_min_cluster_size in tqdm(hdbscan_min_cluster_size_range):
+        for hdbscan_min_cluster_size in track_progress(hdbscan_min_cluster_size_range, job_id):
             for hdbscan_min_samples in hdbscan_min_samples_range:
                 params_copy = params.model_copy(deep=True)
                 params_copy.algorithm_params['hdbscan_eps'] = 0
@@ -43,8 +68,8 @@ class StopsClusteringProvider:
                 params_copy.algorithm_params['hdbscan_min_samples'] = hdbscan_min_samples
                 params_copy.algorithm_params['knn_k'] = 10
 
-                clustering_result = self.clusterize(nodes, params_copy)
-                score, clusters_count = self.compute_score(clustering_result, correspondence)
+                clustering_result = StopsClusteringProvider.clusterize(nodes, params_copy)
+                score, clusters_count = StopsClusteringProvider.compute_score(clustering_result, correspondence)
 
                 if params.min_score is not None and score < params.min_score:
                     continue
@@ -65,14 +90,7 @@ class StopsClusteringProvider:
                 sifted_results.append(r)
                 last_score = score
 
-        return [
-            TruncatedClusteringProfileSchema(
-                name=name,
-                clusters_count=result_entry[0],
-                clustering_score=result_entry[1],
-                clustering_params=result_entry[2],
-            ) for i, result_entry in enumerate(sifted_results)
-        ]
+        return sifted_results
 
     async def realize_clustering_profile(self, params: StopsClusteringParams) \
             -> Tuple[List[ClusteredCorrespondenceNode], List[ClusteredCorrespondenceEntry]]:
@@ -86,10 +104,16 @@ class StopsClusteringProvider:
         nodes = [CorrespondenceNode(**json_node) for json_node in data.get('nodes')]
         correspondence = [CorrespondenceEntry(**json_corr) for json_corr in data.get('correspondence')]
 
-        # Кластеризация узлов и перерасчёт матрицы транспортных корреспонденций
-        clustered_nodes = self.clusterize(nodes, params)
-        clustered_correspondence = self.build_correspondence_matrix(clustered_nodes, correspondence)
+        # Кластеризация узлов и перерасчёт матрицы транспортных корреспонденций в общем пуле процессов
+        return await run_in_process_pool(StopsClusteringProvider.realize_job, nodes, correspondence, params)
 
+    @staticmethod
+    def realize_job(nodes: List[CorrespondenceNode], correspondence: List[CorrespondenceEntry],
+                    params: StopsClusteringParams) \
+            -> Tuple[List[ClusteredCorrespondenceNode], List[ClusteredCorrespondenceEntry]]:
+        """ Кластеризация узлов и перерасчёт матрицы транспортных корреспонденций """
+        clustered_nodes = StopsClusteringProvider.clusterize(nodes, params)
+        clustered_correspondence = StopsClusteringProvider.build_correspondence_matrix(clustered_nodes, correspondence)
         return clustered_nodes, clustered_correspondence
 
     @classmethod
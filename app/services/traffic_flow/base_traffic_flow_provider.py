@@ -89,7 +89,9 @@ class BaseTrafficFlowProvider(ABC):
         for route in routes:
 
             # Конвертация координат геометрии маршрута в СК UTM для корректного расчёта расстояний
-            route_geometry_as_points = [utm_point_from_latlon(node.lat, node.lon) for node in route.geometry]
+            route_geometry_as_points = [
+                utm_point_from_latlon(lat, lon) for lat, lon in zip(route.geometry.lat, route.geometry.lon)
+            ]
 
             # Определение индексов ближайших сегментов для каждой точки маршрута
             closest_segment_points_indices_matrix = flow_node_tree.query_radius(route_geometry_as_points, r=100)
@@ -109,7 +111,7 @@ class BaseTrafficFlowProvider(ABC):
                     continue
 
                 # Расчёт проекций точки на ближайшие сегменты
-                latlon_point = (route.geometry[i].lat, route.geometry[i].lon)
+                latlon_point = (route.geometry.lat[i], route.geometry.lon[i])
                 snap_distances = [segment.get_point_snap_distance(latlon_point) for segment in closest_segments]
 
                 # Определение вектора направления движения транспорта в текущей точке геометрии.
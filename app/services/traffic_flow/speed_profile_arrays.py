@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.cache import LRUCache
+from app.schemas.enums import Weekday
+from app.schemas.speed_profile_schema import SegmentSpeeds
+
+HOURS = 24
+
+# Скорости сегментов маршрутов: идентификатор маршрута, день недели, час, порядковый номер сегмента, скорость
+SegmentSpeedRow = Tuple[str, int, int, int, float]
+
+
+@dataclass
+class SpeedProfileArrays:
+    """
+    Профиль скорости в виде плотного массива
+
+    Скорости хранятся в массиве размерности (день недели, час, сегмент), сегменты каждого маршрута занимают
+    непрерывный диапазон последнего измерения, поэтому срез скоростей маршрута за интервал часов не требует копирования.
+    Отсутствующие в профиле значения равны NaN.
+    """
+    speeds: np.ndarray
+    routes_ranges: Dict[str, Tuple[int, int]]
+
+    @staticmethod
+    def from_rows(rows: Sequence[SegmentSpeedRow]) -> 'SpeedProfileArrays':
+        """
+        Построение массива скоростей по записям о скоростях сегментов маршрутов
+
+        Столбцы массива назначаются парам (маршрут, порядковый номер сегмента) подряд в порядке возрастания, поэтому
+        сегменты каждого маршрута занимают непрерывный диапазон без пустых столбцов, даже если порядковые номера
+        сегментов в записях идут с пропусками.
+        """
+        if not rows:
+            return SpeedProfileArrays(speeds=np.full((len(Weekday), HOURS, 0), np.nan, dtype=float), routes_ranges={})
+        routes_ids, weekdays, hours, segments_orders, values = zip(*rows)
+
+        # Назначение столбцов сегментам маршрутов
+        routes_ids, routes_indices = np.unique(np.array(routes_ids), return_inverse=True)
+        segments_keys, columns = np.unique(np.column_stack((routes_indices, np.array(segments_orders))), axis=0,
+                                           return_inverse=True)
+        starts = np.searchsorted(segments_keys[:, 0], np.arange(len(routes_ids)))
+        ends = np.append(starts[1:], len(segments_keys))
+        routes_ranges = {
+            str(route_id): (int(start), int(end)) for route_id, start, end in zip(routes_ids, starts, ends)
+        }
+
+        # Заполнение массива скоростей
+        speeds = np.full((len(Weekday), HOURS, len(segments_keys)), np.nan, dtype=float)
+        speeds[np.array(weekdays), np.array(hours), columns.ravel()] = values
+        return SpeedProfileArrays(speeds=speeds, routes_ranges=routes_ranges)
+
+    def slice(self, routes_ids: List[str], weekday: Weekday, hour_from: int,
+              hour_to: int) -> Dict[str, List[SegmentSpeeds]]:
+        """ Скорости сегментов маршрутов по часам интервала (включительно), маршруты не из профиля пропускаются """
+        weekday_speeds = self.speeds[list(Weekday).index(weekday), hour_from:hour_to + 1]
+        routes_speeds = {}
+        for route_id in routes_ids:
+            if route_id in self.routes_ranges:
+                start, end = self.routes_ranges[route_id]
+                routes_speeds[route_id] = weekday_speeds[:, start:end].tolist()
+        return routes_speeds
+
+
+# Профили скорости в виде плотных массивов по идентификаторам профилей (профили не изменяются после создания,
+# поэтому записи кэша удаляются только при удалении профилей)
+speed_profile_cache = LRUCache(max_size=32)
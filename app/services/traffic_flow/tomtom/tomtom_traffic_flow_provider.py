@@ -1,23 +1,27 @@
+import asyncio
 import json
-import multiprocessing
 import os
 import time
-from typing import List, Dict
-
-from haversine import haversine, Unit
-from tqdm import tqdm
+from typing import List, Dict, Tuple
 
+import numpy as np
+from haversine import Unit
 from app.common_types import BBox
+from app.jobs import current_job_id, add_progress_steps, track_progress
 from app.logger import logger
+from app.process_pool import run_in_process_pool
 from app.schemas.enums import Weekday
 from app.schemas.route import RouteSchema
-from app.schemas.route_geometry import RouteStopPositionSchema
+from app.schemas.route_geometry import RouteGeometry
 from app.schemas.speed_profile_schema import RouteIdToWeekday
 from app.services.traffic_flow.base_traffic_flow_provider import BaseTrafficFlowProvider, TrafficFlowSegment
-from config import SRC_PATH, app_config
+from config import SRC_PATH
 
 HOURS = 24
 
+# Скорость движения по умолчанию (при отсутствии данных о транспортном потоке), км/ч
+DEFAULT_SPEED = 40
+
 class TomtomTrafficFlowProvider(BaseTrafficFlowProvider):
     """ Класс для получения данных о загруженности транспортных потоков посредством TomTom API """
 
@@ -30,20 +34,31 @@ class TomtomTrafficFlowProvider(BaseTrafficFlowProvider):
         logger.info(f"TRAFFIC FLOW > TOMTOM | FETCHING TRAFFIC FLOW")
         start = time.perf_counter()
 
-        route_id_to_weekday = {}
-
         bbox = self.get_routes_bounds(routes)
 
-        with multiprocessing.Pool(processes=min(len(Weekday), app_config.PROCESS_POOL_WORKERS_NUM)) as pool:
-            items = [(weekday.value, bbox, routes, speed_data_id) for weekday in Weekday]
-            for result in pool.starmap(self.routine, items):
-                weekday, route_id_to_data = result
-                for route_id, data in route_id_to_data.items():
-                    if route_id not in route_id_to_weekday:
-                        route_id_to_weekday[route_id] = {}
-                    route_id_to_weekday[route_id][weekday] = data[weekday]
-            pool.close()
-            pool.join()
+        # Сопоставление маршрутов с транспортными потоками (параллельно для каждого дня недели в общем пуле процессов).
+        # Для каждого дня недели выполняется чтение и сопоставление данных за каждый час
+        job_id = current_job_id()
+        add_progress_steps(len(Weekday) * HOURS * 2)
+        weekday_to_edge_speeds = dict(await asyncio.gather(*(
+            run_in_process_pool(self.routine, weekday.value, bbox, routes, speed_data_id, job_id) for weekday in Weekday
+        )))
+
+        # Расчёт скоростей на участках маршрутов сразу для всех часов всех дней недели
+        route_id_to_weekday = {}
+        for route in routes:
+            route_id = str(route.id)
+            edge_speeds = np.concatenate(
+                [weekday_to_edge_speeds[weekday.value][route_id] for weekday in Weekday], axis=1
+            )
+            segment_speeds = self.aggregate_segment_speeds(route.geometry, edge_speeds)
+
+            route_id_to_weekday[route_id] = {
+                weekday.value: {
+                    hour: segment_speeds[:, i * HOURS + hour].tolist() for hour in range(HOURS)
+                }
+                for i, weekday in enumerate(Weekday)
+            }
 
         end = time.perf_counter()
 
@@ -57,58 +72,68 @@ class TomtomTrafficFlowProvider(BaseTrafficFlowProvider):
         return route_id_to_weekday
 
     @staticmethod
-    def routine(weekday, bbox, routes, speed_data_id):
-        traffic_flow = TomtomTrafficFlowProvider.get_traffic_flow_segments(speed_data_id, weekday, bbox)
-        route_id_to_weekday = {}
-        for hour in tqdm(range(HOURS)):
-            traffic_flow_data = TomtomTrafficFlowProvider.match_routes_with_flows(routes, traffic_flow[hour])
-            for route in routes:
+    def routine(weekday, bbox, routes, speed_data_id, job_id=None) -> Tuple[str, Dict[str, np.ndarray]]:
+        """
+        Сопоставление маршрутов с транспортными потоками за все часы дня недели
 
-                raw_speeds = traffic_flow_data[str(route.id)]
+        Для каждого маршрута возвращается матрица скоростей на рёбрах геометрии размерности (N - 1, 24), где N -
+        количество узлов геометрии. Скорость на ребре определяется по его начальному узлу, при отсутствии данных
+        используется скорость по умолчанию.
+        """
 
-                segments_speeds = []
+        traffic_flow = TomtomTrafficFlowProvider.get_traffic_flow_segments(speed_data_id, weekday, bbox, job_id)
 
-                segment_distance = 0
-                segment_time = 0
+        routes_edge_speeds = {
+            str(route.id): np.full((max(len(route.geometry) - 1, 0), HOURS), DEFAULT_SPEED, dtype=float)
+            for route in routes
+        }
+
+        for hour in track_progress(range(HOURS), job_id):
+            traffic_flow_data = TomtomTrafficFlowProvider.match_routes_with_flows(routes, traffic_flow[hour])
+            for route in routes:
+                edge_speeds = routes_edge_speeds[str(route.id)]
+                raw_speeds = np.array(traffic_flow_data[str(route.id)][:len(edge_speeds)], dtype=float)
 
-                for node1, node2, speed in zip(route.geometry, route.geometry[1:], raw_speeds):
-                    dist = haversine((node1.lat, node1.lon), (node2.lat, node2.lon),
-                                     Unit.KILOMETERS)
+                # Замена отсутствующих (None -> nan) и нулевых скоростей скоростью по умолчанию
+                raw_speeds[np.isnan(raw_speeds) | (raw_speeds == 0)] = DEFAULT_SPEED
+                edge_speeds[:len(raw_speeds), hour] = raw_speeds
 
-                    if dist == 0:
-                        continue
+        return weekday, routes_edge_speeds
 
-                    if speed is None or speed == 0:
-                        speed = 40
+    @staticmethod
+    def aggregate_segment_speeds(geometry: RouteGeometry, edge_speeds: np.ndarray) -> np.ndarray:
+        """
+        Расчёт средних скоростей на участках маршрута между остановками
 
-                    segment_distance += dist
-                    segment_time += dist / speed
+        На вход подаётся матрица скоростей на рёбрах геометрии размерности (N - 1, T) для T временных интервалов.
+        Средняя скорость на участке - гармоническая (суммарное расстояние / суммарное время), расчёт выполняется
+        одной операцией для всех участков и всех временных интервалов. Результат - матрица размерности (M - 1, T),
+        где M - количество мест остановок.
+        """
 
-                    if type(node2) is RouteStopPositionSchema:
-                        segments_speeds.append(segment_distance / segment_time)
-                        segment_distance = 0
-                        segment_time = 0
+        edge_distances = geometry.edge_distances(Unit.KILOMETERS)
 
-                if str(route.id) not in route_id_to_weekday:
-                    route_id_to_weekday[str(route.id)] = {}
-                if weekday not in route_id_to_weekday[str(route.id)]:
-                    route_id_to_weekday[str(route.id)][weekday] = {}
-                if hour not in route_id_to_weekday[str(route.id)][weekday]:
-                    route_id_to_weekday[str(route.id)][weekday][hour] = {}
+        # Протяжённость участков и время их прохождения для каждого временного интервала
+        segment_distances = geometry.reduce_segments(edge_distances)
+        segment_times = geometry.reduce_segments(edge_distances[:, None] / edge_speeds)
 
-                route_id_to_weekday[str(route.id)][weekday][hour] = segments_speeds
+        # Для участков нулевой протяжённости используется скорость по умолчанию
+        with np.errstate(divide='ignore', invalid='ignore'):
+            segment_speeds = segment_distances[:, None] / segment_times
+        segment_speeds[segment_times == 0] = DEFAULT_SPEED
 
-        return weekday, route_id_to_weekday
+        return segment_speeds
 
     @staticmethod
-    def get_traffic_flow_segments(speed_data_id: str, day: str, bbox: BBox) -> Dict[int, List[TrafficFlowSegment]]:
+    def get_traffic_flow_segments(speed_data_id: str, day: str, bbox: BBox,
+                                  job_id: str | None = None) -> Dict[int, List[TrafficFlowSegment]]:
         local_filename = speed_data_id + '_' + day + '.json'
         local_data_path = os.path.join(SRC_PATH, 'services/traffic_flow/files', local_filename)
         with open(local_data_path, 'r', encoding='utf-8') as file:
             json_data = json.load(file)
 
         segments = {_: [] for _ in range(HOURS)}
-        for hour in tqdm(range(HOURS)):
+        for hour in track_progress(range(HOURS), job_id):
             for entry in json_data[str(hour)]:
                 segment = TrafficFlowSegment.from_json(entry)
                 p1 = segment.first_point
@@ -124,21 +149,14 @@ class TomtomTrafficFlowProvider(BaseTrafficFlowProvider):
 
     @staticmethod
     def get_routes_bounds(routes: List[RouteSchema]) -> BBox:
-        min_lon = None
-        min_lat = None
-        max_lon = None
-        max_lat = None
-
-        for route in routes:
-            for node in route.geometry:
-                if min_lon is None or node.lon < min_lon:
-                    min_lon = node.lon
-                if min_lat is None or node.lat < min_lat:
-                    min_lat = node.lat
-                if max_lon is None or node.lon > max_lon:
-                    max_lon = node.lon
-                if max_lat is None or node.lat > max_lat:
-                    max_lat = node.lat
-
-        return min_lon, min_lat, max_lon, max_lat
+        """ Ограничивающая рамка геометрии маршрутов (по массивам координат, без создания схем узлов) """
+        geometries = [route.geometry for route in routes if len(route.geometry) > 0]
+        if len(geometries) == 0:
+            return None, None, None, None
+        return (
+            float(min(geometry.lon.min() for geometry in geometries)),
+            float(min(geometry.lat.min() for geometry in geometries)),
+            float(max(geometry.lon.max() for geometry in geometries)),
+            float(max(geometry.lat.max() for geometry in geometries))
+        )
 
@@ -0,0 +1,29 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых операций
+
+    Операция с ключом, уже выполняющаяся в данный момент, повторно не запускается: все вызывающие получают результат
+    (или исключение) одного выполнения. Операция выполняется в отдельной задаче, поэтому отмена одного из вызывающих
+    (например, при разрыве соединения клиентом) не прерывает её для остальных.
+    """
+
+    def __init__(self):
+        """ Инициализация """
+        self.flights: Dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """ Выполнение операции (или ожидание результата уже выполняющейся операции с тем же ключом) """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(func())
+            self.flights[key] = flight
+            flight.add_done_callback(lambda _: self.flights.pop(key, None))
+        return await asyncio.shield(flight)
+
+    def __len__(self) -> int:
+        """ Количество выполняющихся операций """
+        return len(self.flights)
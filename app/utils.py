@@ -3,9 +3,9 @@ from decimal import Decimal
 from difflib import SequenceMatcher
 from typing import Tuple, List
 
+import numpy as np
 import pygeos
 import utm
-from pygeos.lib import Geometry
 
 Point = Tuple[float, float]
 Segment = Tuple[Point, Point]
@@ -27,11 +27,38 @@ def project_point_on_segment(segment: Segment, point: Point, padding: float = 0)
     utm_segment_end = utm_point_from_latlon(segment_end[0], segment_end[1])
     utm_point = utm_point_from_latlon(point[0], point[1])
 
+    utm_projected_point, snap_distance = project_utm_point_on_segment(
+        (utm_segment_start, utm_segment_end), utm_point, padding
+    )
+
+    if utm_projected_point is None:
+        return None, math.inf
+
+    # Конвертация спроецированной точки из UTM в latlon
+    zone_number, zone_letter = utm.from_latlon(float(point[0]), float(point[1]))[2:4]
+    latlon_projected_point = utm.to_latlon(
+        utm_projected_point[0], utm_projected_point[1],
+        zone_number=zone_number,
+        zone_letter=zone_letter
+    )
+
+    return latlon_projected_point, snap_distance
+
+def project_utm_point_on_segment(utm_segment: Segment, utm_point: Point, padding: float = 0) \
+        -> Tuple[Point | None, float]:
+    """
+    Проекция точки на отрезок (точки заданы в системе координат UTM)
+
+    В качестве результата возвращается кортеж из спроецированной точки (x, y) и расстояния от точки до отрезка.
+    В случае, если проекция точки находится за границами отрезка - возвращается кортеж (None, math.inf)
+
+    """
+
     # Формулы и соотношения:
     # https://www.desmos.com/calculator/c84wacqfvt?lang=ru
 
-    x1, y1 = utm_segment_start
-    x2, y2 = utm_segment_end
+    x1, y1 = utm_segment[0]
+    x2, y2 = utm_segment[1]
     x3, y3 = utm_point
 
     alpha = math.atan2(y2 - y1, x2 - x1)
@@ -57,34 +84,91 @@ def project_point_on_segment(segment: Segment, point: Point, padding: float = 0)
         y1 + offset_from_first_point * math.sin(alpha)
     )
 
-    # Конвертация спроецированной точки из UTM в latlon
-    zone_number, zone_letter = utm.from_latlon(float(point[0]), float(point[1]))[2:4]
-    latlon_projected_point = utm.to_latlon(
-        utm_projected_point[0], utm_projected_point[1],
-        zone_number=zone_number,
-        zone_letter=zone_letter
-    )
+    return utm_projected_point, snap_distance
 
-    return latlon_projected_point, snap_distance
+def utm_frechet_distance(first_utm_polyline: List[Point], second_utm_polyline: List[Point]) -> float:
+    """ Расчёт расстояния Фреше для ломанных, заданных в системе координат UTM """
 
-def frechet_distance(first_polyline: List[Point], second_polyline: List[Point]) -> float:
-    """ Расчёт расстояния Фреше """
-
-    # Преобразование точек первой ломанной latlon -> UTM -> Pygeos Geometry
-    first_polyline_as_utm_points = [utm_point_from_latlon(p[0], p[1]) for p in first_polyline]
-    first_route_geometry_string = ", ".join([f"{p[0]} {p[1]}" for p in first_polyline_as_utm_points])
-    first_route_geometry = Geometry(f"LINESTRING ({first_route_geometry_string})")
-
-    # Преобразование точек второй ломанной latlon -> UTM -> Pygeos Geometry
-    second_polyline_as_utm_points = [utm_point_from_latlon(p[0], p[1]) for p in second_polyline]
-    second_route_geometry_string = ", ".join([f"{p[0]} {p[1]}" for p in second_polyline_as_utm_points])
-    second_route_geometry = Geometry(f"LINESTRING ({second_route_geometry_string})")
+    # Построение геометрий Pygeos непосредственно из массивов координат
+    first_route_geometry = pygeos.linestrings(first_utm_polyline)
+    second_route_geometry = pygeos.linestrings(second_utm_polyline)
 
     # Расчёт расстояния Фреше с помощью библиотеки Pygeos
-    res = pygeos.frechet_distance(first_route_geometry, second_route_geometry)
+    res = float(pygeos.frechet_distance(first_route_geometry, second_route_geometry))
 
     return res
 
 def utm_point_from_latlon(lat: float | Decimal, lon: float | Decimal) -> Point:
     """ Конвертация координат точки из latlon (EPSG 4326) в UTM """
     return utm.from_latlon(float(lat), float(lon))[:2]
+
+def utm_points_from_latlon(lats, lons) -> Tuple[np.ndarray, int, str]:
+    """
+    Векторизованная конвертация координат точек из latlon (EPSG 4326) в UTM
+
+    Все точки проецируются в зону UTM первой точки. В качестве результата возвращается кортеж из массива координат
+    размерности (N, 2), номера и буквы зоны UTM.
+
+    """
+
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+
+    if len(lats) == 0:
+        return np.empty((0, 2)), None, None
+
+    # Определение зоны по первой точке (для точек в пределах одной зоны результат совпадает с поточечной проекцией)
+    zone_number, zone_letter = utm.from_latlon(lats[0], lons[0])[2:4]
+    xs, ys, _, _ = utm.from_latlon(lats, lons, force_zone_number=zone_number, force_zone_letter=zone_letter)
+
+    return np.column_stack((xs, ys)), zone_number, zone_letter
+
+def encode_polyline(values) -> str:
+    """
+    Кодирование последовательности целых чисел в формате Encoded Polyline
+
+    Каждое число кодируется независимо (алгоритм Google Encoded Polyline без расчёта разностей, разности координат
+    рассчитываются вызывающей стороной): знак переносится в младший бит, после чего число разбивается на блоки по 5 бит,
+    начиная с младших, каждый блок (кроме последнего) помечается флагом продолжения 0x20 и смещается на 63.
+
+    """
+
+    values = np.asarray(values, dtype=np.int64)
+
+    if len(values) == 0:
+        return ''
+
+    # Перенос знака в младший бит
+    values = np.where(values < 0, ~(values << 1), values << 1)
+
+    # Разбиение на блоки по 5 бит (64-битное число содержит не более 13 блоков) и определение количества значимых
+    # блоков для каждого числа (не менее одного блока)
+    max_chunks = 13
+    shifted_values = values[:, None] >> (5 * np.arange(max_chunks))[None, :]
+    chunks = shifted_values & 0x1f
+    chunks_count = np.maximum(1, np.count_nonzero(shifted_values, axis=1))
+
+    # Установка флага продолжения для всех блоков, кроме последнего, и отбор значимых блоков
+    chunk_positions = np.arange(max_chunks)[None, :]
+    chunks |= np.where(chunk_positions < chunks_count[:, None] - 1, 0x20, 0)
+    encoded = (chunks + 63)[chunk_positions < chunks_count[:, None]]
+
+    return encoded.astype(np.uint8).tobytes().decode('ascii')
+
+def decode_polyline(polyline: str) -> np.ndarray:
+    """ Декодирование последовательности целых чисел из формата Encoded Polyline """
+
+    chars = np.frombuffer(polyline.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+
+    if len(chars) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # Разбиение на числа по последнему блоку (без флага продолжения)
+    is_last_chunk = (chars & 0x20) == 0
+    starts = np.concatenate(([0], np.flatnonzero(is_last_chunk)[:-1] + 1))
+    value_indices = np.concatenate(([0], np.cumsum(is_last_chunk)[:-1]))
+    positions = np.arange(len(chars)) - starts[value_indices]
+
+    # Сборка чисел из блоков и восстановление знака
+    values = np.add.reduceat((chars & 0x1f) << (5 * positions), starts)
+    return np.where(values & 1, ~(values >> 1), values >> 1)
@@ -24,7 +24,27 @@ class Config(BaseSettings):
     POSTGRES_DB: str
     POSTGRES_URL: PostgresDsn
 
+    # Конфигурация пула соединений с базой данных (время ожидания и время жизни соединения в секундах,
+    # 0 в размере кэша подготовленных запросов отключает кэш)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+
     PROCESS_POOL_WORKERS_NUM: int = 8
 
+    # Конфигурация фоновых задач (количество одновременно выполняемых задач, количество хранимых завершённых задач
+    # и время хранения завершённых задач в секундах)
+    JOBS_MAX_CONCURRENT: int = 2
+    JOBS_HISTORY_SIZE: int = 100
+    JOBS_TTL: int = 3600
+
+    # Конфигурация сжатия ответов API (ответы меньше порогового размера в байтах не сжимаются)
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    GZIP_COMPRESS_LEVEL: int = 6
+    BROTLI_QUALITY: int = 4
+
 
 app_config = Config(_env_file=os.path.join(PROJECT_ROOT, '.env'))
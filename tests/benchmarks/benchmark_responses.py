@@ -0,0 +1,107 @@
+"""
+Сравнение сериализации и сжатия ответов API на типичных объёмах данных
+
+Запуск: python tests/benchmarks/benchmark_responses.py
+"""
+
+import gzip
+import os
+import sys
+import timeit
+
+import brotli
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.api.api_schemas import GetBusDataResponse
+from app.schemas.enums import BusDataProvider, RouteObstacleType, Weekday
+from app.schemas.route import RouteSchema
+from app.schemas.route_geometry import RouteGeometryBuilder
+from app.schemas.route_segment import RouteSegmentSchema
+from app.schemas.speed_profile_schema import SpeedProfileSchema
+from app.schemas.stop import StopSchema
+
+ROUTES_NUM = 50
+STOPS_PER_ROUTE = 30
+NODES_PER_SEGMENT = 60
+REPEATS = 5
+
+
+def make_bus_data() -> GetBusDataResponse:
+    """ Данные об остановках и маршрутах (в объёме крупного района города) """
+
+    stops = [
+        StopSchema(id=str(i), source=BusDataProvider.OSM, name=f'Остановка {i}', lat=60.0 + i * 1e-3, lon=30.0)
+        for i in range(ROUTES_NUM * STOPS_PER_ROUTE)
+    ]
+
+    routes = []
+    for route_num in range(ROUTES_NUM):
+        route_stops = stops[route_num * STOPS_PER_ROUTE:(route_num + 1) * STOPS_PER_ROUTE]
+
+        geometry = RouteGeometryBuilder()
+        for stop in route_stops:
+            geometry.add_stop_position(stop.lat, stop.lon, stop.id)
+            for j in range(NODES_PER_SEGMENT):
+                if j % 20 == 10:
+                    geometry.add_obstacle(stop.lat + j * 1e-5, stop.lon + j * 1e-5, RouteObstacleType.CROSSING)
+                else:
+                    geometry.add_node(stop.lat + j * 1e-5, stop.lon + j * 1e-5)
+
+        segments = [
+            RouteSegmentSchema(stop_from_id=stop_from.id, stop_to_id=stop_to.id, segment_order=i, distance=500.0,
+                               crossings=3, traffic_signals=1, speedbumps=0, roundabouts=0)
+            for i, (stop_from, stop_to) in enumerate(zip(route_stops, route_stops[1:]))
+        ]
+
+        routes.append(RouteSchema(id=str(route_num), source=BusDataProvider.OSM, name=f'Маршрут {route_num}',
+                                  stops=route_stops, segments=segments, geometry=geometry.build()))
+
+    return GetBusDataResponse(routes=routes, stops=stops)
+
+
+def make_speed_profile() -> SpeedProfileSchema:
+    """ Профиль скорости (скорости на каждом сегменте маршрута для каждого часа недели) """
+
+    # Скорости различаются для каждого сегмента и часа (псевдослучайные значения в диапазоне 10-60 км/ч)
+    def speed(*args) -> float:
+        return 10 + (hash(args) % 50000) / 1000
+
+    return SpeedProfileSchema(id='1', name='Профиль скорости', speed_data_id='1', routes={
+        str(route_num): {
+            weekday.value: {
+                hour: [speed(route_num, weekday_num, hour, i) for i in range(STOPS_PER_ROUTE - 1)]
+                for hour in range(24)
+            }
+            for weekday_num, weekday in enumerate(Weekday)
+        }
+        for route_num in range(ROUTES_NUM)
+    })
+
+
+def benchmark(name: str, model):
+    """ Сравнение рендеринга ответа (стандартный JSON и orjson) и сжатия результата """
+
+    # Преобразование модели в JSON-совместимые объекты выполняется FastAPI одинаково для обоих классов ответа
+    content = jsonable_encoder(model)
+
+    json_time = min(timeit.repeat(lambda: JSONResponse(content), number=1, repeat=REPEATS))
+    orjson_time = min(timeit.repeat(lambda: ORJSONResponse(content), number=1, repeat=REPEATS))
+    body = ORJSONResponse(content).body
+
+    gzip_time = min(timeit.repeat(lambda: gzip.compress(body, compresslevel=6), number=1, repeat=REPEATS))
+    brotli_time = min(timeit.repeat(lambda: brotli.compress(body, quality=4), number=1, repeat=REPEATS))
+
+    print(f'{name}:')
+    print(f'  JSON render:   {json_time * 1000:8.1f} ms | orjson render: {orjson_time * 1000:8.1f} ms '
+          f'(x{json_time / orjson_time:.1f})')
+    print(f'  Body size:     {len(body) / 1024:8.1f} KiB')
+    print(f'  gzip (6):      {len(gzip.compress(body, compresslevel=6)) / 1024:8.1f} KiB in {gzip_time * 1000:.1f} ms')
+    print(f'  brotli (4):    {len(brotli.compress(body, quality=4)) / 1024:8.1f} KiB in {brotli_time * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    benchmark('GetBusDataResponse', make_bus_data())
+    benchmark('SpeedProfileSchema', make_speed_profile())
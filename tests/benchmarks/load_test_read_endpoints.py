@@ -0,0 +1,84 @@
+"""
+Нагрузочный тест конечных точек чтения данных (параллельные запросы к запущенному экземпляру модуля)
+
+Запуск: python tests/benchmarks/load_test_read_endpoints.py [URL] [количество клиентов] [запросов на клиента]
+"""
+
+import asyncio
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+from httpx import AsyncClient, Limits
+
+BASE_URL = 'http://localhost:8000'
+CLIENTS_NUM = 50
+REQUESTS_PER_CLIENT = 20
+REQUEST_TIMEOUT = 60
+
+# Конечные точки чтения данных (запросы распределяются между ними по кругу)
+READ_ENDPOINTS = [
+    ('/bus_data/stops', {'source': 'local'}),
+    ('/bus_data/routes', {'source': 'local'}),
+    ('/bus_data/routes', {'source': 'local', 'geometry_encoding': 'polyline', 'zoom': 12}),
+    ('/traffic_flow/list', {}),
+    ('/traffic_flow/data/list', {}),
+    ('/stops_clustering/list', {}),
+    ('/stops_clustering/data/list', {}),
+]
+
+
+async def run_client(client: AsyncClient, client_num: int, requests_num: int,
+                     latencies: Dict[str, List[float]], errors: Dict[str, int]):
+    """ Последовательная отправка запросов одним клиентом """
+    for request_num in range(requests_num):
+        path, params = READ_ENDPOINTS[(client_num + request_num) % len(READ_ENDPOINTS)]
+        start = time.perf_counter()
+        try:
+            response = await client.get(path, params=params)
+            failed = response.status_code != 200
+        except Exception:
+            failed = True
+        if failed:
+            errors[path] += 1
+        else:
+            latencies[path].append(time.perf_counter() - start)
+
+
+async def load_test(base_url: str, clients_num: int, requests_per_client: int):
+    """ Параллельная отправка запросов и вывод статистики задержек и состояния пула соединений """
+
+    latencies, errors = defaultdict(list), defaultdict(int)
+    limits = Limits(max_connections=clients_num, max_keepalive_connections=clients_num)
+    async with AsyncClient(base_url=base_url, timeout=REQUEST_TIMEOUT, limits=limits) as client:
+        print('DB pool before:', (await client.get('/instrumentation/db_pool')).json())
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            run_client(client, client_num, requests_per_client, latencies, errors)
+            for client_num in range(clients_num)
+        ))
+        total_time = time.perf_counter() - start
+
+        print('DB pool after: ', (await client.get('/instrumentation/db_pool')).json())
+
+    requests_num = clients_num * requests_per_client
+    print(f'{requests_num} requests from {clients_num} clients in {total_time:.1f} s '
+          f'({requests_num / total_time:.1f} req/s)')
+    for path in sorted(set(latencies) | set(errors)):
+        path_latencies = np.array(latencies[path]) * 1000
+        if len(path_latencies) == 0:
+            path_latencies = np.zeros(1)
+        p50, p95, p99 = np.percentile(path_latencies, [50, 95, 99])
+        print(f'  {path:30} p50 {p50:8.1f} ms | p95 {p95:8.1f} ms | p99 {p99:8.1f} ms | '
+              f'max {path_latencies.max():8.1f} ms | errors {errors[path]}')
+
+
+if __name__ == '__main__':
+    asyncio.run(load_test(
+        sys.argv[1] if len(sys.argv) > 1 else BASE_URL,
+        int(sys.argv[2]) if len(sys.argv) > 2 else CLIENTS_NUM,
+        int(sys.argv[3]) if len(sys.argv) > 3 else REQUESTS_PER_CLIENT
+    ))
@@ -0,0 +1,88 @@
+import asyncio
+import zlib
+
+import brotli
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from httpx import AsyncClient, ASGITransport
+
+from app.middleware import CompressionMiddleware
+
+# Приложение для тестирования промежуточного слоя сжатия (без подключения к базе данных)
+compression_app = FastAPI(default_response_class=ORJSONResponse)
+compression_app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+LARGE_PAYLOAD = [{'type': 'geometry', 'lat': 60.0 + i * 1e-5, 'lon': 30.0} for i in range(1000)]
+STREAM_LINES = [f'{{"line": {i}}}\n' for i in range(3)]
+
+
+@compression_app.get('/large')
+async def get_large():
+    return LARGE_PAYLOAD
+
+@compression_app.get('/small')
+async def get_small():
+    return {'status': 'ok'}
+
+@compression_app.get('/stream')
+async def get_stream():
+    async def content():
+        for line in STREAM_LINES:
+            yield line
+    return StreamingResponse(content(), media_type='application/x-ndjson')
+
+
+@pytest.mark.asyncio
+class TestCompressionMiddleware:
+
+    @pytest.mark.parametrize('accept_encoding, content_encoding', [
+        ('gzip, deflate, br', 'br'),
+        ('gzip', 'gzip'),
+        ('identity', None)
+    ])
+    async def test_compression(self, accept_encoding, content_encoding):
+        """ Тест выбора алгоритма сжатия по заголовку Accept-Encoding """
+        async with AsyncClient(transport=ASGITransport(app=compression_app), base_url='http://test') as client:
+            response = await client.get('/large', headers={'Accept-Encoding': accept_encoding})
+
+        assert response.headers.get('content-encoding') == content_encoding
+        assert response.json() == LARGE_PAYLOAD
+        if content_encoding is not None:
+            assert int(response.headers['content-length']) < len(response.content) / 5
+
+    async def test_minimum_size(self):
+        """ Тест передачи ответов меньше порогового размера без сжатия """
+        async with AsyncClient(transport=ASGITransport(app=compression_app), base_url='http://test') as client:
+            response = await client.get('/small', headers={'Accept-Encoding': 'gzip, br'})
+
+        assert 'content-encoding' not in response.headers
+        assert response.json() == {'status': 'ok'}
+
+    @pytest.mark.parametrize('accept_encoding', ['gzip', 'br'])
+    async def test_streaming_flush(self, accept_encoding):
+        """ Тест сжатия потокового ответа (каждая часть ответа может быть распакована сразу после получения) """
+        messages = []
+
+        async def receive():
+            # Клиент не разрывает соединение до завершения ответа
+            await asyncio.Event().wait()
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/stream', 'query_string': b'', 'root_path': '',
+            'headers': [(b'accept-encoding', accept_encoding.encode())]
+        }
+        await CompressionMiddleware(compression_app, minimum_size=0)(scope, receive, send)
+
+        bodies = [message['body'] for message in messages if message['type'] == 'http.response.body']
+        if accept_encoding == 'gzip':
+            decompress = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress
+        else:
+            decompress = brotli.Decompressor().process
+
+        # Каждая строка потокового ответа доступна клиенту до получения следующих частей ответа
+        for body, line in zip(bodies, STREAM_LINES):
+            assert decompress(body).decode() == line
@@ -0,0 +1,21 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from config import app_config
+
+
+@pytest.mark.asyncio
+class TestInstrumentation:
+
+    async def test_db_pool_status(self):
+        """ Тест получения состояния пула соединений с базой данных (без подключения к базе данных) """
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://test') as client:
+            response = await client.get('/instrumentation/db_pool')
+
+        assert response.status_code == 200
+        status = response.json()
+        assert status['pool_size'] == app_config.DB_POOL_SIZE
+        assert status['max_overflow'] == app_config.DB_MAX_OVERFLOW
+        assert status['timeout'] == app_config.DB_POOL_TIMEOUT
+        assert status['checked_out'] == 0
@@ -0,0 +1,38 @@
+import msgpack
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.api.api_schemas import GetBusDataResponse
+from app.jobs import job_manager
+from app.main import app
+from app.schemas.enums import JobType
+from tests.test_services.bus_data.test_route_cache import make_route
+
+
+@pytest.mark.asyncio
+class TestJobResult:
+
+    async def test_bus_data_job_result(self):
+        """ Тест получения результата задачи получения данных с согласованием формата ответа """
+
+        route = make_route(0)
+        bus_data = GetBusDataResponse(routes=[route], stops=route.stops)
+
+        async def job():
+            return bus_data
+
+        job_id = job_manager.submit(JobType.BUS_DATA, job).id
+        await job_manager.get(job_id).task
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://test') as client:
+            response = await client.get(f'/jobs/{job_id}/result')
+            polyline_response = await client.get(f'/jobs/{job_id}/result', params={'geometry_encoding': 'polyline'})
+            msgpack_response = await client.get(f'/jobs/{job_id}/result',
+                                                headers={'Accept': 'application/x-msgpack'})
+
+        # Результат сериализуется по схеме ответа, геометрия маршрутов представляется в запрошенном формате
+        assert response.status_code == 200
+        assert response.json()['routes'][0]['geometry'] == route.model_dump(mode='json')['geometry']
+        assert isinstance(polyline_response.json()['routes'][0]['geometry']['polyline'], str)
+        assert msgpack_response.headers['content-type'] == 'application/x-msgpack'
+        assert msgpack.unpackb(msgpack_response.content)['routes'][0]['id'] == route.id
@@ -0,0 +1,32 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+
+
+@pytest.mark.asyncio
+class TestRequestValidation:
+
+    @pytest.mark.parametrize('method, url, body', [
+        ('DELETE', '/bus_data/routes', ['not-a-uuid']),
+        ('DELETE', '/bus_data/stops', ['not-a-uuid']),
+        ('POST', '/bus_data/routes_by_id', ['not-a-uuid']),
+        ('POST', '/traffic_flow/', {'name': 'Профиль', 'routes_ids': ['not-a-uuid'], 'speed_data_id': 'id'}),
+    ])
+    async def test_malformed_ids(self, method, url, body):
+        """ Тест отклонения запросов с некорректными идентификаторами записей (без обращения к базе данных) """
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://test') as client:
+            response = await client.request(method, url, json=body)
+        assert response.status_code == 422
+
+    @pytest.mark.parametrize('params', [
+        {'hour_from': 10, 'hour_to': 9},
+        {'hour_from': -1},
+        {'hour_to': 24},
+    ])
+    async def test_speed_profile_slice_hours(self, params):
+        """ Тест отклонения запросов среза профиля скорости с некорректным интервалом часов """
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://test') as client:
+            response = await client.get('/traffic_flow/profile/speeds',
+                                        params={'routes_ids': ['route'], 'weekday': 'monday', **params})
+        assert response.status_code == 422
@@ -0,0 +1,154 @@
+import pickle
+
+import numpy as np
+import pytest
+from haversine import haversine, Unit
+
+from app.schemas.enums import BusDataProvider, RouteGeometryNodeType, RouteObstacleType, GeometryEncoding
+from app.schemas.route import RouteSchema
+from app.schemas.route_geometry import RouteGeometry, RouteGeometryBuilder, RouteGeometryNodeSchema, \
+    RouteObstacleSchema, RouteStopPositionSchema, OBSTACLE_TYPES, GEOMETRY_ENCODING_CONTEXT_KEY
+
+
+class TestRouteGeometry:
+
+    NODES = [
+        {'type': 'stop_position', 'lat': 60.0, 'lon': 30.0, 'corresponding_stop_id': '1'},
+        {'type': 'obstacle', 'lat': 60.001, 'lon': 30.0, 'obstacle_type': 'crossing'},
+        {'type': 'geometry', 'lat': 60.002, 'lon': 30.0},
+        {'type': 'stop_position', 'lat': 60.003, 'lon': 30.0, 'corresponding_stop_id': '2'},
+    ]
+
+    def make_route(self) -> RouteSchema:
+        return RouteSchema(id='1', source=BusDataProvider.OSM, name='Маршрут 1', stops=[], segments=[],
+                           geometry=self.NODES)
+
+    def test_validation_and_serialization(self):
+        """ Тест валидации геометрии из списка узлов и сериализации обратно в список узлов """
+
+        route = self.make_route()
+        assert isinstance(route.geometry, RouteGeometry)
+        assert len(route.geometry) == 4
+        assert route.geometry.stop_position_indices.tolist() == [0, 3]
+
+        # Внешнее представление геометрии не изменяется
+        assert route.model_dump(mode='json')['geometry'] == self.NODES
+        assert RouteSchema.model_validate_json(route.model_dump_json()).geometry == route.geometry
+
+        # Геометрия передаётся в процессы пула
+        assert pickle.loads(pickle.dumps(route)).geometry == route.geometry
+
+    def test_nodes_access(self):
+        """ Тест получения узлов геометрии в формате pydantic-схем """
+
+        geometry = self.make_route().geometry
+        nodes = geometry.to_nodes()
+
+        assert type(nodes[0]) is RouteStopPositionSchema and nodes[0].corresponding_stop_id == '1'
+        assert type(nodes[1]) is RouteObstacleSchema and nodes[1].obstacle_type is RouteObstacleType.CROSSING
+        assert type(nodes[2]) is RouteGeometryNodeSchema and nodes[2].type is RouteGeometryNodeType.GEOMETRY
+        assert geometry[-1] == nodes[3]
+        assert RouteGeometry.from_nodes(nodes) == geometry
+
+    def test_builder_and_concatenation(self):
+        """ Тест последовательного построения и объединения геометрий """
+
+        builder = RouteGeometryBuilder()
+        builder.add_stop_position(60.0, 30.0, '1')
+        builder.add_obstacle(60.001, 30.0, RouteObstacleType.CROSSING)
+        first_geometry = builder.build()
+
+        builder = RouteGeometryBuilder()
+        builder.add_node(60.002, 30.0)
+        builder.add_stop_position(60.003, 30.0, '2')
+        second_geometry = builder.build()
+
+        geometry = first_geometry + second_geometry
+        assert geometry == self.make_route().geometry
+        assert geometry[1:3] == RouteGeometry.from_nodes(geometry.to_nodes()[1:3])
+        assert len(RouteGeometry.concatenate([])) == 0
+
+    def test_segments_reduction(self):
+        """ Тест расчёта протяжённости участков и количества препятствий между местами остановок """
+
+        builder = RouteGeometryBuilder()
+        builder.add_node(59.999, 30.0)
+        builder.add_stop_position(60.000, 30.0, '1')
+        builder.add_obstacle(60.001, 30.0, RouteObstacleType.CROSSING)
+        builder.add_obstacle(60.002, 30.0, RouteObstacleType.CROSSING)
+        builder.add_stop_position(60.003, 30.0, '2')
+        builder.add_obstacle(60.004, 30.0, RouteObstacleType.SPEEDBUMP)
+        builder.add_stop_position(60.005, 30.0, '3')
+        builder.add_obstacle(60.006, 30.0, RouteObstacleType.ROUNDABOUT)
+        geometry = builder.build()
+
+        edge_distances = geometry.edge_distances()
+        assert len(edge_distances) == len(geometry) - 1
+        assert edge_distances[0] == pytest.approx(haversine((59.999, 30.0), (60.000, 30.0), Unit.METERS))
+
+        # Рёбра до первого и после последнего места остановки не учитываются
+        distances = geometry.reduce_segments(edge_distances)
+        assert distances == pytest.approx([edge_distances[1:4].sum(), edge_distances[4:6].sum()])
+
+        # Суммирование выполняется независимо для каждого столбца
+        assert geometry.reduce_segments(np.column_stack((edge_distances, 2 * edge_distances)))[:, 1] == \
+               pytest.approx(2 * distances)
+
+        obstacle_counts = geometry.segment_obstacle_counts()
+        assert obstacle_counts[:, OBSTACLE_TYPES.index(RouteObstacleType.CROSSING)].tolist() == [2, 0]
+        assert obstacle_counts[:, OBSTACLE_TYPES.index(RouteObstacleType.SPEEDBUMP)].tolist() == [0, 1]
+        assert obstacle_counts[:, OBSTACLE_TYPES.index(RouteObstacleType.ROUNDABOUT)].tolist() == [0, 0]
+
+        # Геометрия с одним местом остановки не содержит участков
+        assert geometry[:3].reduce_segments(geometry[:3].edge_distances()).shape == (0,)
+
+    @pytest.mark.parametrize('encoding', [GeometryEncoding.POLYLINE, GeometryEncoding.DELTA])
+    def test_compact_encoding(self, encoding):
+        """ Тест компактного представления геометрии (разности координат и разреженные аннотации узлов) """
+
+        route = self.make_route()
+        data = route.geometry.encode(encoding)
+
+        assert data['obstacles'] == {'indices': [1], 'types': ['crossing']}
+        assert data['stop_positions'] == {'indices': [0, 3], 'stop_ids': ['1', '2']}
+        if encoding is GeometryEncoding.DELTA:
+            assert data['lat'] == [60000000, 1000, 1000, 1000]
+            assert data['lon'] == [30000000, 0, 0, 0]
+
+        # Восстановление геометрии (координаты - с точностью до округления)
+        decoded = RouteGeometry.decode(data)
+        assert decoded.node_type.tolist() == route.geometry.node_type.tolist()
+        assert decoded.obstacle_type.tolist() == route.geometry.obstacle_type.tolist()
+        assert decoded.stop_ref.tolist() == route.geometry.stop_ref.tolist()
+        assert decoded.lat == pytest.approx(route.geometry.lat, abs=1e-6)
+        assert decoded.lon == pytest.approx(route.geometry.lon, abs=1e-6)
+
+        # Формат сериализации задаётся контекстом сериализации
+        context = {GEOMETRY_ENCODING_CONTEXT_KEY: encoding}
+        assert route.model_dump(mode='json', context=context)['geometry'] == data
+        assert route.model_dump(mode='json')['geometry'] == self.NODES
+
+    def test_simplification(self):
+        """ Тест упрощения геометрии (места остановок и препятствия сохраняются) """
+
+        # Зигзаг с отклонениями около 3 м от прямой, препятствием и местом остановки в середине
+        builder = RouteGeometryBuilder()
+        builder.add_stop_position(60.0, 30.0, '1')
+        for i in range(1, 200):
+            lat, lon = 60.0 + i * 1e-4, 30.0 + (5e-5 if i % 2 else 0)
+            if i == 50:
+                builder.add_obstacle(lat, lon, RouteObstacleType.CROSSING)
+            elif i == 100:
+                builder.add_stop_position(lat, lon, '2')
+            else:
+                builder.add_node(lat, lon)
+        builder.add_stop_position(60.02, 30.0, '3')
+        geometry = builder.build()
+
+        # Промежуточные узлы геометрии отклоняются от прямой менее чем на допуск и исключаются
+        simplified = geometry.simplify(10)
+        assert [node.type.value for node in simplified] == ['stop_position', 'obstacle', 'stop_position', 'stop_position']
+        assert [node.corresponding_stop_id for node in simplified if node.type.value == 'stop_position'] == ['1', '2', '3']
+
+        # При допуске меньше отклонений геометрия сохраняется полностью
+        assert geometry.simplify(1) == geometry
@@ -1,4 +1,4 @@
-from overpy import Result, Node, Way, Relation, RelationMember, RelationNode, RelationWay
+from overpy import Result, Node, Way, Relation, RelationMember, RelationNode, RelationWay, RelationRelation
 
 
 class OverpassApiMock:
@@ -205,6 +205,18 @@ class OverpassApiMock:
 
         self.data = routes_result
 
+    def load_route_master_routes(self):
+        self.load_base_routes()
+
+        # Мастер-маршрут, объединяющий оба направления базового маршрута
+        self.data.append(
+            Relation(rel_id=3, tags={'name': 'Маршрут 1', 'type': 'route_master'}, attributes={}, result=self.data,
+                     members=[
+                         RelationRelation(ref=1, attributes={}),
+                         RelationRelation(ref=2, attributes={})
+                     ])
+        )
+
     def load_complex_geometry_routes(self):
         nodes_result = Result(elements=[
             # Платформы и места остановок
@@ -1002,5 +1014,26 @@ class OverpassApiMock:
 
         self.data = routes_result
 
+    def load_routes_changes(self):
+        # Ответ на запрос существующих маршрутов (маршрут 4 удалён) и их мастер-маршрутов
+        existence_result = Result(elements=[
+            Relation(rel_id=rel_id, tags={}, attributes={}, members=[]) for rel_id in (1, 2, 3)
+        ])
+        existence_result.append(
+            Relation(rel_id=10, tags={'type': 'route_master'}, attributes={}, result=existence_result,
+                     members=[
+                         RelationRelation(ref=1, attributes={}),
+                         RelationRelation(ref=2, attributes={})
+                     ])
+        )
+
+        # Ответ на запрос изменённых маршрутов (изменено второе направление мастер-маршрута)
+        changes_result = Result(elements=[Relation(rel_id=2, tags={}, attributes={}, members=[])])
+
+        self.data = [existence_result, changes_result]
+
     def query(self, *args, **kwargs):
+        # Последовательность ответов возвращается по одному ответу на каждый запрос
+        if isinstance(self.data, list):
+            return self.data.pop(0)
         return self.data
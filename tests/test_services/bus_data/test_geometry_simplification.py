@@ -0,0 +1,34 @@
+from app.schemas.enums import BusDataProvider
+from app.schemas.route import RouteSchema
+from app.schemas.route_geometry import RouteGeometryBuilder, zoom_tolerance
+from app.services.bus_data.geometry_simplification import simplify_route, simplified_geometry_cache
+
+
+def make_route(deviation: float) -> RouteSchema:
+    # Маршрут из 50 узлов с отклонениями от прямой линии
+    geometry = RouteGeometryBuilder()
+    geometry.add_stop_position(60.0, 30.0, '1')
+    for i in range(1, 49):
+        geometry.add_node(60.0 + i * 1e-4, 30.0 + (deviation if i % 2 else 0))
+    geometry.add_stop_position(60.0049, 30.0, '2')
+    return RouteSchema(id='1', source=BusDataProvider.LOCAL, name='Маршрут 1', stops=[], segments=[],
+                       geometry=geometry.build())
+
+
+def test_simplify_route():
+    """ Тест упрощения геометрии маршрута с кэшированием результата """
+
+    simplified_geometry_cache.clear()
+    route = make_route(deviation=1e-5)
+
+    simplified = simplify_route(route, zoom_tolerance(12))
+    assert len(simplified.geometry) == 2 and len(route.geometry) == 50
+    assert simplified.id == route.id and simplified.segments == route.segments
+
+    # Повторное упрощение использует кэш, без допуска маршрут возвращается без изменений
+    assert simplify_route(route, zoom_tolerance(12)).geometry is simplified.geometry
+    assert simplify_route(route, None) is route
+
+    # Изменение геометрии маршрута с тем же идентификатором не приводит к использованию устаревшего результата
+    changed_route = make_route(deviation=1e-3)
+    assert len(simplify_route(changed_route, zoom_tolerance(12)).geometry) > 2
@@ -0,0 +1,112 @@
+from typing import AsyncGenerator
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import StaticPool
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+
+from app.database.daos.route_dao import RouteDAO
+from app.database.daos.stop_dao import StopDAO
+from app.database.models import *
+from app.dispatcher.dispatcher import Dispatcher, RoutesNotFoundError
+from app.schemas.enums import BusDataProvider
+from app.schemas.route import RouteSchema
+from app.schemas.route_geometry import RouteGeometryBuilder
+from app.schemas.route_segment import RouteSegmentSchema
+from app.schemas.stop import StopSchema
+from app.services.bus_data.local.local_bus_data_provider import LocalBusDataProvider, route_cache
+
+
+def make_route(route_num: int) -> RouteSchema:
+    # Маршрут OSM из двух остановок (первая остановка общая для всех маршрутов)
+    stops = [
+        StopSchema(id='1', source=BusDataProvider.OSM, name='Остановка 1', lat=60.0, lon=30.0),
+        StopSchema(id=str(route_num + 2), source=BusDataProvider.OSM, name=f'Остановка {route_num + 2}',
+                   lat=60.01, lon=30.0 + route_num * 1e-3)
+    ]
+    geometry = RouteGeometryBuilder()
+    geometry.add_stop_position(stops[0].lat, stops[0].lon, stops[0].id)
+    geometry.add_node(60.005, 30.0)
+    geometry.add_stop_position(stops[1].lat, stops[1].lon, stops[1].id)
+    segments = [RouteSegmentSchema(stop_from_id=stops[0].id, stop_to_id=stops[1].id, segment_order=0, distance=1000.0,
+                                   crossings=0, traffic_signals=0, speedbumps=0, roundabouts=0)]
+    return RouteSchema(id=str(100 + route_num), source=BusDataProvider.OSM, name=f'Маршрут {route_num}', stops=stops,
+                       final_stop_order=1, segments=segments, geometry=geometry.build())
+
+
+@pytest_asyncio.fixture
+async def session() -> AsyncGenerator:
+    # База данных, размещаемая в оперативной памяти
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:', connect_args={'check_same_thread': False},
+                                 poolclass=StaticPool)
+    async with engine.begin() as async_conn:
+        await async_conn.run_sync(Base.metadata.create_all)
+    async with async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)() as session:
+        yield session
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_route_cache(session):
+    """ Тест кэширования маршрутов локальной базы данных с учётом версий записей """
+
+    route_cache.clear()
+    db_routes = await RouteDAO(session).create_all([make_route(0), make_route(1)])
+    routes_ids = [str(db_route.id) for db_route in db_routes]
+    provider = LocalBusDataProvider(session)
+
+    # Повторное получение маршрутов не приводит к повторному преобразованию
+    routes = await provider.get_routes_by_ids(routes_ids)
+    assert len(route_cache) == 2 and {route.id for route in routes} == set(routes_ids)
+    cached_routes = await provider.get_routes_by_ids(routes_ids)
+    assert all(route is cached_route for route, cached_route in zip(routes, cached_routes))
+    assert {route.id for route in await provider.get_routes_in_bbox(None)} == set(routes_ids)
+
+    # Повторный импорт неизменённой остановки не изменяет версии маршрутов
+    versions = set(await RouteDAO(session).get_versions())
+    stop_ids = await StopDAO(session).upsert_all([make_route(0).stops[0]])
+    assert set(await RouteDAO(session).get_versions()) == versions
+    assert [str(stop_id) for stop_id in stop_ids] == [routes[0].stops[0].id]
+
+    # Изменение общей остановки увеличивает версии обоих маршрутов
+    await StopDAO(session).create_all([
+        StopSchema(id='1', source=BusDataProvider.OSM, name='Новое название', lat=60.0, lon=30.0)
+    ])
+    changed_routes = await provider.get_routes_by_ids(routes_ids)
+    assert [route.stops[0].name for route in changed_routes] == ['Новое название', 'Новое название']
+
+    # Обновление маршрута с сохранением идентификатора увеличивает версию записи
+    updated_route = make_route(0).model_copy(update={'name': 'Обновлённый маршрут'})
+    await RouteDAO(session).update(db_routes[0], updated_route)
+    updated_routes = {route.id: route for route in await provider.get_routes_by_ids(routes_ids)}
+    assert updated_routes[routes_ids[0]].name == 'Обновлённый маршрут'
+
+
+@pytest.mark.asyncio
+async def test_get_routes_with_geometry(session):
+    """ Тест получения маршрутов для генерации профиля скорости (без остановок, с проверкой отсутствующих маршрутов) """
+
+    db_routes = await RouteDAO(session).create_all([make_route(0), make_route(1)])
+    routes_ids = [str(db_route.id) for db_route in db_routes]
+    session.expunge_all()
+
+    # Геометрия и сегменты маршрутов совпадают с полученными при полной загрузке записей
+    loaded_routes = await RouteDAO(session).get_all_with_geometry_by_ids(routes_ids)
+    assert {str(db_route.id) for db_route in loaded_routes} == set(routes_ids)
+    for db_route in loaded_routes:
+        assert db_route.stops == []
+        route = LocalBusDataProvider.db_route_as_schema(db_route)
+        expected_route = make_route(int(db_route.name.split()[-1]))
+        nodes = route.geometry.to_nodes()
+        assert [(node.lat, node.lon) for node in nodes] == \
+               [(node.lat, node.lon) for node in expected_route.geometry.to_nodes()]
+        assert [nodes[0].corresponding_stop_id, nodes[-1].corresponding_stop_id] == \
+               [route.segments[0].stop_from_id, route.segments[0].stop_to_id]
+        assert [segment.distance for segment in route.segments] == [1000.0]
+
+    # Профиль скорости не строится, если часть маршрутов отсутствует
+    missing_route_id = str(uuid4())
+    with pytest.raises(RoutesNotFoundError) as e:
+        await Dispatcher(session).generate_speed_profile('Профиль', routes_ids + [missing_route_id], str(uuid4()))
+    assert e.value.routes_ids == [missing_route_id]
@@ -0,0 +1,113 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.schemas.enums import BusDataProvider
+from app.schemas.stop import StopSchema
+from app.services.bus_data.osm.route_pairing import RoutePairingIndex
+from app.utils import utm_frechet_distance
+
+
+def make_stops(points):
+    return [
+        StopSchema(id=str(i), source=BusDataProvider.OSM, name=f'Остановка {i}', lat=lat, lon=lon)
+        for i, (lat, lon) in enumerate(points)
+    ]
+
+
+class TestRoutePairingIndex:
+
+    # Опорная ломанная маршрута (~5.5 км с юга на север)
+    BASE_POINTS = [(60.00, 30.30), (60.01, 30.30), (60.02, 30.30), (60.03, 30.30), (60.04, 30.30), (60.05, 30.30)]
+
+    def test_get_candidates(self):
+        """ Тест отбора маршрутов-кандидатов (фильтрация по концам маршрутов и ограничивающим рамкам) """
+
+        routes_stops = {
+            # Исходный маршрут
+            1: make_stops(self.BASE_POINTS),
+            # Парный маршрут (обратное направление)
+            2: make_stops(self.BASE_POINTS[::-1]),
+            # Конец маршрута смещён на ~5.5 км от начала исходного маршрута
+            3: make_stops(self.BASE_POINTS[::-1][:-1] + [(59.95, 30.30)]),
+            # Концы маршрута совпадают, но промежуточная остановка смещена на ~11 км к востоку
+            4: make_stops(self.BASE_POINTS[::-1][:3] + [(60.02, 30.50)] + self.BASE_POINTS[::-1][3:]),
+            # Маршрут совпадает с исходным по направлению (развёрнутые концы не совпадают)
+            5: make_stops(self.BASE_POINTS),
+            # Вырожденный маршрут из одной остановки
+            6: make_stops(self.BASE_POINTS[:1]),
+        }
+
+        index = RoutePairingIndex(routes_stops)
+
+        assert index.get_candidates(1) == [2]
+        assert index.get_candidates(6) == []
+
+    def test_get_candidates_matches_brute_force(self):
+        """ Тест совпадения результатов поиска пары с полным перебором всех пар маршрутов """
+
+        rng = random.Random(42)
+        routes_stops = {}
+        route_id = 0
+        for _ in range(15):
+            # Случайная ломанная маршрута
+            lat, lon = 60 + rng.uniform(0, 0.1), 30.3 + rng.uniform(0, 0.2)
+            points = []
+            for _ in range(rng.randint(2, 8)):
+                lat, lon = lat + rng.uniform(-0.01, 0.01), lon + rng.uniform(-0.02, 0.02)
+                points.append((lat, lon))
+            routes_stops[route_id] = make_stops(points)
+            route_id += 1
+
+            # Зашумлённый маршрут обратного направления
+            noise = rng.choice((0.001, 0.01, 0.05))
+            reversed_points = [
+                (lat + rng.uniform(-noise, noise), lon + rng.uniform(-noise, noise)) for lat, lon in points[::-1]
+            ]
+            routes_stops[route_id] = make_stops(reversed_points)
+            route_id += 1
+
+        index = RoutePairingIndex(routes_stops)
+
+        def best_pair(route_id, other_ids):
+            best_id, best_dist = None, None
+            for other_id in other_ids:
+                dist = utm_frechet_distance(index.utm_polylines[route_id], index.utm_polylines[other_id][::-1])
+                if dist < index.tolerance and (best_id is None or dist < best_dist):
+                    best_id, best_dist = other_id, dist
+            return best_id
+
+        has_pairs = False
+        for route_id in routes_stops:
+            brute_force_pair = best_pair(route_id, [other_id for other_id in routes_stops if other_id != route_id])
+            indexed_pair = best_pair(route_id, index.get_candidates(route_id))
+            assert brute_force_pair == indexed_pair
+            has_pairs = has_pairs or brute_force_pair is not None
+
+        assert has_pairs
+
+    def test_frechet_distances(self):
+        """ Тест пакетного расчёта расстояний Фреше """
+
+        rng = random.Random(7)
+        routes_stops = {
+            route_id: make_stops([
+                (60 + rng.uniform(0, 0.05), 30.3 + rng.uniform(0, 0.1)) for _ in range(rng.randint(2, 6))
+            ])
+            for route_id in range(6)
+        }
+        index = RoutePairingIndex(routes_stops)
+
+        route_pairs = [(a, b) for a in routes_stops for b in routes_stops if a != b]
+        distances = index.frechet_distances(route_pairs)
+
+        expected_distances = [
+            utm_frechet_distance(index.utm_polylines[a], index.utm_polylines[b][::-1]) for a, b in route_pairs
+        ]
+        assert distances == pytest.approx(expected_distances)
+
+        # Пустой список пар
+        empty_distances = index.frechet_distances([])
+        assert isinstance(empty_distances, np.ndarray)
+        assert empty_distances.shape == (0,)
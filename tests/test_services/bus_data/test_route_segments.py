@@ -0,0 +1,75 @@
+import pytest
+from haversine import haversine, Unit
+
+from app.schemas.enums import RouteObstacleType
+from app.schemas.route_geometry import RouteStopPositionSchema, RouteObstacleSchema
+from app.services.bus_data.osm.osm_bus_data_provider import OSMBusDataProvider
+from tests.test_services.bus_data.overpass_api_mock import OverpassApiMock
+
+
+def reference_route_segments(stops, nodes):
+    """ Поузловое построение сегментов маршрута (прежняя реализация) """
+    segments = []
+    geometry_cursor = 1
+    stop_cursor = 0
+    distance = 0
+    obstacles = dict.fromkeys(RouteObstacleType, 0)
+    last_node = None
+    while geometry_cursor < len(nodes):
+        node = nodes[geometry_cursor]
+        if last_node is None:
+            last_node = node
+            continue
+        distance += haversine((last_node.lat, last_node.lon), (node.lat, node.lon), unit=Unit.METERS)
+        if isinstance(node, RouteStopPositionSchema):
+            if str(stops[stop_cursor].id) != str(stops[stop_cursor + 1].id):
+                segments.append((str(stops[stop_cursor].id), str(stops[stop_cursor + 1].id), stop_cursor, distance,
+                                 tuple(obstacles.values())))
+            stop_cursor += 1
+            distance = 0
+            obstacles = dict.fromkeys(RouteObstacleType, 0)
+        elif isinstance(node, RouteObstacleSchema):
+            obstacles[node.obstacle_type] += 1
+        last_node = node
+        geometry_cursor += 1
+    return segments
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('load_routes, bbox', [
+    ('load_base_routes_reversed', (30.37230429715162, 59.99280989676329, 30.39241435827749, 60.00717280149259)),
+    ('load_complex_geometry_routes', (30.381612209325752, 60.013091738149, 30.41004456678565, 60.02400742890481)),
+    ('load_route_master_routes', (30.37230429715162, 59.99280989676329, 30.39241435827749, 60.00717280149259))
+])
+async def test_route_segments_match_reference(load_routes, bbox):
+    """
+    Тест построения сегментов маршрута по массивам геометрии в сравнении с прежней поузловой реализацией
+
+    Прежняя реализация не учитывала ребро между первым и вторым узлами геометрии (геометрия всегда начинается
+    с места первой остановки), поэтому протяжённость первого сегмента отличается ровно на длину этого ребра.
+    Остальные сегменты и количество препятствий совпадают.
+    """
+
+    overpass_api_mock = OverpassApiMock()
+    getattr(overpass_api_mock, load_routes)()
+    routes = await OSMBusDataProvider(overpass_api_mock=overpass_api_mock).get_routes_in_bbox(bbox)
+    assert len(routes) > 0
+
+    for route in routes:
+        nodes = route.geometry.to_nodes()
+        assert isinstance(nodes[0], RouteStopPositionSchema)
+
+        segments = [
+            (segment.stop_from_id, segment.stop_to_id, segment.segment_order, segment.distance,
+             (segment.crossings, segment.traffic_signals, segment.speedbumps, segment.roundabouts))
+            for segment in route.segments
+        ]
+        reference_segments = reference_route_segments(route.stops, nodes)
+        assert [segment[:3] + segment[4:] for segment in segments] == \
+               [segment[:3] + segment[4:] for segment in reference_segments]
+
+        first_edge = haversine((nodes[0].lat, nodes[0].lon), (nodes[1].lat, nodes[1].lon), unit=Unit.METERS)
+        distances = [segment[3] for segment in segments]
+        reference_distances = [segment[3] for segment in reference_segments]
+        assert distances[0] == pytest.approx(reference_distances[0] + first_edge)
+        assert distances[1:] == pytest.approx(reference_distances[1:])
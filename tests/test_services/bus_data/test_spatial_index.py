@@ -0,0 +1,74 @@
+import pytest
+from overpy import Node
+
+from app.services.bus_data.osm.spatial_index import BBoxSpatialIndex, UTMNodeTable
+from app.services.bus_data.osm.wrappers import OSMWayWrapper
+from app.utils import utm_point_from_latlon
+
+
+def make_node(node_id, lat, lon, tags=None):
+    return Node(node_id=node_id, lat=lat, lon=lon, tags=tags or {}, attributes={})
+
+
+class TestBBoxSpatialIndex:
+
+    def test_queries(self):
+        """ Тест запросов к общему пространственному индексу мест остановок и отрезков дорог """
+
+        nodes = [
+            make_node(1, 60.0000, 30.3000),
+            make_node(2, 60.0010, 30.3000, {'public_transport': 'stop_position'}),
+            make_node(3, 60.0020, 30.3000),
+            make_node(4, 60.0000, 30.3100, {'public_transport': 'stop_position'}),
+            make_node(5, 60.0020, 30.3100),
+        ]
+        node_by_id = {node.id: node for node in nodes}
+        way_by_id = {
+            1: OSMWayWrapper(id=1, tags={}, nodes=[nodes[0], nodes[1], nodes[2]]),
+            2: OSMWayWrapper(id=2, tags={}, nodes=[nodes[3], nodes[4]]),
+        }
+
+        spatial_index = BBoxSpatialIndex(node_by_id, way_by_id)
+
+        # Координаты UTM рассчитываются для всех узлов
+        assert len(spatial_index.utm_table) == 5
+
+        # Платформа вблизи узла 2
+        platform = utm_point_from_latlon(60.0011, 30.3001)
+
+        # Места остановок в радиусе 30 м
+        assert [[node.id for node in nodes] for nodes in spatial_index.query_stop_positions([platform], r=30)] == [[2]]
+
+        # Отрезки дороги 1, концы которых находятся в радиусе 50 м (без дублирования отрезков)
+        segments = spatial_index.query_way_segments([platform], r=50, way_ids={1, 2})
+        assert len(segments) == 1
+        assert sorted(segments[0]) == [(1, 0), (1, 1)]
+
+        # Отрезки дорог, не входящих в маршрут, не учитываются
+        assert spatial_index.query_way_segments([platform], r=50, way_ids={2}) == [[]]
+
+    def test_utm_node_table(self):
+        """ Тест таблицы координат узлов в системе координат UTM """
+
+        nodes = [make_node(30, 60.0020, 30.3000), make_node(10, 60.0000, 30.3000), make_node(20, 60.0010, 30.3100)]
+        utm_table = UTMNodeTable.from_nodes(nodes + nodes[:1])
+
+        # Векторизованная проекция совпадает с поточечной
+        assert len(utm_table) == 3
+        for node in nodes:
+            assert utm_table[node.id] == pytest.approx(utm_point_from_latlon(node.lat, node.lon))
+        assert utm_table.get_points([20, 10]).ravel() == pytest.approx(
+            [*utm_point_from_latlon(60.0010, 30.3100), *utm_point_from_latlon(60.0000, 30.3000)]
+        )
+
+        # Формирование таблицы для подмножества узлов
+        sliced_utm_table = utm_table.slice([20, 30])
+        assert 20 in sliced_utm_table and 10 not in sliced_utm_table
+        assert sliced_utm_table[30] == utm_table[30]
+
+        # Обратная конвертация в latlon
+        assert utm_table.to_latlon(utm_table[20]) == pytest.approx((60.0010, 30.3100))
+
+        # Отсутствующий узел
+        with pytest.raises(KeyError):
+            utm_table.get_points([40])
@@ -0,0 +1,216 @@
+import math
+import struct
+from typing import List, Tuple, Dict
+
+import numpy as np
+
+from app.schemas.enums import BusDataProvider, RouteObstacleType
+from app.schemas.route import RouteSchema
+from app.schemas.route_geometry import RouteGeometryBuilder, RouteGeometry
+from app.schemas.stop import StopSchema
+from app.services.bus_data.local.local_bus_data_provider import LocalBusDataProvider, VectorTileSource
+from app.cache import LRUCache
+from app.services.bus_data.tiles.vector_tiles import encode_varints, zigzag, TileProjection
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """ Чтение числа в формате varint """
+    result, shift = 0, 0
+    while True:
+        byte = data[pos]
+        result |= (byte & 0x7f) << shift
+        pos += 1
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def read_message(data: bytes) -> List[Tuple[int, int | bytes]]:
+    """ Чтение полей сообщения Protocol Buffers """
+    fields, pos = [], 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        else:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.append((field_number, value))
+    return fields
+
+
+def read_packed(data: bytes) -> List[int]:
+    """ Чтение упакованной последовательности чисел varint """
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def decode_tile(tile: bytes) -> Dict[str, List[Dict]]:
+    """ Декодирование векторной плитки в формат {слой: [{'properties': ..., 'geometry': ...}]} """
+
+    layers = {}
+    for _, layer_data in read_message(tile):
+        layer_fields = read_message(layer_data)
+        name = next(value for field, value in layer_fields if field == 1).decode()
+        keys = [value.decode() for field, value in layer_fields if field == 3]
+
+        values = []
+        for field, value_data in layer_fields:
+            if field != 4:
+                continue
+            value_type, value = read_message(value_data)[0]
+            if value_type == 1:
+                values.append(value.decode())
+            elif value_type == 3:
+                values.append(struct.unpack('<d', value)[0])
+            else:
+                values.append(value)
+
+        features = []
+        for field, feature_data in layer_fields:
+            if field != 2:
+                continue
+            feature_fields = dict(read_message(feature_data))
+            tags = read_packed(feature_fields[2])
+            properties = {keys[tags[i]]: values[tags[i + 1]] for i in range(0, len(tags), 2)}
+
+            # Декодирование команд геометрии в список ломанных (абсолютные координаты)
+            commands, parts, cursor, i = read_packed(feature_fields[4]), [], (0, 0), 0
+            while i < len(commands):
+                command, count = commands[i] & 0x7, commands[i] >> 3
+                i += 1
+                for _ in range(count):
+                    dx, dy = (commands[i] >> 1) ^ -(commands[i] & 1), (commands[i + 1] >> 1) ^ -(commands[i + 1] & 1)
+                    cursor = (cursor[0] + dx, cursor[1] + dy)
+                    i += 2
+                    if command == 1:
+                        parts.append([cursor])
+                    else:
+                        parts[-1].append(cursor)
+
+            features.append({'properties': properties, 'type': feature_fields[3], 'geometry': parts})
+
+        layers[name] = features
+
+    return layers
+
+
+class TestVectorTiles:
+
+    STOPS = [
+        StopSchema(id='1', source=BusDataProvider.LOCAL, name='Остановка 1', lat=60.0, lon=30.0),
+        StopSchema(id='2', source=BusDataProvider.LOCAL, name='Остановка 2', lat=60.01, lon=30.01),
+    ]
+
+    def make_route(self) -> RouteSchema:
+        # Маршрут из 100 узлов с небольшими отклонениями от прямой линии и одним препятствием
+        geometry = RouteGeometryBuilder()
+        geometry.add_stop_position(60.0, 30.0, '1')
+        for i in range(1, 99):
+            lat, lon = 60.0 + i * 1e-4, 30.0 + i * 1e-4 + (1e-5 if i % 2 else 0)
+            if i == 50:
+                geometry.add_obstacle(lat, lon, RouteObstacleType.CROSSING)
+            else:
+                geometry.add_node(lat, lon)
+        geometry.add_stop_position(60.01, 30.01, '2')
+        return RouteSchema(id='1', source=BusDataProvider.LOCAL, name='Маршрут 1', stops=self.STOPS, segments=[],
+                           geometry=geometry.build())
+
+    @staticmethod
+    def projection_at(z: int, lat: float, lon: float) -> TileProjection:
+        tiles_num = 2 ** z
+        x = int((lon + 180) / 360 * tiles_num)
+        y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * tiles_num)
+        return TileProjection(z, x, y)
+
+    def test_encoding_primitives(self):
+        """ Тест кодирования чисел в формате varint и переноса знака """
+        assert encode_varints([1, 150, 300]) == b'\x01\x96\x01\xac\x02'
+        assert encode_varints([]) == b''
+        assert zigzag([0, -1, 1, -2, 2]).tolist() == [0, 1, 2, 3, 4]
+
+    def test_projection(self):
+        """ Тест проекции координат в систему координат плитки """
+        projection = self.projection_at(14, 60.005, 30.005)
+        lon_min, lat_min, lon_max, lat_max = projection.bbox()
+
+        corners = projection.project([lat_max, lat_min], [lon_min, lon_max])
+        assert np.allclose(corners, [[0, 0], [4096, 4096]], atol=1e-6)
+        assert not TileProjection(2, 4, 0).is_valid
+
+    def test_build_vector_tile(self):
+        """ Тест построения векторной плитки с маршрутами, остановками и препятствиями """
+
+        projection = self.projection_at(14, 60.005, 30.005)
+        tile = decode_tile(LocalBusDataProvider.build_vector_tile(projection, self.STOPS, [self.make_route()]))
+
+        assert [feature['properties'] for feature in tile['routes']] == [{'id': '1', 'name': 'Маршрут 1'}]
+        assert [feature['properties'] for feature in tile['obstacles']] == [{'obstacle_type': 'crossing'}]
+
+        # Остановки за пределами плитки не добавляются
+        for feature in tile['stops']:
+            x, y = feature['geometry'][0][0]
+            assert -64 <= x <= 4096 + 64 and -64 <= y <= 4096 + 64
+
+        # Геометрия маршрута обрезается по границам плитки (с учётом буферной зоны)
+        for part in tile['routes'][0]['geometry']:
+            assert all(-64 <= x <= 4096 + 64 and -64 <= y <= 4096 + 64 for x, y in part)
+
+    def test_zoom_simplification(self):
+        """ Тест упрощения геометрии маршрутов и отбора слоёв в зависимости от уровня масштабирования """
+
+        route = self.make_route()
+
+        low_zoom_tile = decode_tile(LocalBusDataProvider.build_vector_tile(
+            self.projection_at(10, 60.005, 30.005), self.STOPS, [route]
+        ))
+        high_zoom_tile = decode_tile(LocalBusDataProvider.build_vector_tile(
+            self.projection_at(20, 60.005, 30.005), self.STOPS, [route]
+        ))
+
+        # На малом масштабе отклонения от прямой неразличимы, остановки и препятствия не отображаются
+        assert sum(len(part) for part in low_zoom_tile['routes'][0]['geometry']) == 2
+        assert set(low_zoom_tile.keys()) == {'routes'}
+
+        # На большом масштабе отклонения от прямой сохраняются
+        assert sum(len(part) for part in high_zoom_tile['routes'][0]['geometry']) > 2
+
+    def test_vector_tile_cache(self):
+        """ Тест кэша векторных плиток (вытеснение и инвалидация) """
+
+        cache = LRUCache(max_size=2)
+        cache.put((0, 0, 0), b'a', cache.generation)
+        cache.put((1, 0, 0), b'b', cache.generation)
+        assert cache.get((0, 0, 0)) == b'a'
+
+        # Вытесняется давно не использовавшаяся плитка
+        cache.put((1, 1, 0), b'c', cache.generation)
+        assert cache.get((1, 0, 0)) is None and cache.get((0, 0, 0)) == b'a'
+
+        # Плитка, построение которой началось до очистки кэша, не сохраняется
+        generation = cache.generation
+        cache.clear()
+        cache.put((0, 0, 0), b'a', generation)
+        assert cache.get((0, 0, 0)) is None
+
+    def test_vector_tile_source(self):
+        """ Тест отбора маршрутов и остановок, пересекающих плитку, по ограничивающим рамкам """
+
+        route = self.make_route()
+        geometry = route.geometry
+        distant_geometry = RouteGeometry(geometry.lat, geometry.lon + 1.0, geometry.node_type, geometry.obstacle_type,
+                                         geometry.stop_ref)
+        distant_route = route.model_copy(update={'id': '2', 'geometry': distant_geometry})
+        empty_route = route.model_copy(update={'id': '3', 'geometry': RouteGeometryBuilder().build()})
+        tile_source = VectorTileSource.build([route, distant_route, empty_route], self.STOPS)
+
+        projection = self.projection_at(16, 60.0, 30.0)
+        bbox = projection.bbox(buffer=64)
+        assert [route.id for route in tile_source.routes_in_bbox(bbox)] == ['1']
+        assert [stop.id for stop in tile_source.stops_in_bbox(bbox)] == ['1']
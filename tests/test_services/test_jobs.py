@@ -0,0 +1,137 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+import pytest_asyncio
+
+from app.jobs import JobManager, add_progress_steps, current_job_id, track_progress
+from app.process_pool import run_in_process_pool, shutdown_process_pool
+from app.schemas.enums import JobType, JobStatus
+
+
+def sleeping_job(seconds: float) -> float:
+    # Длительные вычисления в пуле процессов
+    time.sleep(seconds)
+    return seconds
+
+
+def progress_job(steps: int, job_id: str | None) -> int:
+    # Вычисления в пуле процессов с передачей прогресса выполнения после каждого шага
+    return sum(track_progress(range(steps), job_id))
+
+
+@pytest_asyncio.fixture
+async def fresh_process_pool():
+    # Пересоздание общего пула процессов (процессы пула получают очередь сообщений о прогрессе при запуске)
+    await shutdown_process_pool()
+    yield
+    await shutdown_process_pool()
+
+
+async def wait_finished(job_manager: JobManager, job_id: str):
+    """ Ожидание завершения задачи """
+    await asyncio.wait_for(job_manager.get(job_id).task, timeout=30)
+
+
+@pytest.mark.asyncio
+class TestJobs:
+
+    async def test_jobs_queue(self):
+        """ Тест очереди задач (ограничение количества одновременно выполняемых задач, результат и ошибки) """
+
+        job_manager = JobManager(max_concurrent=1, history_size=10, ttl=3600)
+        release = asyncio.Event()
+
+        async def blocking_job():
+            await release.wait()
+            return 'done'
+
+        async def failing_job():
+            raise ValueError('Test failure')
+
+        first_job = job_manager.submit(JobType.BUS_DATA, blocking_job)
+        second_job = job_manager.submit(JobType.BUS_DATA, failing_job)
+        await asyncio.sleep(0)
+
+        # Вторая задача ожидает завершения первой
+        assert first_job.status is JobStatus.RUNNING and second_job.status is JobStatus.PENDING
+
+        release.set()
+        await wait_finished(job_manager, first_job.id)
+        await wait_finished(job_manager, second_job.id)
+        assert first_job.status is JobStatus.COMPLETED and first_job.result == 'done'
+        assert first_job.as_schema().progress == 1.0
+        assert second_job.status is JobStatus.FAILED and second_job.error == 'Test failure'
+
+    async def test_job_cancellation(self):
+        """ Тест отмены задачи """
+
+        job_manager = JobManager(max_concurrent=1, history_size=10, ttl=3600)
+        job = job_manager.submit(JobType.SPEED_PROFILE, asyncio.Event().wait)
+        await asyncio.sleep(0)
+
+        job_manager.cancel(job.id)
+        await wait_finished(job_manager, job.id)
+        assert job_manager.get(job.id).as_schema().status is JobStatus.CANCELLED
+
+    async def test_job_cancellation_pool_work(self, fresh_process_pool):
+        """ Тест отмены задачи, вычисления которой выполняются в пуле процессов """
+
+        job_manager = JobManager(max_concurrent=1, history_size=10, ttl=3600)
+        job = job_manager.submit(JobType.SPEED_PROFILE, lambda: run_in_process_pool(sleeping_job, 1.0))
+        for _ in range(100):
+            if job.pool_futures and all(future.running() for future in job.pool_futures):
+                break
+            await asyncio.sleep(0.01)
+
+        # До завершения выполняющихся вычислений задача не считается отменённой
+        assert job_manager.cancel(job.id).status is JobStatus.CANCELLING
+        await asyncio.sleep(0.1)
+        assert job.status is JobStatus.CANCELLING and not job.is_finished
+
+        await wait_finished(job_manager, job.id)
+        assert job.status is JobStatus.CANCELLED and not job.pool_futures
+
+    async def test_finished_jobs_eviction(self):
+        """ Тест удаления завершённых задач из реестра по времени хранения """
+
+        job_manager = JobManager(max_concurrent=1, history_size=10, ttl=60)
+
+        async def finished_job():
+            return 'done'
+
+        old_job = job_manager.submit(JobType.BUS_DATA, finished_job)
+        new_job = job_manager.submit(JobType.BUS_DATA, finished_job)
+        await wait_finished(job_manager, old_job.id)
+        await wait_finished(job_manager, new_job.id)
+        old_job.finished_at -= timedelta(seconds=61)
+
+        # Задача, хранящаяся дольше ttl секунд, удаляется при обращении к реестру
+        assert job_manager.get(old_job.id) is None
+        assert job_manager.get_all() == [new_job]
+
+    async def test_job_progress(self, fresh_process_pool):
+        """ Тест передачи прогресса выполнения задачи из процессов общего пула """
+
+        job_manager = JobManager(max_concurrent=1, history_size=10, ttl=3600)
+        release = asyncio.Event()
+
+        async def job():
+            add_progress_steps(10)
+            result = await run_in_process_pool(progress_job, 5, current_job_id())
+            await release.wait()
+            return result
+
+        job = job_manager.submit(JobType.SPEED_PROFILE, job)
+
+        # Сообщения о прогрессе поступают из процесса пула с задержкой
+        for _ in range(100):
+            if job_manager.get(job.id).done_steps == 5:
+                break
+            await asyncio.sleep(0.1)
+        assert job.as_schema().progress == 0.5
+
+        release.set()
+        await wait_finished(job_manager, job.id)
+        assert job.result == 10
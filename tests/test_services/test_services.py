@@ -1,10 +1,24 @@
+from datetime import datetime, timezone
+
 import pytest
+import pytest_asyncio
 
+from app.process_pool import shutdown_process_pool
 from app.schemas.enums import BusDataProvider
 from app.services.bus_data.osm.osm_bus_data_provider import OSMBusDataProvider
+from app.services.bus_data.osm.route_pairing import RoutePairingIndex
+from config import app_config
 from tests.test_services.bus_data.overpass_api_mock import OverpassApiMock
 
 
+@pytest_asyncio.fixture
+async def fresh_process_pool():
+    # Пересоздание общего пула процессов (новые процессы наследуют изменения, внесённые в рамках теста)
+    await shutdown_process_pool()
+    yield
+    await shutdown_process_pool()
+
+
 @pytest.mark.asyncio
 class TestBusDataService:
 
@@ -69,6 +83,13 @@ class TestBusDataService:
         assert len(route.stops) == 3
         assert len(route.geometry) == 7
 
+        # Сегменты маршрута (участки между соседними остановками)
+        assert [(segment.stop_from_id, segment.stop_to_id) for segment in route.segments] == [('1', '3'), ('3', '5')]
+        assert [segment.roundabouts for segment in route.segments] == [1, 0]
+        assert sum(segment.distance for segment in route.segments) == pytest.approx(
+            route.geometry.edge_distances().sum()
+        )
+
     @pytest.mark.asyncio
     async def test_load_osm_missing_data_routes(self):
         """ Тест получения данных о маршрутах OSM (усложненный сценарий для проверки восстановления данных) """
@@ -118,3 +139,165 @@ class TestBusDataService:
         route = routes[0]
         assert route.name == 'Маршрут 1'
         assert len(route.stops) == 8
+
+    @pytest.mark.asyncio
+    async def test_load_osm_routes_failed_extraction(self, monkeypatch, fresh_process_pool):
+        """ Тест получения данных о маршрутах OSM (ошибка построения одного из маршрутов в пуле процессов) """
+        extract_route_stops_and_geometry = OSMBusDataProvider._OSMBusDataProvider__extract_route_stops_and_geometry
+
+        def failing_extract_route_stops_and_geometry(route_relation, route_raw_data):
+            if route_relation.id == 2:
+                raise ValueError("Test failure")
+            return extract_route_stops_and_geometry(route_relation, route_raw_data)
+
+        monkeypatch.setattr(OSMBusDataProvider, '_OSMBusDataProvider__extract_route_stops_and_geometry',
+                            staticmethod(failing_extract_route_stops_and_geometry))
+
+        overpass_api_mock = OverpassApiMock()
+        overpass_api_mock.load_base_routes()
+        bbox = (30.37230429715162, 59.99280989676329, 30.39241435827749, 60.00717280149259)
+
+        routes = await OSMBusDataProvider(overpass_api_mock=overpass_api_mock).get_routes_in_bbox(bbox)
+        assert len(routes) == 1
+
+        # Маршрут, построение которого завершилось ошибкой, отбрасывается (пара маршрутов не объединяется)
+        route = routes[0]
+        assert route.id == '1'
+        assert route.final_stop_order is None
+        assert len(route.stops) == 4
+
+    @pytest.mark.asyncio
+    async def test_load_osm_routes_failed_build(self, monkeypatch, fresh_process_pool):
+        """ Тест получения данных о маршрутах OSM (ошибка построения итогового маршрута в пуле процессов) """
+
+        def failing_construct_route_segments(stops, geometry):
+            raise ValueError("Test failure")
+
+        monkeypatch.setattr(OSMBusDataProvider, 'construct_route_segments',
+                            staticmethod(failing_construct_route_segments))
+
+        overpass_api_mock = OverpassApiMock()
+        overpass_api_mock.load_base_routes()
+        bbox = (30.37230429715162, 59.99280989676329, 30.39241435827749, 60.00717280149259)
+
+        # Маршрут, построение которого завершилось ошибкой, пропускается (как и при ошибке извлечения)
+        routes = await OSMBusDataProvider(overpass_api_mock=overpass_api_mock).get_routes_in_bbox(bbox)
+        assert routes == []
+
+    @pytest.mark.asyncio
+    async def test_load_osm_routes_single_worker(self, monkeypatch, fresh_process_pool):
+        """ Тест получения данных о маршрутах OSM (пул из одного процесса) """
+        monkeypatch.setattr(app_config, 'PROCESS_POOL_WORKERS_NUM', 1)
+
+        overpass_api_mock = OverpassApiMock()
+        overpass_api_mock.load_base_routes()
+        bbox = (30.37230429715162, 59.99280989676329, 30.39241435827749, 60.00717280149259)
+
+        routes = await OSMBusDataProvider(overpass_api_mock=overpass_api_mock).get_routes_in_bbox(bbox)
+        assert len(routes) == 1
+
+        route = routes[0]
+        assert route.name == 'Маршрут 1'
+        assert len(route.stops) == 8
+
+    @pytest.mark.asyncio
+    async def test_load_osm_route_master_routes(self, monkeypatch, fresh_process_pool):
+        """ Тест получения данных о маршрутах OSM (объединение направлений по мастер-маршруту) """
+
+        # Направления мастер-маршрута объединяются без геометрического сопоставления
+        def failing_frechet_distances(self, route_pairs):
+            raise AssertionError("Geometric matching is not expected")
+
+        monkeypatch.setattr(RoutePairingIndex, 'frechet_distances', failing_frechet_distances)
+
+        overpass_api_mock = OverpassApiMock()
+        overpass_api_mock.load_route_master_routes()
+        bbox = (30.37230429715162, 59.99280989676329, 30.39241435827749, 60.00717280149259)
+
+        routes = await OSMBusDataProvider(overpass_api_mock=overpass_api_mock).get_routes_in_bbox(bbox)
+        assert len(routes) == 1
+
+        route = routes[0]
+        assert route.name == 'Маршрут 1'
+        assert route.final_stop_order == 3
+        assert len(route.stops) == 8
+
+    @pytest.mark.asyncio
+    async def test_iter_osm_routes(self):
+        """ Тест последовательного получения маршрутов OSM (для потоковой передачи) """
+        overpass_api_mock = OverpassApiMock()
+        overpass_api_mock.load_base_routes()
+        bbox = (30.37230429715162, 59.99280989676329, 30.39241435827749, 60.00717280149259)
+
+        provider = OSMBusDataProvider(overpass_api_mock=overpass_api_mock)
+        routes_iterator = provider.iter_routes_in_bbox(bbox)
+
+        route = await anext(routes_iterator)
+        assert route.name == 'Маршрут 1'
+        assert route.final_stop_order == 3
+        assert len(route.stops) == 8
+
+        # Результаты совпадают с полным получением маршрутов
+        with pytest.raises(StopAsyncIteration):
+            await anext(routes_iterator)
+        assert await provider.get_routes_in_bbox(bbox) == [route]
+
+    @pytest.mark.asyncio
+    async def test_iter_osm_routes_local_mapping(self, monkeypatch, fresh_process_pool):
+        """ Тест последовательного получения маршрутов OSM (маршрут заранее синхронизирован с локальной БД) """
+        overpass_api_mock = OverpassApiMock()
+        overpass_api_mock.load_base_routes()
+        bbox = (30.37230429715162, 59.99280989676329, 30.39241435827749, 60.00717280149259)
+
+        routes = await OSMBusDataProvider(overpass_api_mock=overpass_api_mock).get_routes_in_bbox(bbox)
+        local_route = routes[0].model_copy(update={'name': 'Локальный маршрут'})
+        await shutdown_process_pool()
+
+        # Синхронизированные маршруты не строятся повторно
+        def failing_build_route_job(route, paired_route=None):
+            raise AssertionError("Route building is not expected")
+
+        monkeypatch.setattr(OSMBusDataProvider, 'build_route_job', staticmethod(failing_build_route_job))
+
+        provider = OSMBusDataProvider(local_routes_mapping={local_route.id: local_route},
+                                      overpass_api_mock=overpass_api_mock)
+        routes = [route async for route in provider.iter_routes_in_bbox(bbox)]
+        assert routes == [local_route]
+
+        # Синхронизированные маршруты и остановки запрашиваются по id объектов OSM из ответа Overpass API
+        class LocalDataProviderMock:
+            def __init__(self):
+                self.requested_stops_ids, self.requested_routes_ids = [], []
+
+            async def get_stops_by_external_ids(self, external_ids):
+                self.requested_stops_ids.extend(external_ids)
+                return {}
+
+            async def get_routes_by_external_ids(self, external_ids):
+                self.requested_routes_ids.extend(external_ids)
+                return {local_route.id: local_route}
+
+        local_data_provider = LocalDataProviderMock()
+        provider = OSMBusDataProvider(overpass_api_mock=overpass_api_mock, local_data_provider=local_data_provider)
+        routes = [route async for route in provider.iter_routes_in_bbox(bbox)]
+        assert routes == [local_route]
+        assert local_data_provider.requested_routes_ids == [local_route.id]
+        assert {stop.id for stop in local_route.stops} <= set(local_data_provider.requested_stops_ids)
+
+    async def test_osm_routes_changes(self):
+        """ Тест определения удалённых и изменённых маршрутов OSM для инкрементальной синхронизации """
+        overpass_api_mock = OverpassApiMock()
+        overpass_api_mock.load_routes_changes()
+
+        provider = OSMBusDataProvider(overpass_api_mock=overpass_api_mock)
+        existing_ids, changed_ids, route_masters = await provider.get_routes_changes(
+            [1, 3, 4], datetime(2025, 1, 1, tzinfo=timezone.utc)
+        )
+
+        assert existing_ids == {1, 2, 3}
+        assert changed_ids == {2}
+        assert route_masters == {10: [1, 2]}
+
+        # Маршрут перестраивается при изменении другого направления того же мастер-маршрута
+        assert provider.affected_routes([1, 3], changed_ids, route_masters) == [1]
+        assert provider.affected_routes([1, 3], {3}, route_masters) == [3]
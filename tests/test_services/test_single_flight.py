@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from app.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+class TestSingleFlight:
+
+    async def test_concurrent_calls_coalesced(self):
+        """ Тест объединения одновременных одинаковых операций """
+
+        single_flight = SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def operation(value: int) -> int:
+            calls.append(value)
+            await release.wait()
+            return value * 2
+
+        # Одновременные операции с одинаковым ключом выполняются один раз, с разными ключами - отдельно
+        waiters = [asyncio.create_task(single_flight.run(('key', 1), lambda: operation(1))) for _ in range(5)]
+        other_waiter = asyncio.create_task(single_flight.run(('key', 2), lambda: operation(2)))
+        await asyncio.sleep(0)
+        assert len(single_flight) == 2
+
+        release.set()
+        assert await asyncio.gather(*waiters) == [2] * 5 and await other_waiter == 4
+        assert sorted(calls) == [1, 2] and len(single_flight) == 0
+
+        # Завершённая операция при следующем вызове выполняется повторно
+        assert await single_flight.run(('key', 1), lambda: operation(1)) == 2
+        assert len(calls) == 3
+
+    async def test_error_and_cancellation(self):
+        """ Тест передачи исключения всем ожидающим и отмены одного из ожидающих """
+
+        single_flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def failing_operation():
+            await release.wait()
+            raise ValueError('Test failure')
+
+        waiters = [asyncio.create_task(single_flight.run('key', failing_operation)) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        # Отмена одного из ожидающих не прерывает операцию для остальных
+        waiters[0].cancel()
+        await asyncio.sleep(0)
+        assert len(single_flight) == 1
+
+        release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError)
+        assert all(isinstance(result, ValueError) for result in results[1:])
+        assert len(single_flight) == 0
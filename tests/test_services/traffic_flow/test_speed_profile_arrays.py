@@ -0,0 +1,43 @@
+import math
+
+from app.schemas.enums import Weekday
+from app.services.traffic_flow.speed_profile_arrays import SpeedProfileArrays, HOURS
+
+
+class TestSpeedProfileArrays:
+
+    def test_slice(self):
+        """ Тест построения плотного массива скоростей профиля и получения среза по маршрутам и интервалу часов """
+
+        # Маршрут 'a' из двух сегментов, маршрут 'b' из одного сегмента (заданы не все дни недели)
+        rows = [
+            (route_id, weekday, hour, segment_order, float(100 * weekday + hour + 0.5 * segment_order))
+            for route_id, segments_num, weekdays in (('a', 2, range(len(Weekday))), ('b', 1, [0]))
+            for weekday in weekdays
+            for hour in range(HOURS)
+            for segment_order in range(segments_num)
+        ]
+        speed_profile_arrays = SpeedProfileArrays.from_rows(rows)
+        assert speed_profile_arrays.speeds.shape == (len(Weekday), HOURS, 3)
+
+        # Срез содержит скорости сегментов по часам интервала, маршруты не из профиля пропускаются
+        routes_speeds = speed_profile_arrays.slice(['b', 'a', 'c'], Weekday.TUESDAY, 7, 9)
+        assert list(routes_speeds) == ['b', 'a']
+        assert routes_speeds['a'] == [[107.0, 107.5], [108.0, 108.5], [109.0, 109.5]]
+
+        # Отсутствующие в профиле значения равны NaN
+        assert len(routes_speeds['b']) == 3 and all(math.isnan(speeds[0]) for speeds in routes_speeds['b'])
+        assert speed_profile_arrays.slice(['b'], Weekday.MONDAY, 23, 23) == {'b': [[23.0]]}
+
+    def test_sparse_segments_orders(self):
+        """ Тест назначения столбцов сегментам с пропусками в порядковых номерах """
+
+        # Порядковые номера сегментов маршрута 'a' идут с пропуском, маршрут 'b' не начинается с нулевого сегмента
+        rows = [('a', 0, 0, 0, 10.0), ('a', 0, 0, 2, 12.0), ('b', 0, 0, 3, 23.0), ('b', 0, 0, 4, 24.0)]
+        speed_profile_arrays = SpeedProfileArrays.from_rows(rows)
+
+        # Массив не содержит пустых столбцов, сегменты маршрутов располагаются в порядке номеров
+        assert speed_profile_arrays.speeds.shape == (len(Weekday), HOURS, 4)
+        assert speed_profile_arrays.slice(['a', 'b'], Weekday.MONDAY, 0, 0) == \
+               {'a': [[10.0, 12.0]], 'b': [[23.0, 24.0]]}
+        assert SpeedProfileArrays.from_rows([]).slice(['a'], Weekday.MONDAY, 0, 23) == {}
@@ -0,0 +1,82 @@
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from haversine import haversine, Unit
+
+from app.schemas.enums import RouteObstacleType
+from app.schemas.route_geometry import RouteGeometryBuilder
+from app.services.traffic_flow.tomtom.tomtom_traffic_flow_provider import TomtomTrafficFlowProvider, DEFAULT_SPEED
+
+
+def reference_segment_speeds(geometry, edge_speeds):
+    """ Поузловой расчёт средних скоростей на участках маршрута для одного временного интервала """
+    nodes = geometry.to_nodes()
+    segments_speeds = []
+    segment_distance = 0
+    segment_time = 0
+    for i, (node1, node2) in enumerate(zip(nodes, nodes[1:])):
+        dist = haversine((node1.lat, node1.lon), (node2.lat, node2.lon), Unit.KILOMETERS)
+        if i >= geometry.stop_position_indices[0] and dist > 0:
+            segment_distance += dist
+            segment_time += dist / edge_speeds[i]
+        if node2.type.value == 'stop_position':
+            segments_speeds.append(segment_distance / segment_time)
+            segment_distance = 0
+            segment_time = 0
+    return segments_speeds
+
+
+class TestTomtomTrafficFlowProvider:
+
+    def test_aggregate_segment_speeds(self):
+        """ Тест пакетного расчёта средних скоростей на участках маршрута для всех временных интервалов """
+
+        rng = random.Random(1)
+
+        builder = RouteGeometryBuilder()
+        lat = 60.0
+        for i in range(30):
+            lat += rng.uniform(0.0005, 0.002)
+            if i % 7 == 0:
+                builder.add_stop_position(lat, 30.0, str(i))
+            elif i % 5 == 0:
+                builder.add_obstacle(lat, 30.0, RouteObstacleType.CROSSING)
+            else:
+                builder.add_node(lat, 30.0)
+        geometry = builder.build()
+
+        # Скорости на рёбрах для 168 часовых интервалов недели
+        edge_speeds = np.array([[rng.uniform(5, 60) for _ in range(168)] for _ in range(len(geometry) - 1)])
+
+        segment_speeds = TomtomTrafficFlowProvider.aggregate_segment_speeds(geometry, edge_speeds)
+        assert segment_speeds.shape == (len(geometry.stop_position_indices) - 1, 168)
+
+        for hour in (0, 17, 167):
+            assert segment_speeds[:, hour] == pytest.approx(reference_segment_speeds(geometry, edge_speeds[:, hour]))
+
+    def test_aggregate_segment_speeds_zero_length(self):
+        """ Тест расчёта средней скорости на участке нулевой протяжённости """
+
+        builder = RouteGeometryBuilder()
+        builder.add_stop_position(60.0, 30.0, '1')
+        builder.add_stop_position(60.0, 30.0, '2')
+        builder.add_stop_position(60.001, 30.0, '3')
+        geometry = builder.build()
+
+        segment_speeds = TomtomTrafficFlowProvider.aggregate_segment_speeds(geometry, np.full((2, 3), 20.0))
+        assert segment_speeds[0].tolist() == [DEFAULT_SPEED] * 3
+        assert segment_speeds[1] == pytest.approx([20.0] * 3)
+
+    def test_get_routes_bounds(self):
+        """ Тест расчёта ограничивающей рамки геометрии маршрутов """
+
+        routes = []
+        for points in ([(60.0, 30.2), (60.1, 30.1)], [(59.9, 30.3)], []):
+            builder = RouteGeometryBuilder()
+            for lat, lon in points:
+                builder.add_node(lat, lon)
+            routes.append(SimpleNamespace(geometry=builder.build()))
+
+        assert TomtomTrafficFlowProvider.get_routes_bounds(routes) == (30.1, 59.9, 30.3, 60.1)
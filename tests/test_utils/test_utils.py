@@ -1,8 +1,10 @@
 import math
 
+import numpy as np
 import pytest
 
-from app.utils import Point, project_point_on_segment, utm_point_from_latlon
+from app.utils import Point, project_point_on_segment, utm_point_from_latlon, utm_frechet_distance, encode_polyline, \
+    decode_polyline
 
 
 class TestUtils:
@@ -44,6 +46,31 @@ class TestUtils:
         assert abs(gt_distance - distance) < self.EPS
         assert self.points_are_equal(projected_point, gt_projected_point)
 
+    def test_utm_frechet_distance(self):
+        """ Тест расчёта расстояния Фреше (ломанные в системе координат UTM) """
+
+        polyline = [(0, 0), (100, 0), (200, 0)]
+        shifted_polyline = [(0, 30), (100, 30), (200, 30)]
+
+        assert utm_frechet_distance(polyline, polyline) == 0
+        assert abs(utm_frechet_distance(polyline, shifted_polyline) - 30) < 10e-6
+        assert abs(utm_frechet_distance(polyline, polyline[::-1]) - 200) < 10e-6
+
+    def test_encode_polyline(self):
+        """ Тест кодирования последовательности чисел в формате Encoded Polyline """
+
+        # Пример из описания формата: (38.5, -120.2), (40.7, -120.95), (43.252, -126.453) с точностью 5 знаков
+        values = [3850000, -12020000, 220000, -75000, 255200, -550300]
+        polyline = encode_polyline(values)
+
+        assert polyline == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+        assert decode_polyline(polyline).tolist() == values
+        assert encode_polyline([]) == '' and len(decode_polyline('')) == 0
+
+        # Большие по модулю значения (более 6 блоков по 5 бит)
+        values = np.array([0, 1, -1, 2 ** 40, -2 ** 40])
+        assert decode_polyline(encode_polyline(values)).tolist() == values.tolist()
+
     @classmethod
     def points_are_equal(cls, point1: Point, point2: Point) -> bool:
         utm_point1 = utm_point_from_latlon(point1[0], point1[1])